@@ -6,10 +6,19 @@ CORS FIXED VERSION
 
 from fastapi import FastAPI, HTTPException, Depends, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Optional, Literal
+import asyncio
+import logging
+from functools import cached_property
+import os
 import time
+import httpx
+import numpy as np
+import orjson
+from cachetools import TTLCache
 
 from typing import List, Dict
 
@@ -17,17 +26,31 @@ from services.csv_parser import NAMASTEParser
 from services.icd11_client import ICD11Client
 from services.mapping_engine import MappingEngine
 from services.fhir_generator import FHIRGenerator
-from services.ml_matcher import SemanticMatcher
+from services.ml_matcher import ML_MATCHER_DISABLED, SemanticMatcher
 from services.audit_service import AuditService
 from services.abha_auth import ABHAAuthService, AuthMiddleware
 
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # Falls back to gzip-only compression
+    BrotliMiddleware = None
+
+try:
+    import h2
+except ImportError:  # ICD-11 calls use HTTP/1.1 keep-alive connections instead
+    h2 = None
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger("ayush")
+
 # Initialize FastAPI app
 app = FastAPI(
     title="AYUSH Terminology Bridge API",
     description="FHIR-compliant API for NAMASTE-ICD11 mapping with ABHA authentication",
     version="2.0.0",
     docs_url="/api/docs",
-    redoc_url="/api/redoc"
+    redoc_url="/api/redoc",
+    default_response_class=ORJSONResponse
 )
 
 # ============= CORS FIX - CRITICAL =============
@@ -39,61 +62,257 @@ app.add_middleware(
         "http://localhost:8080",
         "http://127.0.0.1:3000",
         "http://127.0.0.1:8080",
-        "null",  # For file:// protocol during development
-        "*"  # Allow all origins in development (remove in production!)
-    ],
+        "null"  # For file:// protocol during development
+    ],  # Explicit list: browsers reject "*" when credentials are allowed
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["*"]  # Important: expose response headers to frontend
+    expose_headers=["*"],  # Important: expose response headers to frontend
+    max_age=3600  # Let browsers cache preflight results
 )
 
-# Initialize services
-print("🔄 Initializing services...")
-namaste_parser = NAMASTEParser('data/namaste_sample.csv')
-namaste_parser.load_csv()
-print(f"✅ Loaded {len(namaste_parser.codes)} NAMASTE codes")
-
-icd_client = ICD11Client('config/icd11_credentials.json')
-print("✅ ICD-11 client initialized")
-
-mapping_engine = MappingEngine('data/concept_mappings.json', icd_client, namaste_parser)
-print("✅ Mapping engine ready")
+# Compress large JSON payloads (value sets, audit logs, dashboards)
+if BrotliMiddleware is not None:
+    # Serves br to browsers that accept it and gzip to everyone else
+    app.add_middleware(BrotliMiddleware, quality=4, minimum_size=1024)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+ANN_INDEX_PATH = 'ml_models/namaste_hnsw.index'
+CATALOG_EMBEDDINGS_PATH = 'ml_models/namaste_embeddings.npy'
+
+# Number of binary-ranked search results rescored with full-precision embeddings
+ML_RESCORE_TOP_K = 5
+
+# "readonly" workers skip warming the ML model; it still loads on first use
+WORKER_ROLE = os.environ.get("WORKER_ROLE", "full")
+
+class AppContext:
+    """Services are built on first access so importing this module stays cheap"""
+    
+    def __init__(self):
+        # Created inside the running loop by load_ml_matcher
+        self._ml_matcher_lock: Optional[asyncio.Lock] = None
+    
+    @cached_property
+    def namaste_parser(self) -> NAMASTEParser:
+        parser = NAMASTEParser('data/namaste_sample.csv')
+        parser.load_csv()
+        logger.info("Loaded %d NAMASTE codes", len(parser.codes))
+        return parser
+    
+    @cached_property
+    def icd_client(self) -> ICD11Client:
+        client = ICD11Client('config/icd11_credentials.json')
+        logger.info("ICD-11 client initialized")
+        return client
+    
+    @cached_property
+    def mapping_engine(self) -> MappingEngine:
+        engine = MappingEngine('data/concept_mappings.json', self.icd_client, self.namaste_parser)
+        logger.info("Mapping engine ready")
+        return engine
+    
+    @cached_property
+    def fhir_gen(self) -> FHIRGenerator:
+        return FHIRGenerator()
+    
+    @cached_property
+    def ml_matcher(self) -> SemanticMatcher:
+        """Load the model and build the embedding matrix, binary and ANN indexes over NAMASTE displays"""
+        matcher = SemanticMatcher()
+        parser = self.namaste_parser
+        codes = [c['code'] for c in parser.codes]
+        displays = [c['display'] for c in parser.codes]
+        embeddings = matcher.build_catalog_embeddings(codes, displays, CATALOG_EMBEDDINGS_PATH,
+                                                      source_path=parser.csv_path)
+        matcher.build_binary_index(codes, displays, embeddings)
+        
+        if not parser.load_ann_index(ANN_INDEX_PATH, embeddings.shape[1]):
+            parser.build_ann_index(embeddings, ANN_INDEX_PATH)
+        if parser.ann_index is not None:
+            logger.info("NAMASTE ANN index ready")
+        
+        # Every ICD-11 target in the predefined mappings, encoded once for ML re-ranking
+        icd_entries = {}
+        for mapping in self.mapping_engine.predefined_mappings:
+            for match in mapping.get('icd11_tm2', []) + mapping.get('icd11_mms', []):
+                icd_entries.setdefault(match.get('code'), match)
+        matcher.build_catalog(list(icd_entries.values()))
+        logger.info("ML matcher initialized")
+        return matcher
+    
+    @cached_property
+    def audit_service(self) -> AuditService:
+        return AuditService()
+    
+    @cached_property
+    def auth_service(self) -> ABHAAuthService:
+        return ABHAAuthService()
+    
+    @cached_property
+    def auth_middleware(self) -> AuthMiddleware:
+        return AuthMiddleware(self.auth_service)
+    
+    async def load_ml_matcher(self) -> SemanticMatcher:
+        """
+        ml_matcher for async handlers: the first call builds it on a worker
+        thread (model load, catalogue encoding, indexes) so the event loop
+        keeps serving; concurrent first callers wait for that one build
+        """
+        if not self.is_loaded('ml_matcher'):
+            if self._ml_matcher_lock is None:
+                self._ml_matcher_lock = asyncio.Lock()
+            async with self._ml_matcher_lock:
+                if not self.is_loaded('ml_matcher'):
+                    await asyncio.to_thread(lambda: self.ml_matcher)
+        return self.ml_matcher
+    
+    def is_loaded(self, name: str) -> bool:
+        return name in self.__dict__
+
+ctx = AppContext()
+
+@app.on_event("startup")
+def warm_services():
+    """Build the services this worker's role needs before serving traffic"""
+    ctx.mapping_engine
+    ctx.fhir_gen
+    ctx.audit_service
+    ctx.auth_middleware
+    if WORKER_ROLE != "readonly" and not ML_MATCHER_DISABLED:
+        ctx.ml_matcher
+    logger.info("Services ready (role: %s)", WORKER_ROLE)
+
+async def _refresh_icd_token_loop():
+    """Keep the ICD-11 OAuth token warm so requests never fetch it inline"""
+    while True:
+        try:
+            expires_in = await ctx.icd_client.refresh_token(app.state.http_client)
+            delay = max(expires_in - 60, 60)
+        except Exception:
+            logger.exception("ICD-11 token refresh failed")
+            delay = 60
+        await asyncio.sleep(delay)
+
+@app.on_event("startup")
+async def open_http_client():
+    """Create the shared, pooled async HTTP client used for ICD-11 calls"""
+    app.state.http_client = httpx.AsyncClient(
+        timeout=15,
+        http2=h2 is not None,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=32)
+    )
+    app.state.icd_token_task = asyncio.create_task(_refresh_icd_token_loop())
 
-fhir_gen = FHIRGenerator()
-print("✅ FHIR generator ready")
+@app.on_event("shutdown")
+async def close_http_client():
+    app.state.icd_token_task.cancel()
+    await app.state.http_client.aclose()
 
-ml_matcher = SemanticMatcher()
-print("✅ ML matcher initialized")
+# ============= BACKGROUND AUDIT WRITER =============
 
-audit_service = AuditService()
-print("✅ Audit service ready")
+AUDIT_QUEUE_SIZE = 10000
+AUDIT_BATCH_SIZE = 500
+AUDIT_FLUSH_INTERVAL_SECONDS = 0.1
 
-auth_service = ABHAAuthService()
-auth_middleware = AuthMiddleware(auth_service)
-print("✅ ABHA authentication ready")
+def enqueue_audit(row: Dict):
+    """Queue an API call log (log_api_call kwargs); drop it if the queue is full"""
+    try:
+        app.state.audit_q.put_nowait(row)
+    except asyncio.QueueFull:
+        app.state.audit_dropped += 1
+
+# Queued by stop_audit_writer; the drain writes the batch it holds, then exits
+_AUDIT_STOP = None
+
+async def _audit_drain():
+    """Batch queued audit rows into one DB write per flush interval"""
+    queue = app.state.audit_q
+    loop = asyncio.get_running_loop()
+    
+    stopping = False
+    while not stopping:
+        row = await queue.get()
+        if row is _AUDIT_STOP:
+            return
+        rows = [row]
+        deadline = loop.time() + AUDIT_FLUSH_INTERVAL_SECONDS
+        while len(rows) < AUDIT_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                row = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if row is _AUDIT_STOP:
+                stopping = True
+                break
+            rows.append(row)
+        
+        try:
+            await asyncio.to_thread(ctx.audit_service.bulk_insert, rows)
+        except Exception:
+            logger.exception("Failed to write %d audit rows", len(rows))
+
+# Repeat searches/translations within this window are written as one row with a hit count
+LOG_AGGREGATE_INTERVAL_SECONDS = 1.0
+
+async def _aggregate_flush_loop():
+    while True:
+        await asyncio.sleep(LOG_AGGREGATE_INTERVAL_SECONDS)
+        try:
+            await asyncio.to_thread(ctx.audit_service.flush_aggregated)
+        except Exception:
+            logger.exception("Failed to write aggregated search/translation logs")
+
+@app.on_event("startup")
+async def start_audit_writer():
+    app.state.audit_q = asyncio.Queue(maxsize=AUDIT_QUEUE_SIZE)
+    app.state.audit_dropped = 0
+    app.state.audit_task = asyncio.create_task(_audit_drain())
+    app.state.aggregate_task = asyncio.create_task(_aggregate_flush_loop())
+
+@app.on_event("shutdown")
+async def stop_audit_writer():
+    """Stop the writer and flush anything still queued"""
+    # Not cancelled: the drain may hold a dequeued batch, which it writes before exiting
+    await app.state.audit_q.put(_AUDIT_STOP)
+    await app.state.audit_task
+    app.state.aggregate_task.cancel()
+    ctx.audit_service.flush_aggregated()
+    # Rows enqueued after the stop marker
+    queue = app.state.audit_q
+    rows = [queue.get_nowait() for _ in range(queue.qsize())]
+    ctx.audit_service.bulk_insert(rows)
+    ctx.audit_service.flush()
 
 # Request/Response Models
-class LoginRequest(BaseModel):
-    user_id: str = Field(..., example="DR001")
-    password: str = Field(..., example="demo_password")
+class APIModel(BaseModel):
+    """Base for request bodies: ignore unknown fields, skip re-validation on assignment"""
+    model_config = ConfigDict(extra='ignore', validate_assignment=False)
 
-class SearchRequest(BaseModel):
-    query: str = Field(..., example="diabetes")
+class LoginRequest(APIModel):
+    user_id: str = Field(..., json_schema_extra={'example': "DR001"})
+    password: str = Field(..., json_schema_extra={'example': "demo_password"})
+
+class SearchRequest(APIModel):
+    query: str = Field(..., json_schema_extra={'example': "diabetes"})
     limit: Optional[int] = Field(10, ge=1, le=50)
     use_ml: Optional[bool] = Field(True, description="Use ML semantic matching")
 
-class TranslateRequest(BaseModel):
-    namaste_code: str = Field(..., example="NAM0004")
+class TranslateRequest(APIModel):
+    namaste_code: str = Field(..., json_schema_extra={'example': "NAM0004"})
     use_ml: Optional[bool] = Field(True, description="Use ML hybrid matching")
 
-class ConditionRequest(BaseModel):
-    namaste_code: str = Field(..., example="NAM0004")
-    icd_codes: List[str] = Field(..., example=["TM2.7", "5A00"])
-    patient_id: str = Field(..., example="PATIENT-001")
-    abha_id: Optional[str] = Field(None, example="12-3456-7890-1234")
+class ConditionRequest(APIModel):
+    namaste_code: str = Field(..., json_schema_extra={'example': "NAM0004"})
+    icd_codes: List[str] = Field(..., json_schema_extra={'example': ["TM2.7", "5A00"]})
+    patient_id: str = Field(..., json_schema_extra={'example': "PATIENT-001"})
+    abha_id: Optional[str] = Field(None, json_schema_extra={'example': "12-3456-7890-1234"})
 
-class FHIRBundleRequest(BaseModel):
+class FHIRBundleRequest(APIModel):
     resource_type: Literal["Bundle"] = "Bundle"
     entries: List[Dict]
 
@@ -107,16 +326,26 @@ async def get_current_user(request: Request, authorization: Optional[str] = Head
     if not authorization:
         raise HTTPException(status_code=401, detail="Authorization header missing")
 
-    user = auth_middleware.authenticate_request(authorization)
+    # Reuse the payload already decoded by the audit middleware
+    user = getattr(request.state, "user", None)
+    if user is None:
+        user = ctx.auth_middleware.authenticate_request(authorization)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
     return user
 
+# Constant header appended to every response, pre-encoded once
+API_VERSION_HEADER = (b"x-api-version", b"2.0.0")
+
 # Middleware for request timing and audit
 @app.middleware("http")
 async def audit_middleware_func(request: Request, call_next):
-    start_time = time.time()
+    # CORS preflights are answered by CORSMiddleware; no auth or audit needed
+    if request.method == 'OPTIONS':
+        return await call_next(request)
+    
+    start_ns = time.perf_counter_ns()
     
     # Extract user info if available
     auth_header = request.headers.get('authorization')
@@ -124,7 +353,8 @@ async def audit_middleware_func(request: Request, call_next):
     user_role = None
     
     if auth_header:
-        user = auth_middleware.authenticate_request(auth_header)
+        user = ctx.auth_middleware.authenticate_request(auth_header)
+        request.state.user = user
         if user:
             user_id = user.get('user_id')
             user_role = user.get('role')
@@ -132,12 +362,12 @@ async def audit_middleware_func(request: Request, call_next):
     # Process request
     response = await call_next(request)
     
-    # Calculate response time
-    response_time = (time.time() - start_time) * 1000
+    # Calculate response time (monotonic clock, immune to wall-clock jumps)
+    response_time = (time.perf_counter_ns() - start_ns) / 1e6
     
     # Log to audit trail (skip health checks and OPTIONS)
-    if not request.url.path.endswith('/health') and request.method != 'OPTIONS':
-        audit_service.log_api_call(
+    if not request.url.path.endswith('/health'):
+        enqueue_audit(dict(
             action_type=f"{request.method}_{request.url.path}",
             user_id=user_id,
             user_role=user_role,
@@ -147,11 +377,11 @@ async def audit_middleware_func(request: Request, call_next):
             user_agent=request.headers.get('user-agent'),
             response_status=response.status_code,
             response_time_ms=response_time
-        )
+        ))
     
     # Add custom headers
-    response.headers["X-Response-Time"] = f"{response_time:.2f}ms"
-    response.headers["X-API-Version"] = "2.0.0"
+    response.headers["X-Response-Time"] = format(response_time, ".2f") + "ms"
+    response.raw_headers.append(API_VERSION_HEADER)
     
     return response
 
@@ -163,16 +393,16 @@ async def login(request: LoginRequest):
     Login with ABHA credentials (mock implementation)
     Returns JWT token for subsequent API calls
     """
-    result = auth_service.generate_mock_abha_token(request.user_id, request.password)
+    result = ctx.auth_service.generate_mock_abha_token(request.user_id, request.password)
     
     if not result:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     # Create session
-    session_id = auth_service.create_session(request.user_id)
+    session_id = ctx.auth_service.create_session(request.user_id)
     result['session_id'] = session_id
     """
-    audit_service.log_api_call(
+    ctx.audit_service.log_api_call(
         action_type="LOGIN",
         user_id=request.user_id,
         endpoint="/api/auth/login",
@@ -190,15 +420,19 @@ async def get_userinfo(current_user: dict = Depends(get_current_user)):
     return current_user
 
 @app.post("/api/auth/logout", tags=["Authentication"])
-async def logout(current_user: dict = Depends(get_current_user)):
+async def logout(
+    authorization: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
     """Logout and invalidate session"""
-    audit_service.log_api_call(
+    ctx.auth_middleware.invalidate(authorization)
+    enqueue_audit(dict(
         action_type="LOGOUT",
         user_id=current_user['user_id'],
         endpoint="/api/auth/logout",
         method="POST",
         response_status=200
-    )
+    ))
     
     return {"message": "Logged out successfully"}
 
@@ -233,25 +467,42 @@ async def search_namaste(
     """
     start_time = time.time()
     
-    # Basic fuzzy search
-    results = namaste_parser.search_codes(q, limit)
-    
-    # Enhanced ML semantic search if requested
-    if use_ml and results:
-        # Use ML matcher to re-rank results
-        enhanced_results = []
-        for result in results:
-            semantic_score = ml_matcher.compute_similarity(q, result['display'])
-            result['semantic_score'] = semantic_score
-            result['combined_score'] = (result['match_score'] + semantic_score) / 2
-            enhanced_results.append(result)
-        
-        enhanced_results.sort(key=lambda x: x['combined_score'], reverse=True)
-        results = enhanced_results
+    if use_ml:
+        await ctx.load_ml_matcher()  # first use builds the binary and ANN indexes
+    
+    if use_ml and ctx.namaste_parser.ann_index is not None:
+        # Semantic retrieval from the ANN index, ranked together with fuzzy scores
+        query_emb = (await asyncio.to_thread(ctx.ml_matcher.encode_batch, [q]))[0]
+        results = ctx.namaste_parser.hybrid_search(q, query_emb, limit)
+    else:
+        # Basic fuzzy search
+        results = ctx.namaste_parser.search_codes(q, limit)
+    
+    # Enhanced ML semantic re-rank if requested and no ANN index is available
+    if use_ml and results and ctx.namaste_parser.ann_index is None:
+        # Coarse re-rank on 1-bit embeddings, then rescore the top few in FP32
+        scores = await asyncio.to_thread(
+            ctx.ml_matcher.binary_similarities, q, [r['code'] for r in results]
+        )
+        top = np.argsort(-scores)[:ML_RESCORE_TOP_K]
+        scores[top] = await asyncio.to_thread(
+            ctx.ml_matcher.score_candidates, q,
+            [results[i]['code'] for i in top], [results[i]['display'] for i in top]
+        )
+        match_scores = np.fromiter((r['match_score'] for r in results), dtype=np.float32, count=len(results))
+        semantic_scores = scores.astype(np.float32)
+        combined = (match_scores + semantic_scores) * 0.5
+        results = [
+            results[i] | {
+                'combined_score': round(float(combined[i]), 4),
+                'semantic_score': round(float(semantic_scores[i]), 4)
+            }
+            for i in np.argsort(-combined, kind='stable')
+        ]
     
     # Log search
     top_result = results[0]['code'] if results else None
-    audit_service.log_search(
+    ctx.audit_service.record_search(
         user_id=current_user['user_id'],
         query=q,
         results_count=len(results),
@@ -260,13 +511,13 @@ async def search_namaste(
     
     response_time = (time.time() - start_time) * 1000
     
-    return {
+    return ORJSONResponse({
         "query": q,
         "results": results,
         "count": len(results),
         "ml_enabled": use_ml,
         "response_time_ms": round(response_time, 2)
-    }
+    })
 
 @app.post("/api/terminology/translate", tags=["Terminology"])
 async def translate_code(
@@ -280,7 +531,7 @@ async def translate_code(
     start_time = time.time()
     
     # Get basic mapping
-    mapping = mapping_engine.translate_namaste_to_icd(request.namaste_code)
+    mapping = ctx.mapping_engine.translate_namaste_to_icd(request.namaste_code)
     
     if 'error' in mapping:
         raise HTTPException(status_code=404, detail=mapping['error'])
@@ -293,18 +544,16 @@ async def translate_code(
         tm2_matches = mapping.get('icd11_tm2_matches', [])
         bio_matches = mapping.get('icd11_biomedicine_matches', [])
         
-        # Re-rank using ML semantic similarity
-        for match in tm2_matches:
-            match['ml_score'] = ml_matcher.compute_similarity(
-                namaste_data['display'],
-                match['title']
-            )
-        
-        for match in bio_matches:
-            match['ml_score'] = ml_matcher.compute_similarity(
-                namaste_data['display'],
-                match['title']
-            )
+        # Re-rank using ML semantic similarity, scoring both lists concurrently
+        ml_matcher = await ctx.load_ml_matcher()
+        display = namaste_data['display']
+        tm2_scores, bio_scores = await asyncio.gather(
+            asyncio.to_thread(ml_matcher.compute_similarities_batch, display, [m['title'] for m in tm2_matches]),
+            asyncio.to_thread(ml_matcher.compute_similarities_batch, display, [m['title'] for m in bio_matches])
+        )
+        for matches, scores in ((tm2_matches, tm2_scores), (bio_matches, bio_scores)):
+            for match, score in zip(matches, scores.tolist()):
+                match['ml_score'] = score
         
         # Sort by ML score
         tm2_matches.sort(key=lambda x: x.get('ml_score', 0), reverse=True)
@@ -322,7 +571,7 @@ async def translate_code(
         top_tm2_match = tm2_matches[0] if tm2_matches else {}
         top_bio_match = bio_matches[0] if bio_matches else {}
 
-    audit_service.log_translation(
+    ctx.audit_service.record_translation(
         user_id=current_user['user_id'],
         namaste_code=request.namaste_code,
         icd11_tm2=top_tm2_match.get('code'),
@@ -345,7 +594,7 @@ async def get_namaste_code(
     current_user: dict = Depends(get_current_user)
 ):
     """Get detailed information about a NAMASTE code"""
-    code_data = namaste_parser.get_code_by_id(code)
+    code_data = ctx.namaste_parser.get_code_by_id(code)
     
     if not code_data:
         raise HTTPException(status_code=404, detail=f"NAMASTE code {code} not found")
@@ -368,7 +617,7 @@ async def get_icd11_entity(
     Supports both TM2 (Traditional Medicine 2) and MMS (Biomedicine) linearizations
     """
     try:
-        entity = icd_client.get_entity(code, linearization)
+        entity = await ctx.icd_client.get_entity_async(code, linearization, app.state.http_client)
         
         if not entity:
             raise HTTPException(status_code=404, detail=f"ICD-11 code {code} not found")
@@ -379,6 +628,8 @@ async def get_icd11_entity(
             "entity": entity,
             "system": "http://id.who.int/icd/release/11/mms" if linearization == "mms" else "http://id.who.int/icd/release/11/tm2"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -394,29 +645,28 @@ async def create_condition_resource(
     Links NAMASTE code with ICD-11 codes (TM2 + Biomedicine)
     """
     # Validate NAMASTE code
-    namaste_data = namaste_parser.get_code_by_id(request.namaste_code)
+    namaste_data = ctx.namaste_parser.get_code_by_id(request.namaste_code)
     if not namaste_data:
         raise HTTPException(status_code=404, detail=f"NAMASTE code {request.namaste_code} not found")
     
-    # Create FHIR Condition
-    condition = fhir_gen.create_condition(
+    # Create FHIR Condition, serialized straight from the pre-encoded skeleton
+    condition_id, body = ctx.fhir_gen.create_condition_bytes(
         namaste_code=request.namaste_code,
         namaste_display=namaste_data['display'],
         icd_codes=request.icd_codes,
-        patient_id=request.patient_id,
-        abha_id=request.abha_id
+        patient_id=request.patient_id
     )
     
     # Log FHIR resource creation
-    audit_service.log_fhir_resource(
+    ctx.audit_service.log_fhir_resource(
         user_id=current_user['user_id'],
         resource_type='Condition',
-        resource_id=condition['id'],
+        resource_id=condition_id,
         patient_id=request.patient_id,
         codes=[request.namaste_code] + request.icd_codes
     )
     
-    return condition
+    return Response(content=body, media_type="application/json")
 
 @app.post("/api/fhir/ConceptMap", tags=["FHIR"])
 async def create_concept_map(
@@ -429,21 +679,21 @@ async def create_concept_map(
     Maps NAMASTE code to ICD-11 codes
     """
     # Validate source code
-    namaste_data = namaste_parser.get_code_by_id(source_code)
+    namaste_data = ctx.namaste_parser.get_code_by_id(source_code)
     if not namaste_data:
         raise HTTPException(status_code=404, detail=f"NAMASTE code {source_code} not found")
     
     # Get mapping details
-    mapping = mapping_engine.translate_namaste_to_icd(source_code)
+    mapping = ctx.mapping_engine.translate_namaste_to_icd(source_code)
     
     # Create ConceptMap
-    concept_map = fhir_gen.create_concept_map(
+    concept_map = ctx.fhir_gen.create_concept_map(
         source_code=source_code,
         source_display=namaste_data['display'],
         target_codes=target_codes
     )
     
-    audit_service.log_fhir_resource(
+    ctx.audit_service.log_fhir_resource(
         user_id=current_user['user_id'],
         resource_type='ConceptMap',
         resource_id=concept_map['id'],
@@ -452,6 +702,9 @@ async def create_concept_map(
     
     return concept_map
 
+# Encoded ValueSet bodies by lowercased filter; short TTL keeps the resource date current
+value_set_bodies = TTLCache(maxsize=256, ttl=300)
+
 @app.get("/api/fhir/ValueSet", tags=["FHIR"])
 async def get_value_set(
     system: str = "namaste",
@@ -461,49 +714,88 @@ async def get_value_set(
     """
     Get FHIR ValueSet for NAMASTE or ICD-11 codes
     """
-    if system.lower() == "namaste":
-        codes = namaste_parser.codes
-        if filter:
-            codes = [c for c in codes if filter.lower() in c['display'].lower()]
+    if system.lower() != "namaste":
+        raise HTTPException(status_code=400, detail="Only NAMASTE ValueSet supported currently")
+    
+    filter_lc = filter.lower() if filter else None
+    body = value_set_bodies.get(filter_lc)
+    if body is None:
+        # Limit to 50 for performance; the filter stops scanning once it has them
+        if filter_lc:
+            codes = ctx.namaste_parser.filter_valueset(filter_lc, 50)
+        else:
+            codes = ctx.namaste_parser.codes[:50]
         
-        value_set = fhir_gen.create_value_set(
-            codes=codes[:50],  # Limit to 50 for performance
+        value_set = ctx.fhir_gen.create_value_set(
+            codes=codes,
             system_name="NAMASTE"
         )
-    else:
-        raise HTTPException(status_code=400, detail="Only NAMASTE ValueSet supported currently")
+        body = ctx.fhir_gen.to_json(value_set)
+        value_set_bodies[filter_lc] = body
     
-    return value_set
+    return Response(content=body, media_type="application/json")
 
 # ============= ANALYTICS & AUDIT ENDPOINTS =============
 
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+def wants_ndjson(request: Request) -> bool:
+    """Client asked for newline-delimited JSON via the Accept header"""
+    return NDJSON_MEDIA_TYPE in request.headers.get('accept', '')
+
+def ndjson_stream(rows):
+    """Encode rows one per line so the response is streamed, not materialized"""
+    for row in rows:
+        yield orjson.dumps(row) + b"\n"
+
 @app.get("/api/audit/recent", tags=["Audit"])
 async def get_recent_audit_logs(
+    request: Request,
     limit: int = 50,
     current_user: dict = Depends(get_current_user)
 ):
-    """Get recent audit logs (admin only)"""
+    """
+    Get recent audit logs (admin only)
+    Send `Accept: application/x-ndjson` to stream one log per line
+    """
     if current_user.get('role') not in ['admin', 'auditor']:
         raise HTTPException(status_code=403, detail="Insufficient permissions")
     
-    logs = audit_service.get_audit_logs(limit)
-    return {
+    if wants_ndjson(request):
+        return StreamingResponse(
+            ndjson_stream(ctx.audit_service.iter_audit_logs(limit=limit)),
+            media_type=NDJSON_MEDIA_TYPE
+        )
+    
+    logs = ctx.audit_service.get_audit_logs(limit=limit)
+    return ORJSONResponse({
         "logs": logs,
         "count": len(logs)
-    }
+    })
 
 @app.get("/api/audit/user/{user_id}", tags=["Audit"])
 async def get_user_activity(
+    request: Request,
     user_id: str,
+    limit: int = 100,
     current_user: dict = Depends(get_current_user)
 ):
-    """Get activity logs for specific user"""
+    """
+    Get activity logs for specific user
+    Send `Accept: application/x-ndjson` to stream the logs one per line
+    """
     # Users can only view their own logs unless admin
     if current_user['user_id'] != user_id and current_user.get('role') != 'admin':
         raise HTTPException(status_code=403, detail="Insufficient permissions")
     
-    logs = audit_service.get_user_activity(user_id)
-    stats = audit_service.get_user_statistics(user_id)
+    if wants_ndjson(request):
+        return StreamingResponse(
+            ndjson_stream(ctx.audit_service.iter_audit_logs(user_id=user_id, limit=limit)),
+            media_type=NDJSON_MEDIA_TYPE
+        )
+    
+    logs = ctx.audit_service.get_user_activity(user_id)
+    stats = ctx.audit_service.get_user_statistics(user_id)
     
     return {
         "user_id": user_id,
@@ -520,7 +812,7 @@ async def get_popular_searches(
     if current_user.get('role') not in ['admin', 'researcher']:
         raise HTTPException(status_code=403, detail="Insufficient permissions")
     
-    popular = audit_service.get_popular_searches(limit)
+    popular = ctx.audit_service.get_popular_searches(limit)
     return {
         "popular_searches": popular,
         "count": len(popular)
@@ -534,7 +826,7 @@ async def get_translation_statistics(
     if current_user.get('role') not in ['admin', 'researcher']:
         raise HTTPException(status_code=403, detail="Insufficient permissions")
     
-    stats = audit_service.get_translation_statistics()
+    stats = ctx.audit_service.get_translation_statistics()
     return stats
 
 @app.get("/api/analytics/dashboard-stats", tags=["Analytics"])
@@ -544,18 +836,11 @@ async def get_dashboard_stats(
     """Get comprehensive dashboard statistics"""
     if current_user.get('role') not in ['admin', 'researcher']:
         raise HTTPException(status_code=403, detail="Insufficient permissions")
-    """
-    return {
-        "total_searches": audit_service.get_total_searches(),
-        "total_translations": audit_service.get_total_translations(),
-        "total_users": audit_service.get_total_users(),
-        "popular_codes": audit_service.get_popular_codes(10),
-        "recent_activity": audit_service.get_recent_logs(20),
-        "translation_stats": audit_service.get_translation_statistics()
-    }
-    """
+    
+    # Same payload the dashboard page reads (unique_users, top_searches, ...)
+    stats = await asyncio.to_thread(ctx.audit_service.get_analytics_summary)
+    return ORJSONResponse(stats)
 
-    return audit_service.get_analytics_summary()
 # ============= HEALTH CHECK =============
 
 @app.get("/api/health", tags=["General"])
@@ -565,37 +850,25 @@ async def health_check():
         "status": "healthy",
         "version": "2.0.0",
         "services": {
-            "namaste_parser": "active",
-            "icd11_client": "active",
-            "mapping_engine": "active",
-            "fhir_generator": "active",
-            "ml_matcher": "active",
-            "audit_service": "active",
-            "auth_service": "active"
+            service: "active" if ctx.is_loaded(attr) else "idle"
+            for service, attr in [
+                ("namaste_parser", "namaste_parser"),
+                ("icd11_client", "icd_client"),
+                ("mapping_engine", "mapping_engine"),
+                ("fhir_generator", "fhir_gen"),
+                ("ml_matcher", "ml_matcher"),
+                ("audit_service", "audit_service"),
+                ("auth_service", "auth_service")
+            ]
         },
         "timestamp": time.time()
     }
 
-# ============= OPTIONS HANDLER (CORS PREFLIGHT) =============
-
-@app.options("/{full_path:path}")
-async def options_handler(full_path: str):
-    """Handle CORS preflight requests"""
-    return JSONResponse(
-        content={"message": "OK"},
-        headers={
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
-            "Access-Control-Allow-Headers": "Authorization, Content-Type, Accept",
-            "Access-Control-Max-Age": "3600"
-        }
-    )
-
 # ============= ERROR HANDLERS =============
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={
             "error": exc.detail,
@@ -606,8 +879,8 @@ async def http_exception_handler(request: Request, exc: HTTPException):
 
 @app.exception_handler(Exception)
 async def general_exception_handler(request: Request, exc: Exception):
-    print(f"[ERROR] {str(exc)}")
-    return JSONResponse(
+    logger.exception("Unhandled error on %s", request.url.path, exc_info=exc)
+    return ORJSONResponse(
         status_code=500,
         content={
             "error": "Internal server error",
@@ -616,6 +889,30 @@ async def general_exception_handler(request: Request, exc: Exception):
         }
     )
 
+def build_log_config() -> Dict:
+    """Uvicorn logging config; emits JSON lines when python-json-logger is installed"""
+    try:
+        import pythonjsonlogger  # noqa: F401
+        formatter = {
+            "()": "pythonjsonlogger.jsonlogger.JsonFormatter",
+            "fmt": "%(asctime)s %(levelname)s %(name)s %(message)s"
+        }
+    except ImportError:
+        formatter = {"format": "%(asctime)s %(levelname)s %(name)s: %(message)s"}
+    
+    logger_config = {"handlers": ["default"], "level": "INFO", "propagate": False}
+    return {
+        "version": 1,
+        "disable_existing_loggers": False,
+        "formatters": {"default": formatter},
+        "handlers": {"default": {"class": "logging.StreamHandler", "formatter": "default"}},
+        "loggers": {
+            "uvicorn": logger_config,
+            "uvicorn.access": logger_config,
+            "ayush": logger_config
+        }
+    }
+
 if __name__ == "__main__":
     import uvicorn
     print("\n🚀 Starting AYUSH Terminology Bridge API v2.0")
@@ -624,4 +921,15 @@ if __name__ == "__main__":
     print("📊 Features: ML Matching + Audit Trail + FHIR R4")
     print("🌐 CORS: Enabled for localhost:3000 and localhost:8080\n")
     
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
\ No newline at end of file
+    # Workers need an import string; access logs are off since the audit middleware records requests
+    uvicorn.run(
+        "api.app:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.environ.get("WORKERS", os.cpu_count() or 1)),
+        loop="uvloop",
+        http="httptools",
+        log_level="info",
+        access_log=False,
+        log_config=build_log_config()
+    )
\ No newline at end of file
@@ -3,36 +3,157 @@ Custom middleware for AYUSH Terminology Bridge API
 Handles: Audit logging, Rate limiting, Request timing, CORS, Security headers
 """
 
-from fastapi import Request, Response
-from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi.responses import ORJSONResponse
 from starlette.middleware.cors import CORSMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import asyncio
+import atexit
+import logging
+import math
+import os
+import queue
 import time
-from typing import Callable, Optional
-import json
-from collections import defaultdict
-from datetime import datetime, timedelta
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Optional, Tuple
+from collections import defaultdict, deque
+from cachetools import TTLCache
+from datetime import datetime, timezone
+from functools import partial
 
 from services.audit_service import AuditService
 from services.abha_auth import AuthMiddleware as ABHAAuthMiddleware
 
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Rate limit buckets stay in-process
+    aioredis = None
 
-class AuditMiddleware(BaseHTTPMiddleware):
+
+# Middleware below are plain ASGI callables rather than BaseHTTPMiddleware
+# subclasses, which avoids a task group and stream bridge per request.
+
+# Wall-clock time is only needed for human-readable timestamps; durations use time.monotonic()
+_utc_now = partial(datetime.now, timezone.utc)
+
+
+def _get_header(scope: Scope, name: bytes) -> Optional[str]:
+    """Read a request header from the raw ASGI header list (names are lowercase)"""
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def _client_ip(scope: Scope) -> str:
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _append_headers(message: Message, headers: List[Tuple[bytes, bytes]]):
+    """Add raw headers to an http.response.start message (one list concat)"""
+    message["headers"] = list(message.get("headers", ())) + headers
+
+
+API_VERSION_HEADER = (b"x-api-version", b"2.0.0")
+
+# Constant response headers, encoded once and spliced into http.response.start
+_SECURITY_HEADERS: List[Tuple[bytes, bytes]] = [
+    (b"x-content-type-options", b"nosniff"),
+    (b"x-frame-options", b"DENY"),
+    (b"x-xss-protection", b"1; mode=block"),
+    (b"strict-transport-security", b"max-age=31536000; includeSubDomains"),
+    (b"content-security-policy", b"default-src 'self'"),
+    (b"referrer-policy", b"strict-origin-when-cross-origin"),
+    (b"permissions-policy", b"geolocation=(), microphone=(), camera=()")
+]
+
+# Load-balancer probe endpoints skip auth, audit, rate limiting and logging
+_PROBE_SUFFIXES = ('/health', '/metrics')
+
+
+logger = logging.getLogger("ayush.middleware")
+
+AUDIT_QUEUE_SIZE = 10000
+AUDIT_BATCH_SIZE = 200
+AUDIT_FLUSH_INTERVAL_SECONDS = 0.2
+
+# Queued on shutdown; the writer writes the batch it holds, then exits
+_AUDIT_STOP = None
+
+
+async def _audit_writer(audit_queue: asyncio.Queue, audit_service: AuditService):
+    """Drain queued audit rows, writing up to one batch per flush interval"""
+    loop = asyncio.get_running_loop()
+    
+    stopping = False
+    while not stopping:
+        row = await audit_queue.get()
+        if row is _AUDIT_STOP:
+            return
+        batch = [row]
+        deadline = loop.time() + AUDIT_FLUSH_INTERVAL_SECONDS
+        while len(batch) < AUDIT_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                row = await asyncio.wait_for(audit_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if row is _AUDIT_STOP:
+                stopping = True
+                break
+            batch.append(row)
+        
+        try:
+            await asyncio.to_thread(audit_service.bulk_insert, batch)
+        except Exception:
+            logger.exception("Failed to write %d audit rows", len(batch))
+
+
+request_logger = logging.getLogger("ayush.requests")
+
+
+def _queue_request_logging():
+    """Hand request log records to a listener thread so the event loop never blocks on I/O"""
+    if request_logger.handlers:
+        return
+    
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, logging.StreamHandler())
+    request_logger.addHandler(QueueHandler(log_queue))
+    request_logger.setLevel(logging.INFO)
+    request_logger.propagate = False
+    listener.start()
+    atexit.register(listener.stop)
+
+
+class AuditMiddleware:
     """
     Middleware to log all API requests to audit trail
     Captures: endpoint, method, user, IP, timing, response status
     """
     
-    def __init__(self, app, audit_service: AuditService, auth_middleware: ABHAAuthMiddleware):
-        super().__init__(app)
+    def __init__(self, app: ASGIApp, audit_service: AuditService, auth_middleware: ABHAAuthMiddleware,
+                 audit_queue: asyncio.Queue):
+        self.app = app
         self.audit_service = audit_service
         self.auth_middleware = auth_middleware
+        # Rows are written in batches by _audit_writer, off the request path
+        self.audit_queue = audit_queue
+        self.dropped = 0
     
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        start_time = time.time()
-        
-        # Extract user info if available
-        auth_header = request.headers.get('authorization')
+    def _enqueue(self, row: dict):
+        """Queue log_api_call kwargs; drop the row if the writer has fallen behind"""
+        try:
+            self.audit_queue.put_nowait(row)
+        except asyncio.QueueFull:
+            self.dropped += 1
+    
+    def _authenticate(self, scope: Scope, start_time: float) -> Tuple[Optional[str], Optional[str]]:
+        """Resolve the caller from the Authorization header; returns (user_id, user_role)"""
+        auth_header = _get_header(scope, b'authorization')
+        user = None
         user_id = None
         user_role = None
         
@@ -42,323 +163,555 @@ class AuditMiddleware(BaseHTTPMiddleware):
                 user_id = user.get('user_id')
                 user_role = user.get('role')
         
-        # Store request details for potential error logging
-        request.state.start_time = start_time
-        request.state.user_id = user_id
+        # Store request details straight in the scope's state dict (Starlette
+        # exposes it as request.state); the decoded token is reused by get_current_user
+        state = scope.setdefault("state", {})
+        state["start_time"] = start_time
+        state["user_id"] = user_id
+        state["user"] = user
+        
+        return user_id, user_role
+    
+    def _log(self, scope: Scope, action_type: str, user_id: Optional[str], user_role: Optional[str],
+             response_status: int, response_time: float, **extra):
+        self._enqueue(dict(
+            action_type=action_type,
+            user_id=user_id,
+            user_role=user_role,
+            endpoint=scope["path"],
+            method=scope["method"],
+            ip_address=_client_ip(scope),
+            user_agent=_get_header(scope, b'user-agent'),
+            response_status=response_status,
+            response_time_ms=response_time,
+            **extra
+        ))
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # Skip probes before any header parsing or token verification
+        if scope["type"] != "http" or scope["path"].endswith(_PROBE_SUFFIXES):
+            await self.app(scope, receive, send)
+            return
+        
+        start_time = time.monotonic()
+        path = scope["path"]
+        method = scope["method"]
+        
+        # Extract user info if available
+        user_id, user_role = self._authenticate(scope, start_time)
+        
+        status_code = 500
+        
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                response_time = (time.monotonic() - start_time) * 1000
+                
+                # Add custom headers
+                _append_headers(message, [
+                    (b"x-response-time", f"{response_time:.2f}ms".encode()),
+                    API_VERSION_HEADER
+                ])
+            await send(message)
         
         try:
             # Process request
-            response = await call_next(request)
-            
-            # Calculate response time
-            response_time = (time.time() - start_time) * 1000
-            
-            # Log to audit trail (skip health checks)
-            if not request.url.path.endswith('/health'):
-                self.audit_service.log_api_call(
-                    action_type=f"{request.method}_{request.url.path}",
-                    user_id=user_id,
-                    user_role=user_role,
-                    endpoint=str(request.url.path),
-                    method=request.method,
-                    ip_address=request.client.host if request.client else "unknown",
-                    user_agent=request.headers.get('user-agent'),
-                    response_status=response.status_code,
-                    response_time_ms=response_time
-                )
-            
-            # Add custom headers
-            response.headers["X-Response-Time"] = f"{response_time:.2f}ms"
-            response.headers["X-API-Version"] = "2.0.0"
-            
-            return response
+            await self.app(scope, receive, send_wrapper)
             
         except Exception as e:
             # Log error
-            response_time = (time.time() - start_time) * 1000
+            response_time = (time.monotonic() - start_time) * 1000
             
-            self.audit_service.log_api_call(
-                action_type=f"ERROR_{request.method}_{request.url.path}",
-                user_id=user_id,
-                user_role=user_role,
-                endpoint=str(request.url.path),
-                method=request.method,
-                ip_address=request.client.host if request.client else "unknown",
-                user_agent=request.headers.get('user-agent'),
-                response_status=500,
-                response_time_ms=response_time,
-                metadata={'error': str(e)}
-            )
+            self._log(scope, f"ERROR_{method}_{path}", user_id, user_role, 500, response_time,
+                      metadata={'error': str(e)})
             
             raise
+        
+        # Calculate response time
+        response_time = (time.monotonic() - start_time) * 1000
+        
+        # Log to audit trail
+        self._log(scope, f"{method}_{path}", user_id, user_role, status_code, response_time)
 
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
+# Token-bucket refill + consume, run atomically in Redis so every worker
+# shares one bucket per IP. Returns {allowed, remaining, retry_after}.
+RATE_LIMIT_LUA = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1])
+if tokens == nil then
+    tokens = capacity
+else
+    tokens = math.min(capacity, tokens + math.max(0, now - tonumber(bucket[2])) * rate)
+end
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = math.ceil((1 - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], ARGV[4])
+return {allowed, math.floor(tokens), retry_after}
+"""
+
+
+class RateLimitMiddleware:
     """
-    Simple rate limiting middleware
-    Limits: 100 requests per minute per IP
+    Token-bucket rate limiting middleware
+    Limits: 100 requests per minute per IP (bursts up to the full quota)
+    
+    With a redis_url the buckets live in Redis and are shared by all workers;
+    otherwise (or if Redis is unreachable) they are kept per process.
+    algorithm="sliding_window" switches the in-process limiter to an
+    approximate sliding-window counter (no bursts above the window quota).
     """
     
-    def __init__(self, app, max_requests: int = 100, window_seconds: int = 60):
-        super().__init__(app)
+    ALGORITHMS = ('token_bucket', 'sliding_window')
+    
+    def __init__(self, app: ASGIApp, max_requests: int = 100, window_seconds: int = 60,
+                 redis_url: Optional[str] = None, algorithm: str = 'token_bucket'):
+        if algorithm not in self.ALGORITHMS:
+            raise ValueError(f"Unknown rate limit algorithm: {algorithm}")
+        
+        self.app = app
         self.max_requests = max_requests
         self.window_seconds = window_seconds
-        self.request_counts = defaultdict(list)
+        self.refill_rate = max_requests / window_seconds  # tokens per second
+        self._limit_header = (b"x-ratelimit-limit", str(max_requests).encode())
+        # ip -> [tokens, last_refill]; idle IPs expire once their bucket would be full again
+        self.buckets = TTLCache(maxsize=100_000, ttl=window_seconds * 2)
+        # ip -> (window_index, previous_count, current_count) for the sliding-window counter
+        self.counters = TTLCache(maxsize=100_000, ttl=window_seconds * 2)
+        self._consume_local = (self._consume_token_bucket if algorithm == 'token_bucket'
+                               else self._consume_sliding_window)
+        
+        self.redis = None
+        self.rate_limit_script = None
+        if redis_url and aioredis is not None:
+            self.redis = aioredis.Redis.from_url(redis_url)
+            # Sent with EVALSHA; the script is loaded on first use
+            self.rate_limit_script = self.redis.register_script(RATE_LIMIT_LUA)
     
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        # Skip rate limiting for health checks
-        if request.url.path.endswith('/health'):
-            return await call_next(request)
+    def _consume_token_bucket(self, client_ip: str) -> Tuple[bool, int, int]:
+        # Hot path: bind attributes to locals once
+        max_req = self.max_requests
+        rate = self.refill_rate
+        buckets = self.buckets
         
-        # Get client IP
-        client_ip = request.client.host if request.client else "unknown"
+        # Refill lazily for the time elapsed since this bucket was last touched
+        now = time.monotonic()
+        bucket = buckets.get(client_ip)
+        if bucket is None:
+            bucket = buckets[client_ip] = [float(max_req), now]
+            tokens = bucket[0]
+        else:
+            tokens = min(max_req, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            # Re-assign so an active client's bucket does not expire mid-use
+            buckets[client_ip] = bucket
         
-        # Clean old entries
-        current_time = datetime.now()
-        cutoff_time = current_time - timedelta(seconds=self.window_seconds)
+        if tokens < 1:
+            bucket[0] = tokens
+            return False, 0, math.ceil((1 - tokens) / rate)
         
-        self.request_counts[client_ip] = [
-            req_time for req_time in self.request_counts[client_ip]
-            if req_time > cutoff_time
-        ]
+        # Consume a token for this request
+        bucket[0] = tokens - 1
+        return True, int(tokens - 1), 0
+    
+    def _consume_sliding_window(self, client_ip: str) -> Tuple[bool, int, int]:
+        """Weight the previous window's count by how much of it still overlaps the sliding window"""
+        max_req = self.max_requests
+        window = self.window_seconds
         
-        # Check rate limit
-        if len(self.request_counts[client_ip]) >= self.max_requests:
-            return JSONResponse(
-                status_code=429,
-                content={
-                    "error": "Rate limit exceeded",
-                    "message": f"Maximum {self.max_requests} requests per {self.window_seconds} seconds",
-                    "retry_after": self.window_seconds
-                },
-                headers={
-                    "Retry-After": str(self.window_seconds),
-                    "X-RateLimit-Limit": str(self.max_requests),
-                    "X-RateLimit-Remaining": "0"
-                }
+        now = time.monotonic()
+        current = int(now // window)
+        start, prev, cur = self.counters.get(client_ip, (current, 0, 0))
+        if current != start:
+            # Roll forward; anything older than the previous window no longer counts
+            prev = cur if current == start + 1 else 0
+            cur = 0
+        
+        elapsed_fraction = (now % window) / window
+        estimated = prev * (1 - elapsed_fraction) + cur
+        if estimated >= max_req:
+            self.counters[client_ip] = (current, prev, cur)
+            return False, 0, math.ceil(window * (1 - elapsed_fraction))
+        
+        cur += 1
+        self.counters[client_ip] = (current, prev, cur)
+        return True, max(0, int(max_req - estimated - 1)), 0
+    
+    async def _consume(self, client_ip: str) -> Tuple[bool, int, int]:
+        """Take a token for client_ip; returns (allowed, remaining, retry_after)"""
+        if self.rate_limit_script is None:
+            return self._consume_local(client_ip)
+        
+        try:
+            allowed, remaining, retry_after = await self.rate_limit_script(
+                keys=[f"ratelimit:{client_ip}"],
+                args=[time.time(), self.refill_rate, self.max_requests, self.window_seconds * 1000]
             )
+        except aioredis.RedisError:
+            return self._consume_local(client_ip)
         
-        # Add current request
-        self.request_counts[client_ip].append(current_time)
+        return bool(allowed), int(remaining), int(retry_after)
+    
+    def _reject(self, retry_after: int) -> ORJSONResponse:
+        return ORJSONResponse(
+            status_code=429,
+            content={
+                "error": "Rate limit exceeded",
+                "message": f"Maximum {self.max_requests} requests per {self.window_seconds} seconds",
+                "retry_after": retry_after
+            },
+            headers={
+                "Retry-After": str(retry_after),
+                "X-RateLimit-Limit": str(self.max_requests),
+                "X-RateLimit-Remaining": "0"
+            }
+        )
+    
+    def _headers(self, remaining: int) -> List[Tuple[bytes, bytes]]:
+        reset = int(time.time() + (self.max_requests - remaining) / self.refill_rate)
+        return [
+            self._limit_header,
+            (b"x-ratelimit-remaining", str(remaining).encode()),
+            (b"x-ratelimit-reset", str(reset).encode())
+        ]
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # Skip rate limiting for health/metrics probes
+        if scope["type"] != "http" or scope["path"].endswith(_PROBE_SUFFIXES):
+            await self.app(scope, receive, send)
+            return
         
-        # Process request
-        response = await call_next(request)
+        # Get client IP
+        client_ip = _client_ip(scope)
+        allowed, remaining, retry_after = await self._consume(client_ip)
         
-        # Add rate limit headers
-        remaining = self.max_requests - len(self.request_counts[client_ip])
-        response.headers["X-RateLimit-Limit"] = str(self.max_requests)
-        response.headers["X-RateLimit-Remaining"] = str(remaining)
-        response.headers["X-RateLimit-Reset"] = str(int((current_time + timedelta(seconds=self.window_seconds)).timestamp()))
+        # Check rate limit
+        if not allowed:
+            await self._reject(retry_after)(scope, receive, send)
+            return
         
-        return response
+        rate_headers = self._headers(remaining)
+        
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                # Add rate limit headers
+                _append_headers(message, rate_headers)
+            await send(message)
+        
+        # Process request
+        await self.app(scope, receive, send_wrapper)
 
 
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
+class SecurityHeadersMiddleware:
     """
     Add security headers to all responses
     Protects against: XSS, clickjacking, MIME sniffing
     """
     
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        response = await call_next(request)
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         
-        # Security headers
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-        response.headers["Content-Security-Policy"] = "default-src 'self'"
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        response.headers["Permissions-Policy"] = "geolocation=(), microphone=(), camera=()"
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                _append_headers(message, _SECURITY_HEADERS)
+            await send(message)
         
-        return response
+        await self.app(scope, receive, send_wrapper)
 
 
-class RequestLoggingMiddleware(BaseHTTPMiddleware):
+class RequestLoggingMiddleware:
     """
     Detailed request/response logging for debugging
     Logs request body and response for non-health endpoints
     """
     
-    def __init__(self, app, log_bodies: bool = False):
-        super().__init__(app)
+    def __init__(self, app: ASGIApp, log_bodies: bool = False):
+        self.app = app
         self.log_bodies = log_bodies
+        _queue_request_logging()
     
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        # Skip logging for health checks
-        if request.url.path.endswith('/health'):
-            return await call_next(request)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # Skip logging for probes, or entirely when the logger is off
+        if (scope["type"] != "http" or scope["path"].endswith(_PROBE_SUFFIXES)
+                or not request_logger.isEnabledFor(logging.INFO)):
+            await self.app(scope, receive, send)
+            return
         
-        # Log request
-        print(f"\n{'='*60}")
-        print(f"[{datetime.now().isoformat()}] {request.method} {request.url.path}")
-        print(f"Client: {request.client.host if request.client else 'unknown'}")
-        print(f"User-Agent: {request.headers.get('user-agent', 'N/A')}")
+        method = scope["method"]
         
         # Log request body if enabled (be careful with sensitive data)
-        if self.log_bodies and request.method in ['POST', 'PUT', 'PATCH']:
-            try:
-                body = await request.body()
-                if body:
-                    print(f"Request Body: {body.decode('utf-8')[:500]}")  # Limit to 500 chars
-            except:
-                pass
+        if self.log_bodies and method in ['POST', 'PUT', 'PATCH']:
+            # Buffer the body so it can be replayed to the app
+            messages = []
+            more_body = True
+            while more_body:
+                message = await receive()
+                messages.append(message)
+                more_body = message.get("more_body", False)
+            
+            body = b"".join(m.get("body", b"") for m in messages)
+            if body:
+                request_logger.info("%s %s body=%r", method, scope["path"], body[:500])  # Limit to 500 bytes, no full decode
+            
+            original_receive = receive
+            
+            async def receive():
+                return messages.pop(0) if messages else await original_receive()
         
-        # Process request
-        start_time = time.time()
-        response = await call_next(request)
-        response_time = (time.time() - start_time) * 1000
+        status_code = None
         
-        # Log response
-        print(f"Status: {response.status_code}")
-        print(f"Response Time: {response_time:.2f}ms")
-        print(f"{'='*60}\n")
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
         
-        return response
+        # Process request
+        start_time = time.monotonic()
+        await self.app(scope, receive, send_wrapper)
+        response_time = (time.monotonic() - start_time) * 1000
+        
+        # One record per request; %-args are formatted by the listener thread
+        request_logger.info(
+            "[%s] %s %s client=%s ua=%s status=%s time=%.2fms",
+            _utc_now().isoformat(), method, scope["path"], _client_ip(scope),
+            _get_header(scope, b'user-agent') or 'N/A', status_code, response_time
+        )
 
 
-class CacheMiddleware(BaseHTTPMiddleware):
+class CacheMiddleware:
     """
     Simple in-memory cache for GET requests
     Caches: Terminology lookups, ICD-11 entities
     """
     
-    def __init__(self, app, ttl_seconds: int = 300):
-        super().__init__(app)
-        self.cache = {}
+    # Health, audit and analytics responses must always be fresh
+    SKIP_PREFIXES = ('/api/health', '/api/audit', '/api/analytics')
+    
+    def __init__(self, app: ASGIApp, ttl_seconds: int = 300):
+        self.app = app
+        # Entries expire after ttl_seconds; least recently used go first when full
+        self.cache = TTLCache(maxsize=1000, ttl=ttl_seconds)
         self.ttl_seconds = ttl_seconds
     
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+    def _cache_key(self, scope: Scope) -> Optional[str]:
+        """Key for a cacheable request, or None"""
         # Only cache GET requests
-        if request.method != "GET":
-            return await call_next(request)
+        if scope["method"] != "GET":
+            return None
         
         # Skip caching for certain endpoints
-        skip_paths = ['/health', '/audit', '/analytics']
-        if any(path in request.url.path for path in skip_paths):
-            return await call_next(request)
+        path = scope["path"]
+        if path.startswith(self.SKIP_PREFIXES) or path.endswith(_PROBE_SUFFIXES):
+            return None
         
-        # Generate cache key
-        cache_key = f"{request.method}:{request.url.path}:{request.url.query}"
+        return f"GET:{path}:{scope['query_string'].decode('latin-1')}"
+    
+    async def _replay(self, cache_key: str, send: Send) -> bool:
+        """Send the cached response for cache_key if there is one"""
+        cached = self.cache.get(cache_key)
+        if cached is None:
+            return False
         
-        # Check cache
-        if cache_key in self.cache:
-            cached_data, cached_time = self.cache[cache_key]
+        body, hit_headers, cached_time = cached
+        
+        # Replay the stored bytes as-is; no JSON parsing or re-serialization
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": hit_headers + [(b"x-cache-age", str(int(time.monotonic() - cached_time)).encode())]
+        })
+        await send({"type": "http.response.body", "body": body})
+        return True
+    
+    def _storing_send(self, cache_key: str, send: Send) -> Send:
+        """Wrap send to buffer a 200 response and store it under cache_key"""
+        start_message = None
+        body_chunks = []
+        
+        async def send_wrapper(message: Message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                if message["status"] != 200:
+                    await send(message)
+                    return
+                # Hold back successful responses until the body is complete
+                start_message = message
+                return
+            
+            if start_message is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            
+            body_chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
             
-            # Check if cache is still valid
-            if (datetime.now() - cached_time).total_seconds() < self.ttl_seconds:
-                # Return cached response
-                return JSONResponse(
-                    content=cached_data,
-                    headers={"X-Cache": "HIT", "X-Cache-Age": str(int((datetime.now() - cached_time).total_seconds()))}
-                )
+            body = b"".join(body_chunks)
+            headers = [(k, v) for k, v in start_message.get("headers", ()) if k != b"content-length"]
+            headers.append((b"content-length", str(len(body)).encode()))
+            
+            # Store JSON responses in cache as raw bytes
+            content_type = next((v for k, v in headers if k == b"content-type"), b"")
+            if content_type.startswith(b"application/json"):
+                # HIT headers are built once here, so replays only add the age
+                hit_headers = [
+                    (b"content-type", content_type),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"x-cache", b"HIT")
+                ]
+                self.cache[cache_key] = (body, hit_headers, time.monotonic())
+                headers.append((b"x-cache", b"MISS"))
+            
+            start_message["headers"] = headers
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
         
-        # Process request
-        response = await call_next(request)
+        return send_wrapper
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        cache_key = self._cache_key(scope) if scope["type"] == "http" else None
+        if cache_key is None:
+            await self.app(scope, receive, send)
+            return
         
-        # Cache successful GET responses
-        if response.status_code == 200 and request.method == "GET":
-            try:
-                # Read response body
-                body = b""
-                async for chunk in response.body_iterator:
-                    body += chunk
-                
-                # Parse JSON
-                response_data = json.loads(body.decode())
-                
-                # Store in cache
-                self.cache[cache_key] = (response_data, datetime.now())
-                
-                # Clean old cache entries (keep last 1000)
-                if len(self.cache) > 1000:
-                    # Remove oldest 200 entries
-                    sorted_keys = sorted(self.cache.keys(), key=lambda k: self.cache[k][1])
-                    for key in sorted_keys[:200]:
-                        del self.cache[key]
-                
-                # Return new response
-                return JSONResponse(
-                    content=response_data,
-                    headers={"X-Cache": "MISS"}
-                )
-            except:
-                pass
+        # Check cache
+        if await self._replay(cache_key, send):
+            return
         
-        return response
+        # Process request
+        await self.app(scope, receive, self._storing_send(cache_key, send))
 
 
-class ErrorHandlingMiddleware(BaseHTTPMiddleware):
+class ErrorHandlingMiddleware:
     """
     Global error handling middleware
     Catches unhandled exceptions and returns structured error responses
     """
     
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        response_started = False
+        
+        async def send_wrapper(message: Message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+        
         try:
-            response = await call_next(request)
-            return response
+            await self.app(scope, receive, send_wrapper)
             
         except Exception as e:
-            # Log error
-            print(f"[ERROR] Unhandled exception in {request.url.path}: {str(e)}")
+            logger.exception("Unhandled exception in %s", scope['path'])
             
-            # Return structured error response
-            return JSONResponse(
-                status_code=500,
-                content={
-                    "error": "Internal server error",
-                    "message": str(e),
-                    "path": request.url.path,
-                    "method": request.method,
-                    "timestamp": datetime.now().isoformat()
-                }
-            )
+            # Too late for a structured error once headers are on the wire
+            if response_started:
+                raise
+            
+            await self._error_response(scope, e)(scope, receive, send)
+    
+    def _error_response(self, scope: Scope, e: Exception) -> ORJSONResponse:
+        """Structured 500 body for an unhandled exception"""
+        return ORJSONResponse(
+            status_code=500,
+            content={
+                "error": "Internal server error",
+                "message": str(e),
+                "path": scope["path"],
+                "method": scope["method"],
+                "timestamp": _utc_now().isoformat()
+            }
+        )
 
 
-class MetricsMiddleware(BaseHTTPMiddleware):
+class MetricsMiddleware:
     """
     Collect API metrics for monitoring
     Tracks: Request counts, response times, error rates
+    
+    Starlette builds the installed instance itself, so pass `shared` to have
+    it record into another instance's counters (see configure_middleware).
     """
     
-    def __init__(self, app):
-        super().__init__(app)
+    def __init__(self, app: Optional[ASGIApp], shared: Optional["MetricsMiddleware"] = None):
+        self.app = app
+        if shared is not None:
+            self.metrics = shared.metrics
+            self.running = shared.running
+            return
+        
         self.metrics = {
             "total_requests": 0,
             "total_errors": 0,
             "endpoint_counts": defaultdict(int),
-            "response_times": defaultdict(list),
+            # Last 100 response times per endpoint, evicted automatically
+            "response_times": defaultdict(lambda: deque(maxlen=100)),
             "status_codes": defaultdict(int)
         }
+        # endpoint -> [count, total response time] for O(1) averages
+        self.running = defaultdict(lambda: [0, 0.0])
     
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        start_time = time.time()
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        start_time = time.monotonic()
+        path = scope["path"]
+        status_code = 500
+        
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
         
         try:
-            response = await call_next(request)
+            await self.app(scope, receive, send_wrapper)
             
-            # Update metrics
-            self.metrics["total_requests"] += 1
-            self.metrics["endpoint_counts"][request.url.path] += 1
-            self.metrics["status_codes"][response.status_code] += 1
-            
-            response_time = (time.time() - start_time) * 1000
-            self.metrics["response_times"][request.url.path].append(response_time)
-            
-            # Keep only last 100 response times per endpoint
-            if len(self.metrics["response_times"][request.url.path]) > 100:
-                self.metrics["response_times"][request.url.path] = \
-                    self.metrics["response_times"][request.url.path][-100:]
-            
-            if response.status_code >= 400:
-                self.metrics["total_errors"] += 1
-            
-            return response
-            
-        except Exception as e:
+        except Exception:
             self.metrics["total_errors"] += 1
             raise
+        
+        self.record(path, status_code, (time.monotonic() - start_time) * 1000)
+    
+    def record(self, path: str, status_code: int, response_time: float):
+        """Update metrics for one completed request"""
+        m = self.metrics
+        m["total_requests"] += 1
+        m["endpoint_counts"][path] += 1
+        m["status_codes"][status_code] += 1
+        m["response_times"][path].append(response_time)
+        
+        running = self.running[path]
+        running[0] += 1
+        running[1] += response_time
+        
+        if status_code >= 400:
+            m["total_errors"] += 1
     
     def get_metrics(self):
         """Get current metrics"""
@@ -373,20 +726,150 @@ class MetricsMiddleware(BaseHTTPMiddleware):
             )[:10],
             "status_codes": dict(self.metrics["status_codes"]),
             "avg_response_times": {
-                endpoint: sum(times) / len(times) if times else 0
-                for endpoint, times in self.metrics["response_times"].items()
+                endpoint: total / count
+                for endpoint, (count, total) in self.running.items()
+                if count
             }
         }
         return metrics_summary
 
 
+class FusedMiddleware:
+    """
+    The production stack in a single ASGI layer
+    Runs error handling, metrics, audit, cache, rate limiting and security
+    headers in one coroutine with one send wrapper, instead of six nested
+    layers each adding an await frame and a closure per request.
+    
+    Uses the configured component instances for all state (audit queue,
+    buckets, cache, counters), so their settings and metrics are shared.
+    Security headers are added to every response, including cache hits
+    and 429s.
+    """
+    
+    def __init__(self, app: ASGIApp, errors: ErrorHandlingMiddleware, metrics: MetricsMiddleware,
+                 audit: AuditMiddleware, cache: CacheMiddleware, rate_limit: RateLimitMiddleware):
+        self.app = app
+        self.errors = errors
+        self.metrics = metrics
+        self.audit = audit
+        self.cache = cache
+        self.rate_limit = rate_limit
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        start_time = time.monotonic()
+        path = scope["path"]
+        method = scope["method"]
+        
+        # Probes are neither audited nor rate limited
+        probe = path.endswith(_PROBE_SUFFIXES)
+        user_id = user_role = None
+        if not probe:
+            user_id, user_role = self.audit._authenticate(scope, start_time)
+        
+        extra_headers = _SECURITY_HEADERS
+        status_code = 500
+        response_started = False
+        
+        async def send_wrapper(message: Message):
+            nonlocal status_code, response_started
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                response_started = True
+                headers = extra_headers
+                if not probe:
+                    response_time = (time.monotonic() - start_time) * 1000
+                    headers = headers + [(b"x-response-time", f"{response_time:.2f}ms".encode()), API_VERSION_HEADER]
+                _append_headers(message, headers)
+            await send(message)
+        
+        try:
+            cache_key = self.cache._cache_key(scope)
+            if cache_key is None or not await self.cache._replay(cache_key, send_wrapper):
+                inner_send = send_wrapper if cache_key is None else self.cache._storing_send(cache_key, send_wrapper)
+                
+                if probe:
+                    await self.app(scope, receive, inner_send)
+                else:
+                    allowed, remaining, retry_after = await self.rate_limit._consume(_client_ip(scope))
+                    if allowed:
+                        extra_headers = extra_headers + self.rate_limit._headers(remaining)
+                        await self.app(scope, receive, inner_send)
+                    else:
+                        await self.rate_limit._reject(retry_after)(scope, receive, inner_send)
+            
+        except Exception as e:
+            self.metrics.metrics["total_errors"] += 1
+            if not probe:
+                response_time = (time.monotonic() - start_time) * 1000
+                self.audit._log(scope, f"ERROR_{method}_{path}", user_id, user_role, 500, response_time,
+                                metadata={'error': str(e)})
+            
+            logger.exception("Unhandled exception in %s", path)
+            
+            # Too late for a structured error once headers are on the wire
+            if response_started:
+                raise
+            
+            await self.errors._error_response(scope, e)(scope, receive, send)
+            return
+        
+        response_time = (time.monotonic() - start_time) * 1000
+        self.metrics.record(path, status_code, response_time)
+        if not probe:
+            self.audit._log(scope, f"{method}_{path}", user_id, user_role, status_code, response_time)
+
+
 # Utility function to configure all middleware
-def configure_middleware(app, services):
+def configure_middleware(app, services, fused: bool = True):
     """
     Configure all middleware in correct order
     Order matters: Security -> CORS -> Rate Limit -> Cache -> Audit -> Metrics -> Error Handling
+    
+    With fused=True (production) the stack is installed as one FusedMiddleware;
+    pass fused=False for separate layers, e.g. to add RequestLoggingMiddleware.
     """
     
+    audit_queue = asyncio.Queue(maxsize=AUDIT_QUEUE_SIZE)
+    
+    async def start_audit_writer():
+        app.state.audit_writer = asyncio.create_task(_audit_writer(audit_queue, services.audit_service))
+    
+    async def stop_audit_writer():
+        # Stop the writer and flush anything still queued. Not cancelled: the
+        # writer may hold a dequeued batch, which it writes before exiting
+        await audit_queue.put(_AUDIT_STOP)
+        await app.state.audit_writer
+        services.audit_service.bulk_insert([audit_queue.get_nowait() for _ in range(audit_queue.qsize())])
+    
+    app.add_event_handler("startup", start_audit_writer)
+    app.add_event_handler("shutdown", stop_audit_writer)
+    
+    rate_limit_options = dict(max_requests=100, window_seconds=60, redis_url=os.environ.get("REDIS_URL"))
+    
+    # The returned instance reads the installed metrics' counters
+    metrics_middleware = MetricsMiddleware(app=None)
+    
+    if fused:
+        app.add_middleware(
+            FusedMiddleware,
+            errors=ErrorHandlingMiddleware(None),
+            metrics=metrics_middleware,
+            audit=AuditMiddleware(
+                None,
+                audit_service=services.audit_service,
+                auth_middleware=services.auth_middleware,
+                audit_queue=audit_queue
+            ),
+            cache=CacheMiddleware(None, ttl_seconds=300),
+            rate_limit=RateLimitMiddleware(None, **rate_limit_options)
+        )
+        return metrics_middleware
+    
     # 1. Security headers (first)
     app.add_middleware(SecurityHeadersMiddleware)
     
@@ -394,21 +877,21 @@ def configure_middleware(app, services):
     # app.add_middleware(CORSMiddleware, ...)
     
     # 3. Rate limiting
-    app.add_middleware(RateLimitMiddleware, max_requests=100, window_seconds=60)
+    app.add_middleware(RateLimitMiddleware, **rate_limit_options)
     
     # 4. Cache middleware
     app.add_middleware(CacheMiddleware, ttl_seconds=300)
     
-    # 5. Audit logging
+    # 5. Audit logging (rows are batched to the DB by a background task)
     app.add_middleware(
         AuditMiddleware,
         audit_service=services.audit_service,
-        auth_middleware=services.auth_middleware
+        auth_middleware=services.auth_middleware,
+        audit_queue=audit_queue
     )
     
     # 6. Metrics collection
-    metrics_middleware = MetricsMiddleware(app)
-    app.add_middleware(MetricsMiddleware)
+    app.add_middleware(MetricsMiddleware, shared=metrics_middleware)
     
     # 7. Request logging (development only)
     # app.add_middleware(RequestLoggingMiddleware, log_bodies=False)
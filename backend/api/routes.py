@@ -3,9 +3,14 @@ Modular route definitions for AYUSH Terminology Bridge API
 Separates concerns: auth, terminology, FHIR, analytics, audit
 """
 
-from fastapi import APIRouter, HTTPException, Depends, Header
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
+from fastapi import APIRouter, HTTPException, Depends, Header, Request
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Any, List, Optional, Dict
+from urllib.parse import urlsplit
+from datetime import datetime
+import asyncio
+import orjson
 import time
 
 # Import services (will be injected)
@@ -16,36 +21,58 @@ from services.fhir_generator import FHIRGenerator
 from services.ml_matcher import SemanticMatcher
 from services.audit_service import AuditService
 from services.abha_auth import ABHAAuthService, AuthMiddleware
+from services.response_cache import ResponseCache
 
 # ============= REQUEST/RESPONSE MODELS =============
 
-class LoginRequest(BaseModel):
-    user_id: str = Field(..., example="DR001")
-    password: str = Field(..., example="demo_password")
+class APIModel(BaseModel):
+    """Base for request bodies: ignore unknown fields, skip re-validation on assignment"""
+    model_config = ConfigDict(extra='ignore', validate_assignment=False)
 
-class SearchRequest(BaseModel):
-    query: str = Field(..., example="diabetes")
+class LoginRequest(APIModel):
+    user_id: str = Field(..., json_schema_extra={'example': "DR001"})
+    password: str = Field(..., json_schema_extra={'example': "demo_password"})
+
+class SearchRequest(APIModel):
+    query: str = Field(..., json_schema_extra={'example': "diabetes"})
     limit: Optional[int] = Field(10, ge=1, le=50)
     use_ml: Optional[bool] = Field(True, description="Use ML semantic matching")
 
-class TranslateRequest(BaseModel):
-    namaste_code: str = Field(..., example="NAM0004")
+class TranslateRequest(APIModel):
+    namaste_code: str = Field(..., json_schema_extra={'example': "NAM0004"})
     use_ml: Optional[bool] = Field(True, description="Use ML hybrid matching")
 
-class ConditionRequest(BaseModel):
-    namaste_code: str = Field(..., example="NAM0004")
-    icd_codes: List[str] = Field(..., example=["TM2.7", "5A00"])
-    patient_id: str = Field(..., example="PATIENT-001")
-    abha_id: Optional[str] = Field(None, example="12-3456-7890-1234")
+class ConditionRequest(APIModel):
+    namaste_code: str = Field(..., json_schema_extra={'example': "NAM0004"})
+    icd_codes: List[str] = Field(..., json_schema_extra={'example': ["TM2.7", "5A00"]})
+    patient_id: str = Field(..., json_schema_extra={'example': "PATIENT-001"})
+    abha_id: Optional[str] = Field(None, json_schema_extra={'example': "12-3456-7890-1234"})
 
-class ConceptMapRequest(BaseModel):
-    source_code: str = Field(..., example="NAM0004")
-    target_codes: List[str] = Field(..., example=["TM2.7", "5A00"])
+class ConceptMapRequest(APIModel):
+    source_code: str = Field(..., json_schema_extra={'example': "NAM0004"})
+    target_codes: List[str] = Field(..., json_schema_extra={'example': ["TM2.7", "5A00"]})
 
-class BatchTranslateRequest(BaseModel):
-    namaste_codes: List[str] = Field(..., example=["NAM0001", "NAM0004", "NAM0010"])
+class BatchTranslateRequest(APIModel):
+    namaste_codes: List[str] = Field(..., json_schema_extra={'example': ["NAM0001", "NAM0004", "NAM0010"]})
     use_ml: Optional[bool] = Field(True)
 
+class BatchSubRequest(APIModel):
+    id: str = Field(..., json_schema_extra={'example': "search-1"})
+    url: str = Field(..., json_schema_extra={'example': "/api/terminology/search?q=diabetes"})
+    method: str = Field("GET", json_schema_extra={'example': "GET"})
+    body: Optional[Any] = None
+
+class BatchRequest(APIModel):
+    requests: List[BatchSubRequest] = Field(..., max_length=50)
+
+class BatchSubResponse(APIModel):
+    id: str
+    status: int
+    body: Optional[Any] = None
+
+class BatchResponse(APIModel):
+    responses: List[BatchSubResponse]
+
 # ============= DEPENDENCY INJECTION =============
 
 class ServiceContainer:
@@ -79,13 +106,15 @@ def get_services() -> ServiceContainer:
         raise RuntimeError("Services not initialized")
     return services
 
-async def get_current_user(authorization: Optional[str] = Header(None)) -> dict:
+async def get_current_user(request: Request, authorization: Optional[str] = Header(None)) -> dict:
     """Dependency to extract and verify user from token"""
     if not authorization:
         raise HTTPException(status_code=401, detail="Authorization header missing")
     
-    svc = get_services()
-    user = svc.auth_middleware.authenticate_request(authorization)
+    # Reuse the payload AuditMiddleware already decoded for this request
+    user = request.scope.get("state", {}).get("user")
+    if user is None:
+        user = get_services().auth_middleware.authenticate_request(authorization)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
     
@@ -93,7 +122,7 @@ async def get_current_user(authorization: Optional[str] = Header(None)) -> dict:
 
 # ============= AUTHENTICATION ROUTES =============
 
-auth_router = APIRouter(prefix="/api/auth", tags=["Authentication"])
+auth_router = APIRouter(prefix="/api/auth", tags=["Authentication"], default_response_class=ORJSONResponse)
 
 @auth_router.post("/login")
 async def login(request: LoginRequest, svc: ServiceContainer = Depends(get_services)):
@@ -128,10 +157,12 @@ async def get_userinfo(current_user: dict = Depends(get_current_user)):
 
 @auth_router.post("/logout")
 async def logout(
+    authorization: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user),
     svc: ServiceContainer = Depends(get_services)
 ):
     """Logout and invalidate session"""
+    svc.auth_middleware.invalidate(authorization)
     svc.audit_service.log_api_call(
         action_type="LOGOUT",
         user_id=current_user['user_id'],
@@ -157,7 +188,23 @@ async def refresh_token(
 
 # ============= TERMINOLOGY ROUTES =============
 
-terminology_router = APIRouter(prefix="/api/terminology", tags=["Terminology"])
+terminology_router = APIRouter(prefix="/api/terminology", tags=["Terminology"], default_response_class=ORJSONResponse)
+
+# Repeated clinical queries are served from here instead of re-running the pipeline
+response_cache = ResponseCache()
+
+# Identical requests already being computed, keyed like response_cache
+inflight: Dict[tuple, asyncio.Task] = {}
+
+async def _singleflight(key: tuple, coro_factory):
+    """Run coro_factory() once per key; concurrent callers with the same key await that run"""
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(coro_factory())
+        inflight[key] = task
+        task.add_done_callback(lambda _: inflight.pop(key, None))
+    # Shielded so one caller disconnecting does not cancel the work for the others
+    return await asyncio.shield(task)
 
 @terminology_router.get("/search")
 async def search_namaste(
@@ -173,20 +220,22 @@ async def search_namaste(
     """
     start_time = time.time()
     
-    # Basic fuzzy search
-    results = svc.namaste_parser.search_codes(q, limit)
+    cache_key = ('search', q, use_ml, limit)
+    cached = response_cache.get(cache_key)
     
-    # Enhanced ML semantic search if requested
-    if use_ml and results:
-        enhanced_results = []
-        for result in results:
-            semantic_score = svc.ml_matcher.compute_similarity(q, result['display'])
-            result['semantic_score'] = semantic_score
-            result['combined_score'] = (result['match_score'] + semantic_score) / 2
-            enhanced_results.append(result)
-        
-        enhanced_results.sort(key=lambda x: x['combined_score'], reverse=True)
-        results = enhanced_results
+    # ML searches also match earlier queries that mean the same thing
+    query_emb = None
+    if cached is None and use_ml:
+        query_emb = (await asyncio.to_thread(svc.ml_matcher.encode_batch, [q]))[0]
+        cached = response_cache.get_similar(('search', limit), query_emb)
+    
+    if cached is not None:
+        results = cached['results']
+    else:
+        results = await _singleflight(cache_key, lambda: _search(svc, q, limit, use_ml, query_emb))
+        response_cache.set(cache_key, {"results": results})
+        if query_emb is not None:
+            response_cache.add_similar(('search', limit), query_emb, {"results": results})
     
     # Log search
     top_result = results[0]['code'] if results else None
@@ -204,9 +253,39 @@ async def search_namaste(
         "results": results,
         "count": len(results),
         "ml_enabled": use_ml,
+        "cached": cached is not None,
         "response_time_ms": round(response_time, 2)
     }
 
+async def _search(svc: ServiceContainer, q: str, limit: int, use_ml: bool,
+                  query_emb=None) -> List[Dict]:
+    """Fuzzy search, re-ranked semantically when use_ml is set"""
+    if use_ml and svc.namaste_parser.ann_index is not None:
+        # Top-k candidates from the ANN index, ranked by fuzzy + semantic score
+        if query_emb is None:
+            query_emb = (await asyncio.to_thread(svc.ml_matcher.encode_batch, [q]))[0]
+        return svc.namaste_parser.hybrid_search(q, query_emb, limit)
+    
+    # Basic fuzzy search
+    results = svc.namaste_parser.search_codes(q, limit)
+    
+    # Enhanced ML semantic search if requested (one batched encode for all results)
+    if use_ml and results:
+        scores = await asyncio.to_thread(
+            svc.ml_matcher.score_candidates, q,
+            [r['code'] for r in results], [r['display'] for r in results]
+        )
+        enhanced_results = []
+        for result, semantic_score in zip(results, scores.tolist()):
+            result['semantic_score'] = semantic_score
+            result['combined_score'] = (result['match_score'] + semantic_score) / 2
+            enhanced_results.append(result)
+        
+        enhanced_results.sort(key=lambda x: x['combined_score'], reverse=True)
+        results = enhanced_results
+    
+    return results
+
 @terminology_router.post("/translate")
 async def translate_code(
     request: TranslateRequest,
@@ -219,32 +298,52 @@ async def translate_code(
     """
     start_time = time.time()
     
+    cache_key = ('translate', request.namaste_code, request.use_ml)
+    mapping = response_cache.get(cache_key)
+    if mapping is None:
+        mapping = await _singleflight(cache_key, lambda: _translate(svc, request.namaste_code, request.use_ml))
+        response_cache.set(cache_key, mapping)
+    mapping = dict(mapping)
+    
+    # Log translation
+    svc.audit_service.log_translation(
+        user_id=current_user['user_id'],
+        source_code=request.namaste_code,
+        target_system='ICD-11',
+        target_codes=[m['code'] for m in mapping.get('icd11_tm2_matches', [])[:3]],
+        confidence_score=mapping.get('confidence', 0)
+    )
+    
+    response_time = (time.time() - start_time) * 1000
+    mapping['response_time_ms'] = round(response_time, 2)
+    
+    return mapping
+
+async def _translate(svc: ServiceContainer, namaste_code: str, use_ml: bool) -> Dict:
+    """Mapping for one code, re-ranked semantically when use_ml is set"""
     # Get basic mapping
-    mapping = svc.mapping_engine.translate_namaste_to_icd(request.namaste_code)
+    mapping = svc.mapping_engine.translate_namaste_to_icd(namaste_code)
     
     if 'error' in mapping:
         raise HTTPException(status_code=404, detail=mapping['error'])
     
     # Enhance with ML if requested
-    if request.use_ml:
+    if use_ml:
         namaste_data = mapping['namaste']
         
         # Get ICD candidates for re-ranking
         tm2_matches = mapping.get('icd11_tm2_matches', [])
         bio_matches = mapping.get('icd11_biomedicine_matches', [])
         
-        # Re-rank using ML semantic similarity
-        for match in tm2_matches:
-            match['ml_score'] = svc.ml_matcher.compute_similarity(
-                namaste_data['display'],
-                match['title']
-            )
-        
-        for match in bio_matches:
-            match['ml_score'] = svc.ml_matcher.compute_similarity(
-                namaste_data['display'],
-                match['title']
-            )
+        # Re-rank using ML semantic similarity (single batched call for both lists)
+        all_matches = tm2_matches + bio_matches
+        scores = await asyncio.to_thread(
+            svc.ml_matcher.compute_similarities_batch,
+            namaste_data['display'],
+            [m['title'] for m in all_matches]
+        )
+        for match, score in zip(all_matches, scores.tolist()):
+            match['ml_score'] = score
         
         # Sort by ML score
         tm2_matches.sort(key=lambda x: x.get('ml_score', 0), reverse=True)
@@ -252,18 +351,6 @@ async def translate_code(
         
         mapping['ml_enhanced'] = True
     
-    # Log translation
-    svc.audit_service.log_translation(
-        user_id=current_user['user_id'],
-        source_code=request.namaste_code,
-        target_system='ICD-11',
-        target_codes=[m['code'] for m in mapping.get('icd11_tm2_matches', [])[:3]],
-        confidence_score=mapping.get('confidence', 0)
-    )
-    
-    response_time = (time.time() - start_time) * 1000
-    mapping['response_time_ms'] = round(response_time, 2)
-    
     return mapping
 
 @terminology_router.post("/translate/batch")
@@ -273,36 +360,42 @@ async def batch_translate(
     svc: ServiceContainer = Depends(get_services)
 ):
     """Batch translate multiple NAMASTE codes"""
-    results = []
+    # Translations are in-memory lookups: one off-loop call for the whole batch
+    mappings = await asyncio.to_thread(svc.mapping_engine.translate_many, request.namaste_codes)
     
-    for code in request.namaste_codes:
-        try:
-            mapping = svc.mapping_engine.translate_namaste_to_icd(code)
-            
-            if request.use_ml and 'error' not in mapping:
-                # ML enhancement
-                namaste_data = mapping['namaste']
-                tm2_matches = mapping.get('icd11_tm2_matches', [])
-                
-                for match in tm2_matches:
-                    match['ml_score'] = svc.ml_matcher.compute_similarity(
-                        namaste_data['display'],
-                        match['title']
-                    )
-                tm2_matches.sort(key=lambda x: x.get('ml_score', 0), reverse=True)
-            
+    results = []
+    for code, mapping in zip(request.namaste_codes, mappings):
+        if 'error' in mapping:
             results.append({
                 "namaste_code": code,
-                "success": True,
-                "mapping": mapping
+                "success": False,
+                "error": mapping['error']
             })
-        except Exception as e:
+        else:
             results.append({
                 "namaste_code": code,
-                "success": False,
-                "error": str(e)
+                "success": True,
+                "mapping": mapping
             })
     
+    if request.use_ml:
+        # ML enhancement: score every code's TM2 candidates in one batched encode
+        enhanced = [r['mapping'] for r in results if r['success']]
+        groups = [
+            (m['namaste']['display'], [match['title'] for match in m.get('icd11_tm2_matches', [])])
+            for m in enhanced
+        ]
+        try:
+            group_scores = await asyncio.to_thread(svc.ml_matcher.compute_similarities_grouped, groups)
+        except Exception:
+            group_scores = []  # Keep the algorithmic ranking if the model fails
+        
+        for mapping, scores in zip(enhanced, group_scores):
+            tm2_matches = mapping.get('icd11_tm2_matches', [])
+            for match, score in zip(tm2_matches, scores.tolist()):
+                match['ml_score'] = score
+            tm2_matches.sort(key=lambda x: x.get('ml_score', 0), reverse=True)
+    
     return {
         "total": len(request.namaste_codes),
         "successful": len([r for r in results if r['success']]),
@@ -331,6 +424,7 @@ async def get_namaste_code(
 @terminology_router.get("/icd11/{code}")
 async def get_icd11_entity(
     code: str,
+    request: Request,
     linearization: str = "mms",
     current_user: dict = Depends(get_current_user),
     svc: ServiceContainer = Depends(get_services)
@@ -340,7 +434,9 @@ async def get_icd11_entity(
     Supports both TM2 and MMS linearizations
     """
     try:
-        entity = svc.icd_client.get_entity(code, linearization)
+        # Shares the app's pooled client when one was opened at startup
+        http_client = getattr(request.app.state, 'http_client', None)
+        entity = await svc.icd_client.get_entity_async(code, linearization, http_client)
         
         if not entity:
             raise HTTPException(status_code=404, detail=f"ICD-11 code {code} not found")
@@ -356,7 +452,7 @@ async def get_icd11_entity(
 
 # ============= FHIR ROUTES =============
 
-fhir_router = APIRouter(prefix="/api/fhir", tags=["FHIR"])
+fhir_router = APIRouter(prefix="/api/fhir", tags=["FHIR"], default_response_class=ORJSONResponse)
 
 @fhir_router.post("/Condition")
 async def create_condition_resource(
@@ -370,25 +466,24 @@ async def create_condition_resource(
     if not namaste_data:
         raise HTTPException(status_code=404, detail=f"NAMASTE code {request.namaste_code} not found")
     
-    # Create FHIR Condition
-    condition = svc.fhir_gen.create_condition(
+    # Create FHIR Condition, serialized straight from the pre-encoded skeleton
+    condition_id, body = svc.fhir_gen.create_condition_bytes(
         namaste_code=request.namaste_code,
         namaste_display=namaste_data['display'],
         icd_codes=request.icd_codes,
-        patient_id=request.patient_id,
-        abha_id=request.abha_id
+        patient_id=request.patient_id
     )
     
     # Log FHIR resource creation
     svc.audit_service.log_fhir_resource(
         user_id=current_user['user_id'],
         resource_type='Condition',
-        resource_id=condition['id'],
+        resource_id=condition_id,
         patient_id=request.patient_id,
         codes=[request.namaste_code] + request.icd_codes
     )
     
-    return condition
+    return Response(content=body, media_type="application/json")
 
 @fhir_router.post("/ConceptMap")
 async def create_concept_map(
@@ -427,12 +522,13 @@ async def get_value_set(
 ):
     """Get FHIR ValueSet for NAMASTE codes"""
     if system.lower() == "namaste":
-        codes = svc.namaste_parser.codes
         if filter:
-            codes = [c for c in codes if filter.lower() in c['display'].lower()]
+            codes = svc.namaste_parser.filter_valueset(filter.lower(), 50)
+        else:
+            codes = svc.namaste_parser.codes[:50]
         
         value_set = svc.fhir_gen.create_value_set(
-            codes=codes[:50],
+            codes=codes,
             system_name="NAMASTE"
         )
     else:
@@ -442,7 +538,7 @@ async def get_value_set(
 
 # ============= AUDIT ROUTES =============
 
-audit_router = APIRouter(prefix="/api/audit", tags=["Audit"])
+audit_router = APIRouter(prefix="/api/audit", tags=["Audit"], default_response_class=ORJSONResponse)
 
 @audit_router.get("/recent")
 async def get_recent_audit_logs(
@@ -487,20 +583,26 @@ async def export_audit_logs(
     current_user: dict = Depends(get_current_user),
     svc: ServiceContainer = Depends(get_services)
 ):
-    """Export audit logs (admin only)"""
+    """Export audit logs (admin only) as newline-delimited JSON, oldest first"""
     if current_user.get('role') != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    logs = svc.audit_service.export_logs(start_date, end_date)
-    return {
-        "logs": logs,
-        "count": len(logs),
-        "format": "json"
-    }
+    # Parse up front: errors inside the stream would surface after the 200 headers
+    try:
+        start = datetime.fromisoformat(start_date) if start_date else None
+        end = datetime.fromisoformat(end_date) if end_date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start_date and end_date must be ISO 8601 dates")
+    
+    def ndjson_lines():
+        for log in svc.audit_service.iter_export_logs(start, end):
+            yield orjson.dumps(log) + b"\n"
+    
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
 
 # ============= ANALYTICS ROUTES =============
 
-analytics_router = APIRouter(prefix="/api/analytics", tags=["Analytics"])
+analytics_router = APIRouter(prefix="/api/analytics", tags=["Analytics"], default_response_class=ORJSONResponse)
 
 @analytics_router.get("/popular-searches")
 async def get_popular_searches(
@@ -539,11 +641,76 @@ async def get_dashboard_statistics(
     if current_user.get('role') not in ['admin', 'researcher']:
         raise HTTPException(status_code=403, detail="Insufficient permissions")
     
-    return {
-        "total_searches": svc.audit_service.get_total_searches(),
-        "total_translations": svc.audit_service.get_total_translations(),
-        "total_users": svc.audit_service.get_total_users(),
-        "popular_codes": svc.audit_service.get_popular_codes(10),
-        "recent_activity": svc.audit_service.get_recent_logs(20),
-        "translation_stats": svc.audit_service.get_translation_statistics()
-    }
\ No newline at end of file
+    return await asyncio.to_thread(svc.audit_service.get_dashboard_stats, 10, 20)
+
+# ============= BATCH ROUTES =============
+
+batch_router = APIRouter(prefix="/api", tags=["Batch"], default_response_class=ORJSONResponse)
+
+BATCH_CONCURRENCY = 16
+
+async def _dispatch(request: Request, user: dict, sub: BatchSubRequest) -> BatchSubResponse:
+    """Run one sub-request through the app's router, skipping the HTTP middleware stack"""
+    url = urlsplit(sub.url)
+    body = b"" if sub.body is None else orjson.dumps(sub.body)
+    headers = [(k, v) for k, v in request.scope["headers"] if k in (b"authorization", b"accept")]
+    headers.append((b"content-type", b"application/json"))
+    headers.append((b"content-length", str(len(body)).encode()))
+    scope = {
+        **request.scope,
+        "method": sub.method.upper(),
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "headers": headers,
+        # get_current_user picks this up, so the token is verified once per batch
+        "state": {"user": user},
+    }
+    
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+    
+    status = 500
+    chunks = []
+    
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+    
+    await request.app.router(scope, receive, send)
+    raw = b"".join(chunks)
+    try:
+        payload = orjson.loads(raw) if raw else None
+    except ValueError:
+        payload = raw.decode(errors="replace")
+    return BatchSubResponse(id=sub.id, status=status, body=payload)
+
+@batch_router.post("/batch", response_model=BatchResponse)
+async def batch(
+    batch_request: BatchRequest,
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Execute several API calls in one round-trip
+    
+    Sub-requests run concurrently against the in-process router and share
+    this request's authentication; a failing sub-request gets its own
+    error status without affecting the others.
+    """
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    
+    async def execute(sub: BatchSubRequest) -> BatchSubResponse:
+        if urlsplit(sub.url).path.rstrip('/') == "/api/batch":
+            return BatchSubResponse(id=sub.id, status=400, body={"detail": "Nested batch requests are not allowed"})
+        async with semaphore:
+            try:
+                return await _dispatch(request, current_user, sub)
+            except Exception as e:
+                return BatchSubResponse(id=sub.id, status=500, body={"detail": str(e)})
+    
+    responses = await asyncio.gather(*(execute(sub) for sub in batch_request.requests))
+    return BatchResponse(responses=list(responses))
@@ -3,12 +3,17 @@ Database Models and Connection for AYUSH Terminology Bridge
 Supports: SQLite (development), PostgreSQL (production)
 """
 
-from sqlalchemy import create_engine, Column, String, Integer, Float, DateTime, Boolean, Text, JSON
+from sqlalchemy import create_engine, event, text, Index, Column, String, Integer, Float, DateTime, Boolean, Text, JSON
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.pool import NullPool, QueuePool
 from datetime import datetime
+from functools import lru_cache
 from typing import Optional, List, Dict
+import asyncio
 import json
+import logging
 import os
 
 # ============= DATABASE CONFIGURATION =============
@@ -24,13 +29,31 @@ DATABASE_URL = os.getenv(
 
 # Create engine
 if DATABASE_URL.startswith("sqlite"):
+    # A connection per session; WAL lets readers proceed while a writer commits
     engine = create_engine(
         DATABASE_URL,
+        poolclass=NullPool,
         connect_args={"check_same_thread": False},
         echo=False  # Set to True for SQL query logging
     )
+    
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
 else:
-    engine = create_engine(DATABASE_URL, echo=False)
+    engine = create_engine(
+        DATABASE_URL,
+        poolclass=QueuePool,
+        pool_size=int(os.getenv("DB_POOL_SIZE", 20)),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 20)),
+        pool_pre_ping=True,
+        pool_recycle=3600,  # Drop connections before the server times them out
+        echo=False
+    )
 
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -64,6 +87,15 @@ class User(Base):
 class AuditLog(Base):
     """Audit log model for tracking all system activities"""
     __tablename__ = "audit_logs"
+    __table_args__ = (
+        # Per-user activity newest-first, and per-action aggregation, as single index range scans
+        Index("ix_audit_user_time", "user_id", text("timestamp DESC")),
+        Index("ix_audit_action_time", "action_type", "timestamp"),
+    ) + (
+        # JSONB containment/key lookups on metadata; SQLite stores it as plain JSON text
+        () if DATABASE_URL.startswith("sqlite")
+        else (Index("ix_audit_meta_gin", "metadata", postgresql_using="gin"),)
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     timestamp = Column(DateTime, default=datetime.utcnow, index=True)
@@ -78,12 +110,17 @@ class AuditLog(Base):
     response_time_ms = Column(Float)
     request_body = Column(Text, nullable=True)
     response_body = Column(Text, nullable=True)
-    metadata = Column(JSON, nullable=True)
+    # Column keeps its "metadata" name; the attribute can't, Base.metadata is reserved
+    meta = Column("metadata", JSONB().with_variant(JSON(), "sqlite"), nullable=True)
     error_message = Column(Text, nullable=True)
 
 class SearchLog(Base):
     """Search activity log for analytics"""
     __tablename__ = "search_logs"
+    __table_args__ = (
+        Index("ix_search_query_time", "query", "timestamp"),
+        Index("ix_search_user_time", "user_id", text("timestamp DESC")),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     timestamp = Column(DateTime, default=datetime.utcnow, index=True)
@@ -97,6 +134,10 @@ class SearchLog(Base):
 class TranslationLog(Base):
     """Translation activity log for analytics"""
     __tablename__ = "translation_logs"
+    __table_args__ = (
+        Index("ix_translation_code_time", "namaste_code", "timestamp"),
+        Index("ix_translation_user_time", "user_id", text("timestamp DESC")),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     timestamp = Column(DateTime, default=datetime.utcnow, index=True)
@@ -170,12 +211,15 @@ def get_db() -> Session:
     finally:
         db.close()
 
-def create_default_users(db: Session):
-    """Create default demo users"""
+@lru_cache(maxsize=None)
+def _hash_password(password: str) -> str:
+    """bcrypt hash of a default password, computed once per distinct password"""
     from passlib.context import CryptContext
     
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-    
+    return CryptContext(schemes=["bcrypt"], deprecated="auto").hash(password)
+
+def create_default_users(db: Session):
+    """Create default demo users"""
     default_users = [
         {
             "user_id": "DR001",
@@ -187,7 +231,7 @@ def create_default_users(db: Session):
             "facility": "AIIMS Delhi",
             "specialization": "Ayurveda",
             "license_number": "AY/DL/2020/12345",
-            "hashed_password": pwd_context.hash("demo_password")
+            "password": "demo_password"
         },
         {
             "user_id": "DR002",
@@ -199,7 +243,7 @@ def create_default_users(db: Session):
             "facility": "Banaras Hindu University",
             "specialization": "Unani",
             "license_number": "UN/UP/2019/67890",
-            "hashed_password": pwd_context.hash("demo_password")
+            "password": "demo_password"
         },
         {
             "user_id": "ADMIN001",
@@ -211,7 +255,7 @@ def create_default_users(db: Session):
             "facility": "AYUSH Ministry HQ",
             "specialization": "System Administration",
             "license_number": "ADMIN/2024/001",
-            "hashed_password": pwd_context.hash("admin_password")
+            "password": "admin_password"
         },
         {
             "user_id": "RESEARCHER001",
@@ -223,7 +267,7 @@ def create_default_users(db: Session):
             "facility": "CCRAS",
             "specialization": "Research",
             "license_number": "RES/2023/001",
-            "hashed_password": pwd_context.hash("research_password")
+            "password": "research_password"
         },
         {
             "user_id": "AUDITOR001",
@@ -235,19 +279,131 @@ def create_default_users(db: Session):
             "facility": "AYUSH Quality Assurance",
             "specialization": "Compliance",
             "license_number": "AUD/2024/001",
-            "hashed_password": pwd_context.hash("audit_password")
+            "password": "audit_password"
         }
     ]
     
-    for user_data in default_users:
-        # Check if user already exists
-        existing = db.query(User).filter(User.user_id == user_data["user_id"]).first()
-        if not existing:
-            user = User(**user_data)
-            db.add(user)
+    # One lookup for all default users, then a single bulk insert of the missing ones
+    existing = {
+        user_id for (user_id,) in
+        db.query(User.user_id).filter(User.user_id.in_([u["user_id"] for u in default_users])).all()
+    }
+    # Only hash passwords for users that will actually be inserted
+    missing = [
+        User(**{k: v for k, v in user_data.items() if k != "password"},
+             hashed_password=_hash_password(user_data["password"]))
+        for user_data in default_users if user_data["user_id"] not in existing
+    ]
     
+    db.bulk_save_objects(missing)
     db.commit()
-    print(f"✅ Created {len(default_users)} default users")
+    print(f"✅ Created {len(missing)} default users")
+
+# ============= BATCHED LOG WRITES =============
+
+logger = logging.getLogger("ayush.database")
+
+class AuditSink:
+    """
+    Buffers log rows in memory and writes them in batches
+    
+    A single background task drains the queue, grouping rows by model and
+    inserting each group with bulk_insert_mappings in one transaction per
+    flush. Rows are dropped (and counted) when the queue is full rather
+    than blocking the request that produced them.
+    """
+    
+    # Queued by stop(); _run writes the batch it holds, then exits
+    _STOP = None
+    
+    def __init__(self, session_factory=SessionLocal, maxsize: int = 10_000,
+                 batch_size: int = 500, flush_interval: float = 0.1):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self._task = None
+    
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    def put(self, model, row: Dict):
+        """Queue one row for `model` without blocking"""
+        row.setdefault('timestamp', datetime.utcnow())
+        try:
+            self.queue.put_nowait((model, row))
+        except asyncio.QueueFull:
+            self.dropped += 1
+    
+    async def start(self):
+        """
+        Start the writer task and install this sink as the module's audit_sink
+        (call from app startup)
+        """
+        global audit_sink
+        self._task = asyncio.create_task(self._run())
+        audit_sink = self
+    
+    async def stop(self):
+        """Stop the writer task and flush anything still queued (call from app shutdown)"""
+        global audit_sink
+        if audit_sink is self:
+            audit_sink = None
+        if self._task is not None:
+            # Not cancelled: the task may hold a dequeued batch, which it writes before exiting
+            await self.queue.put(self._STOP)
+            await self._task
+            self._task = None
+        self._write([self.queue.get_nowait() for _ in range(self.queue.qsize())])
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is self._STOP:
+                return
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception:
+                logger.exception("Failed to write %d log rows", len(batch))
+    
+    def _write(self, batch: List):
+        if not batch:
+            return
+        
+        rows_by_model = {}
+        for model, row in batch:
+            rows_by_model.setdefault(model, []).append(row)
+        
+        db = self.session_factory()
+        try:
+            for model, rows in rows_by_model.items():
+                db.bulk_insert_mappings(model, rows)
+            db.commit()
+        finally:
+            db.close()
+
+# The started AuditSink, if any (see AuditSink.start); makes DatabaseManager.log_* non-blocking
+audit_sink: Optional[AuditSink] = None
 
 # ============= DATABASE UTILITIES =============
 
@@ -257,6 +413,9 @@ class DatabaseManager:
     @staticmethod
     def log_audit(db: Session, **kwargs):
         """Log audit entry"""
+        if audit_sink is not None and audit_sink.running:
+            audit_sink.put(AuditLog, kwargs)
+            return None
         log = AuditLog(**kwargs)
         db.add(log)
         db.commit()
@@ -265,6 +424,9 @@ class DatabaseManager:
     @staticmethod
     def log_search(db: Session, **kwargs):
         """Log search activity"""
+        if audit_sink is not None and audit_sink.running:
+            audit_sink.put(SearchLog, kwargs)
+            return None
         log = SearchLog(**kwargs)
         db.add(log)
         db.commit()
@@ -273,6 +435,9 @@ class DatabaseManager:
     @staticmethod
     def log_translation(db: Session, **kwargs):
         """Log translation activity"""
+        if audit_sink is not None and audit_sink.running:
+            audit_sink.put(TranslationLog, kwargs)
+            return None
         log = TranslationLog(**kwargs)
         db.add(log)
         db.commit()
@@ -281,6 +446,9 @@ class DatabaseManager:
     @staticmethod
     def log_fhir_resource(db: Session, **kwargs):
         """Log FHIR resource creation"""
+        if audit_sink is not None and audit_sink.running:
+            audit_sink.put(FHIRResourceLog, kwargs)
+            return None
         log = FHIRResourceLog(**kwargs)
         db.add(log)
         db.commit()
@@ -299,9 +467,13 @@ class DatabaseManager:
     @staticmethod
     def get_user_statistics(db: Session, user_id: str) -> Dict:
         """Get statistics for a user"""
-        total_searches = db.query(SearchLog).filter(SearchLog.user_id == user_id).count()
-        total_translations = db.query(TranslationLog).filter(TranslationLog.user_id == user_id).count()
-        total_fhir = db.query(FHIRResourceLog).filter(FHIRResourceLog.user_id == user_id).count()
+        # One round-trip; each subquery is a range scan on its (user_id, ...) index
+        total_searches, total_translations, total_fhir = db.execute(text(
+            "SELECT "
+            "(SELECT COUNT(*) FROM search_logs WHERE user_id = :u), "
+            "(SELECT COUNT(*) FROM translation_logs WHERE user_id = :u), "
+            "(SELECT COUNT(*) FROM fhir_resource_logs WHERE user_id = :u)"
+        ), {"u": user_id}).one()
         
         return {
             "total_searches": total_searches,
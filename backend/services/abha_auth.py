@@ -6,10 +6,53 @@ Simulated authentication for demo purposes - can be connected to real ABDM APIs
 import jwt
 import hashlib
 import secrets
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Dict, Optional
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Callable, Dict, Optional
 import json
 import os
+import re
+
+from cachetools import TTLCache
+
+try:
+    from cryptography.hazmat.primitives.serialization import load_pem_private_key, load_pem_public_key
+except ImportError:  # Only needed for asymmetric JWT algorithms
+    load_pem_private_key = load_pem_public_key = None
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:  # stdlib parser accepts the same bytes
+    _json_loads = json.loads
+
+# Verified-token LRU bounds: entry count and maximum age regardless of the token's exp
+VERIFY_CACHE_SIZE = 4096
+VERIFY_CACHE_MAX_AGE_SECONDS = 300
+
+# Role hierarchy shared by ABHAAuthService and AuthMiddleware; unknown roles rank 0
+ROLE_LEVELS = MappingProxyType({
+    'admin': 4,
+    'auditor': 3,
+    'researcher': 2,
+    'practitioner': 1
+})
+UNKNOWN_REQUIRED_LEVEL = 999  # Unknown required roles are never satisfied
+
+@lru_cache(maxsize=None)
+def make_role_guard(required_role: str) -> Callable[[Optional[Dict]], bool]:
+    """Predicate on a token payload, with the required level resolved once per role"""
+    required_level = ROLE_LEVELS.get(required_role, UNKNOWN_REQUIRED_LEVEL)
+    
+    def guard(user_payload: Optional[Dict]) -> bool:
+        return bool(user_payload) and ROLE_LEVELS.get(user_payload.get('role'), 0) >= required_level
+    
+    return guard
+
+# JWT algorithm prefixes that sign with a PEM key pair instead of the shared secret
+ASYMMETRIC_JWT_PREFIXES = ('RS', 'PS', 'ES', 'EdDSA')
 
 class ABHAAuthService:
     def __init__(self, config_path: str = 'config/abha_config.json'):
@@ -19,18 +62,60 @@ class ABHAAuthService:
         
         # CHANGED: Use secret key from the loaded config file for consistency
         self.secret_key = os.environ.get('JWT_SECRET_KEY', self.config.get('jwt_settings', {}).get('secret_key', 'your-secret-key-change-in-production'))
+        self._load_jwt_keys()
         
         # ADDED: Load users from the config file, not a hardcoded list
         # This converts the list of users from JSON into a dictionary keyed by user_id
         self.users_db = {user['user_id']: user for user in self.config.get('mock_users', [])}
         if not self.users_db:
              print("⚠️  Warning: No mock users found in abha_config.json")
+        self._by_email = {user['email']: user for user in self.users_db.values() if user.get('email')}
+        
+        # ABHA ID format check, compiled once from config
+        validation_config = self.config.get('abha_validation', {})
+        self._abha_validate_enabled = validation_config.get('validate_abha_format', True)
+        self._abha_re = re.compile(validation_config.get('abha_regex', r'^\d{2}-\d{4}-\d{4}-\d{4}$'))
+        
+        # Token digest -> (expires_at, payload); the raw token is never stored
+        self._verify_cache = OrderedDict()
+    
+    def _load_jwt_keys(self):
+        """
+        Resolve the JWT algorithm and signing/verification keys once
+        
+        Asymmetric algorithms load the PEM files named by private_key_path and
+        public_key_path (or JWT_PRIVATE_KEY_PATH / JWT_PUBLIC_KEY_PATH) into key
+        objects, so PyJWT does not re-parse the PEM on every encode/decode.
+        """
+        jwt_settings = self.config.get('jwt_settings', {})
+        self.jwt_algorithm = jwt_settings.get('algorithm', 'HS256')
+        
+        if not self.jwt_algorithm.startswith(ASYMMETRIC_JWT_PREFIXES):
+            self._signing_key = self._verify_key = self.secret_key.encode()
+            return
+        
+        if load_pem_private_key is None:
+            raise RuntimeError(f"cryptography is required for {self.jwt_algorithm} JWTs")
+        
+        with open(os.environ.get('JWT_PRIVATE_KEY_PATH', jwt_settings.get('private_key_path')), 'rb') as f:
+            self._signing_key = load_pem_private_key(f.read(), password=None)
+        
+        public_key_path = os.environ.get('JWT_PUBLIC_KEY_PATH', jwt_settings.get('public_key_path'))
+        if public_key_path:
+            with open(public_key_path, 'rb') as f:
+                self._verify_key = load_pem_public_key(f.read())
+        else:
+            self._verify_key = self._signing_key.public_key()
     
     def load_config(self, config_path: str):
         """Load ABHA configuration"""
         if os.path.exists(config_path):
-            with open(config_path, 'r') as f:
-                self.config = json.load(f)
+            compiled = self._load_compiled_config(config_path)
+            if compiled is not None:
+                self.config = compiled
+                return
+            with open(config_path, 'rb') as f:
+                self.config = _json_loads(f.read())
         else:
             # Default config for demo if file is missing
             print(f"⚠️  Warning: {config_path} not found. Using default demo config.")
@@ -50,6 +135,19 @@ class ABHAAuthService:
                 }]
             }
             
+    @staticmethod
+    def _load_compiled_config(config_path: str) -> Optional[Dict]:
+        """Config pre-baked by services.compile_config, if it matches config_path as it is now"""
+        try:
+            from services import abha_config_compiled as compiled
+        except ImportError:
+            return None
+        
+        if (compiled.SOURCE_PATH != os.path.abspath(config_path)
+                or compiled.SOURCE_MTIME != os.path.getmtime(config_path)):
+            return None
+        return compiled.CONFIG
+    
     def generate_mock_abha_token(self, user_id: str, password: str) -> Optional[Dict]:
         """
         Generate mock ABHA token for demo
@@ -57,8 +155,10 @@ class ABHAAuthService:
         """
         user = self.users_db.get(user_id)
         
-        # Mock authentication: check if user exists and password matches
-        if not user or user.get('password') != password:
+        # Mock authentication: constant-time compare, also run for unknown users
+        # so response timing doesn't reveal which user_ids exist
+        stored = user.get('password', '') if user else secrets.token_urlsafe(16)
+        if not secrets.compare_digest(stored.encode(), password.encode()) or not user:
             return None
         
         # Fetch token expiration from the nested jwt_settings object
@@ -78,7 +178,7 @@ class ABHAAuthService:
             'exp': datetime.utcnow() + timedelta(minutes=expire_minutes)
         }
         
-        access_token = jwt.encode(token_data, self.secret_key, algorithm=self.config['jwt_settings']['algorithm'])
+        access_token = jwt.encode(token_data, self._signing_key, algorithm=self.jwt_algorithm)
         
         # Generate refresh token
         refresh_token = secrets.token_urlsafe(32)
@@ -102,20 +202,38 @@ class ABHAAuthService:
     
     def verify_token(self, token: str) -> Optional[Dict]:
         """Verify JWT token and return user info"""
+        cache_key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        now = time.time()
+        cached = self._verify_cache.get(cache_key)
+        if cached is not None:
+            if cached[0] > now:
+                self._verify_cache.move_to_end(cache_key)
+                return cached[1]
+            self._verify_cache.pop(cache_key, None)
+        
         try:
             payload = jwt.decode(
                 token, 
-                self.secret_key, 
-                algorithms=[self.config['jwt_settings']['algorithm']]
+                self._verify_key, 
+                algorithms=[self.jwt_algorithm]
             )
             # No need for manual expiration check, pyjwt does it automatically
-            return payload
         except jwt.ExpiredSignatureError:
             # Token has expired
             return None
         except jwt.InvalidTokenError:
             # Any other token error
             return None
+        
+        max_age = now + VERIFY_CACHE_MAX_AGE_SECONDS
+        self._verify_cache[cache_key] = (min(payload.get('exp', max_age), max_age), payload)
+        if len(self._verify_cache) > VERIFY_CACHE_SIZE:
+            self._verify_cache.popitem(last=False)
+        return payload
+    
+    def invalidate(self, token: str):
+        """Forget a verified token (e.g. on logout)"""
+        self._verify_cache.pop(hashlib.blake2b(token.encode(), digest_size=16).digest(), None)
     
     def get_user_info(self, token: str) -> Optional[Dict]:
         """Get user information from token"""
@@ -128,36 +246,13 @@ class ABHAAuthService:
     
     def check_permission(self, token: str, required_role: str) -> bool:
         """Check if user has required role/permission"""
-        payload = self.verify_token(token)
-        if not payload:
-            return False
-        
-        user_role = payload.get('role')
-        
-        # Using role_permissions from config if available, otherwise fallback
-        role_config = self.config.get('role_permissions', {}).get(user_role)
-        if role_config:
-            # A more dynamic permission check could be added here if needed
-            # For now, we stick to a simple role hierarchy
-            pass
-
-        role_levels = {
-            'admin': 4,
-            'auditor': 3,
-            'researcher': 2,
-            'practitioner': 1
-        }
-        
-        user_level = role_levels.get(user_role, 0)
-        required_level = role_levels.get(required_role, 999) # Default to a high number
-        
-        return user_level >= required_level
+        # Simple role hierarchy; role_permissions in the config is not consulted
+        return make_role_guard(required_role)(self.verify_token(token))
     
     def create_session(self, user_id: str) -> str:
         """Create session ID for tracking"""
-        session_data = f"{user_id}-{datetime.utcnow().isoformat()}-{secrets.token_hex(8)}"
-        session_id = hashlib.sha256(session_data.encode()).hexdigest()[:16]
-        return session_id
+        # 96 random bits, 16 URL-safe characters like the old truncated digest
+        return secrets.token_urlsafe(12)
     
     # ... (register_user and validate_abha_id methods can remain as they are) ...
     def register_user(self, user_data: Dict) -> Dict:
@@ -166,7 +261,11 @@ class ABHAAuthService:
         """
         user_id = f"DR{secrets.randbelow(1000):03d}"
         
-        self.users_db[user_id] = {
+        replaced = self.users_db.get(user_id)
+        if replaced and replaced.get('email'):
+            self._by_email.pop(replaced['email'], None)
+        
+        user = self.users_db[user_id] = {
             'user_id': user_id,
             'password': user_data.get('password', 'password'), # Added default password
             'abha_id': user_data.get('abha_id'),
@@ -178,6 +277,8 @@ class ABHAAuthService:
             'email': user_data.get('email'),
             'phone': user_data.get('phone')
         }
+        if user['email']:
+            self._by_email[user['email']] = user
         
         return {
             'user_id': user_id,
@@ -185,22 +286,31 @@ class ABHAAuthService:
             'message': 'User registered successfully (session only)'
         }
     
+    def get_user_by_email(self, email: str) -> Optional[Dict]:
+        """Look up a user by email address"""
+        return self._by_email.get(email)
+    
     def validate_abha_id(self, abha_id: str) -> bool:
         """Validate ABHA ID format using regex from config"""
-        import re
-        validation_config = self.config.get('abha_validation', {})
-        if not validation_config.get('validate_abha_format', True):
+        if not self._abha_validate_enabled:
             return True # Skip validation if disabled
         
-        pattern = validation_config.get('abha_regex', r'^\d{2}-\d{4}-\d{4}-\d{4}$')
-        return bool(re.match(pattern, abha_id))
+        return self._abha_re.match(abha_id) is not None
 
 
 class AuthMiddleware:
     """Middleware for FastAPI/Flask to handle authentication"""
     
-    def __init__(self, auth_service: ABHAAuthService):
+    def __init__(self, auth_service: ABHAAuthService, cache_ttl_seconds: int = 60,
+                 cache_size: int = 10_000):
         self.auth_service = auth_service
+        # Verified token claims keyed by Authorization header digest -> (expires_at, payload)
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self._token_cache = TTLCache(maxsize=cache_size, ttl=cache_ttl_seconds)
+    
+    @staticmethod
+    def _cache_key(authorization_header: str) -> str:
+        return hashlib.blake2b(authorization_header.encode(), digest_size=16).hexdigest()
     
     def authenticate_request(self, authorization_header: Optional[str]) -> Optional[Dict]:
         """
@@ -215,34 +325,40 @@ class AuthMiddleware:
         if not authorization_header:
             return None
         
+        # Serve repeat headers from the cache before parsing or re-verifying the signature
+        cache_key = self._cache_key(authorization_header)
+        now = time.time()
+        cached = self._token_cache.get(cache_key)
+        if cached and cached[0] > now:
+            return cached[1]
+        
         try:
             scheme, token = authorization_header.split()
             if scheme.lower() != 'bearer':
                 return None
-            
-            return self.auth_service.verify_token(token)
         except ValueError:
             return None
+        
+        payload = self.auth_service.verify_token(token)
+        if payload:
+            # Never cache beyond the token's own expiry
+            ttl_expiry = now + self.cache_ttl_seconds
+            expires_at = min(ttl_expiry, payload.get('exp', ttl_expiry))
+            self._token_cache[cache_key] = (expires_at, payload)
+        else:
+            self._token_cache.pop(cache_key, None)
+        
+        return payload
+    
+    def invalidate(self, authorization_header: Optional[str]):
+        """Drop the cached claims for a header (e.g. on logout)"""
+        if authorization_header:
+            self._token_cache.pop(self._cache_key(authorization_header), None)
+            self.auth_service.invalidate(authorization_header.split()[-1])
     
     def require_role(self, user_payload: Optional[Dict], required_role: str) -> bool:
         """Check if user has required role"""
-        if not user_payload:
-            return False
-        
-        # Let the auth service handle the logic
-        user_role = user_payload.get('role')
-        
-        role_levels = {
-            'admin': 4,
-            'auditor': 3,
-            'researcher': 2,
-            'practitioner': 1
-        }
-        
-        user_level = role_levels.get(user_role, 0)
-        required_level = role_levels.get(required_role, 999)
-        
-        return user_level >= required_level
+        return make_role_guard(required_role)(user_payload)
 
 # Example usage
 if __name__ == "__main__":
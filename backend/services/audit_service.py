@@ -4,18 +4,163 @@ Compliant with India's 2016 EHR Standards (ISO 22600)
 """
 
 import sqlite3
+import logging
+import queue
+import threading
+import time
 from datetime import datetime
 import json
 import hashlib
-from typing import Dict, List, Optional
+import os
+from typing import Dict, Iterable, Iterator, List, Optional
 import uuid
+from collections import Counter
+from functools import lru_cache
+
+from services.classifiers import classify_query
+
+try:
+    import blake3
+except ImportError:  # New checksums use hashlib's BLAKE2b instead
+    blake3 = None
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:  # stdlib parser accepts the same strings
+    _json_loads = json.loads
+
+logger = logging.getLogger("ayush.audit")
+
+def _timestamp(epoch: Optional[float] = None) -> str:
+    """
+    Local time as stored in every timestamp column ("YYYY-MM-DD HH:MM:SS.ffffff")
+    
+    Rows are bound as this string rather than a datetime, which sqlite3 would
+    otherwise convert through its (deprecated) default adapter on every insert.
+    """
+    moment = datetime.now() if epoch is None else datetime.fromtimestamp(epoch)
+    return moment.isoformat(' ')
+
+# Background writer: rows are committed in batches of up to WRITE_BATCH_SIZE
+WRITE_QUEUE_SIZE = 10000
+WRITE_BATCH_SIZE = 500
+WRITE_FLUSH_INTERVAL_SECONDS = 0.1
+
+# In-memory top-N counters keep at most this many terms/codes; the least
+# frequent half is dropped when full
+TOP_COUNTER_CAPACITY = 10000
+
+# The counters only see this process's writes, so they are used only when the
+# server runs a single worker (WORKERS, with the same default as api/app.py).
+# Otherwise all-time rankings are read from the history tables' covering indexes.
+SINGLE_WORKER = int(os.environ.get('WORKERS', os.cpu_count() or 1)) == 1
+
+# Algorithm for new audit checksums; set to "sha256" where compliance requires SHA-256.
+# Checksums are stored as "<algorithm>:<hex>", so rows written under any setting still verify.
+AUDIT_CHECKSUM_ALGORITHM = os.environ.get('AUDIT_CHECKSUM_ALGORITHM', 'blake3' if blake3 else 'blake2b')
+
+@lru_cache(maxsize=None)
+def _checksum_hasher(algorithm: str):
+    """bytes -> "<algorithm>:<hex>" for one algorithm, with the constructor resolved once"""
+    prefix = f"{algorithm}:"
+    if algorithm == 'blake3':
+        new = blake3.blake3
+    elif algorithm == 'blake2b':
+        def new(buf, _blake2b=hashlib.blake2b):
+            return _blake2b(buf, digest_size=32)
+    else:
+        new = getattr(hashlib, algorithm, None) or (lambda buf: hashlib.new(algorithm, buf))
+    
+    def hasher(buf: bytes) -> str:
+        return prefix + new(buf).hexdigest()
+    return hasher
 
 class AuditService:
-    def __init__(self, db_path: str = 'data/audit_logs.db'):
+    def __init__(self, db_path: str = 'data/audit_logs.db', in_memory_top: Optional[bool] = None):
 
-        """Initialize audit database"""
+        """
+        Initialize audit database
+        
+        in_memory_top serves all-time top searches/codes from per-process
+        counters; it defaults to SINGLE_WORKER. Leave it off whenever several
+        processes write to the same database.
+        """
         self.db_path = db_path
         self.init_database()
+        
+        # One shared WAL-mode connection for all writes, used under _write_lock
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('PRAGMA temp_store=MEMORY')
+        self._write_lock = threading.Lock()
+        
+        # log_* calls enqueue (sql, params); a daemon thread commits them in batches
+        self._write_q = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self.dropped = 0
+        self._writer = threading.Thread(target=self._write_loop, name="audit-writer", daemon=True)
+        self._writer.start()
+        
+        # Repeat searches/translations per (user, query or code), written by flush_aggregated
+        self._pending_searches = {}
+        self._pending_translations = {}
+        self._pending_lock = threading.Lock()
+        
+        # Search term / NAMASTE code -> hits, seeded once and updated as activity is logged;
+        # both None when rankings are read from the database
+        self._top_lock = threading.Lock()
+        if SINGLE_WORKER if in_memory_top is None else in_memory_top:
+            self._top_searches, self._top_translations = self._load_top_counters()
+        else:
+            self._top_searches = self._top_translations = None
+    
+    def _load_top_counters(self):
+        """Seed the top-N counters from the history tables"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return [
+                Counter(dict(conn.execute(f'''
+                    SELECT {column}, SUM(hit_count) AS count FROM {table}
+                    GROUP BY {column} ORDER BY count DESC LIMIT ?
+                ''', (TOP_COUNTER_CAPACITY,))))
+                for table, column in (('search_history', 'search_query'),
+                                      ('translation_history', 'namaste_code'))
+            ]
+        finally:
+            conn.close()
+    
+    def _count_top(self, counter: Optional[Counter], key: str, hits: int = 1):
+        if counter is None:
+            return
+        with self._top_lock:
+            counter[key] += hits
+            if len(counter) > TOP_COUNTER_CAPACITY:
+                kept = counter.most_common(TOP_COUNTER_CAPACITY // 2)
+                counter.clear()
+                counter.update(dict(kept))
+    
+    def _top_counts(self, cursor, table: str, column: str, counter: Optional[Counter],
+                    limit: int, date_range: Optional[tuple] = None) -> List[tuple]:
+        """
+        (term or code, hits) pairs, most frequent first
+        
+        All-time rankings come from the in-memory counter when one is kept;
+        otherwise, and for a (start, end) date range, from the history table.
+        """
+        if date_range is None and counter is not None:
+            with self._top_lock:
+                return counter.most_common(limit)
+        
+        where = 'WHERE timestamp >= ? AND date(timestamp) <= ?' if date_range else ''
+        cursor.execute(f'''
+            SELECT {column}, SUM(hit_count) as count 
+            FROM {table} 
+            {where}
+            GROUP BY {column} 
+            ORDER BY count DESC 
+            LIMIT ?
+        ''', (*(date_range or ()), limit))
+        return cursor.fetchall()
     
     def init_database(self):
         """Create audit tables if not exists"""
@@ -47,6 +192,11 @@ class AuditService:
             )
         ''')
         
+        # Keyset cursor for exports
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_logs_timestamp_id ON audit_logs(timestamp, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_ts_user ON audit_logs(timestamp, user_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_status ON audit_logs(response_status)')
+        
         # Search history table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS search_history (
@@ -56,7 +206,9 @@ class AuditService:
                 search_query TEXT NOT NULL,
                 results_count INTEGER,
                 top_result_code TEXT,
-                session_id TEXT
+                session_id TEXT,
+                hit_count INTEGER DEFAULT 1,
+                query_tags TEXT
             )
         ''')
         
@@ -72,10 +224,25 @@ class AuditService:
                 confidence_tm2 FLOAT,
                 confidence_bio FLOAT,
                 mapping_method TEXT,
-                accepted BOOLEAN
+                accepted BOOLEAN,
+                hit_count INTEGER DEFAULT 1
             )
         ''')
         
+        # Databases created before aggregated logging / query tagging lack these columns
+        for table, column, ddl in (
+            ('search_history', 'hit_count', 'INTEGER DEFAULT 1'),
+            ('translation_history', 'hit_count', 'INTEGER DEFAULT 1'),
+            ('search_history', 'query_tags', 'TEXT'),
+        ):
+            columns = {row[1] for row in cursor.execute(f'PRAGMA table_info({table})')}
+            if column not in columns:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}')
+        
+        # Covering indexes for the top-N aggregates: GROUP BY + SUM read only the index
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_search_query ON search_history(search_query, hit_count)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_trans_code ON translation_history(namaste_code, hit_count)')
+        
         # Analytics aggregation table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS analytics_summary (
@@ -85,7 +252,11 @@ class AuditService:
                 total_fhir_resources INTEGER DEFAULT 0,
                 unique_users INTEGER DEFAULT 0,
                 avg_response_time_ms FLOAT,
-                top_searched_terms TEXT
+                top_searched_terms TEXT,
+                total_api_calls INTEGER DEFAULT 0,
+                status_api_calls INTEGER DEFAULT 0,
+                successful_api_calls INTEGER DEFAULT 0,
+                timed_api_calls INTEGER DEFAULT 0
             )
         ''')
 
@@ -101,37 +272,206 @@ class AuditService:
             )
         ''')
 
+        self._init_analytics_triggers(cursor)
+        
         conn.commit()
         conn.close()
         print("✅ Audit database initialized")
     
-    def _generate_checksum(self, data: Dict) -> str:
-        """Generate SHA-256 checksum for audit integrity"""
-        data_str = json.dumps(data, sort_keys=True)
-        return hashlib.sha256(data_str.encode()).hexdigest()
+    # Per-day counters in analytics_summary, maintained on insert by _init_analytics_triggers
+    _ANALYTICS_TRIGGERS = {
+        'trg_audit_agg': '''
+            CREATE TRIGGER trg_audit_agg AFTER INSERT ON audit_logs BEGIN
+                INSERT INTO analytics_summary (date) VALUES (date(NEW.timestamp))
+                    ON CONFLICT(date) DO NOTHING;
+                UPDATE analytics_summary SET
+                    total_api_calls = total_api_calls + 1,
+                    status_api_calls = status_api_calls + (NEW.response_status IS NOT NULL),
+                    successful_api_calls = successful_api_calls
+                        + COALESCE(NEW.response_status >= 200 AND NEW.response_status < 300, 0),
+                    avg_response_time_ms = CASE WHEN NEW.response_time_ms IS NULL THEN avg_response_time_ms
+                        ELSE (COALESCE(avg_response_time_ms, 0) * timed_api_calls + NEW.response_time_ms)
+                             / (timed_api_calls + 1) END,
+                    timed_api_calls = timed_api_calls + (NEW.response_time_ms IS NOT NULL)
+                WHERE date = date(NEW.timestamp);
+            END
+        ''',
+        'trg_search_agg': '''
+            CREATE TRIGGER trg_search_agg AFTER INSERT ON search_history BEGIN
+                INSERT INTO analytics_summary (date) VALUES (date(NEW.timestamp))
+                    ON CONFLICT(date) DO NOTHING;
+                UPDATE analytics_summary SET total_searches = total_searches + COALESCE(NEW.hit_count, 1)
+                WHERE date = date(NEW.timestamp);
+            END
+        ''',
+        'trg_translation_agg': '''
+            CREATE TRIGGER trg_translation_agg AFTER INSERT ON translation_history BEGIN
+                INSERT INTO analytics_summary (date) VALUES (date(NEW.timestamp))
+                    ON CONFLICT(date) DO NOTHING;
+                UPDATE analytics_summary SET total_translations = total_translations + COALESCE(NEW.hit_count, 1)
+                WHERE date = date(NEW.timestamp);
+            END
+        ''',
+        'trg_fhir_agg': '''
+            CREATE TRIGGER trg_fhir_agg AFTER INSERT ON fhir_resource_logs BEGIN
+                INSERT INTO analytics_summary (date) VALUES (date(NEW.timestamp))
+                    ON CONFLICT(date) DO NOTHING;
+                UPDATE analytics_summary SET total_fhir_resources = total_fhir_resources + 1
+                WHERE date = date(NEW.timestamp);
+            END
+        ''',
+    }
+    
+    def _init_analytics_triggers(self, cursor):
+        """Create the analytics_summary triggers, backfilling the counters when they are new"""
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(analytics_summary)')}
+        for column in ('total_api_calls', 'status_api_calls', 'successful_api_calls', 'timed_api_calls'):
+            if column not in columns:
+                cursor.execute(f'ALTER TABLE analytics_summary ADD COLUMN {column} INTEGER DEFAULT 0')
+        
+        existing = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+        if set(self._ANALYTICS_TRIGGERS) <= existing:
+            return
+        
+        for name in self._ANALYTICS_TRIGGERS:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        
+        # Rebuild the counters from the rows already logged, then keep them current
+        cursor.execute('DELETE FROM analytics_summary')
+        cursor.execute('''
+            INSERT INTO analytics_summary (
+                date, total_api_calls, status_api_calls, successful_api_calls,
+                timed_api_calls, avg_response_time_ms
+            )
+            SELECT date(timestamp), COUNT(*), COUNT(response_status),
+                   COUNT(CASE WHEN response_status >= 200 AND response_status < 300 THEN 1 END),
+                   COUNT(response_time_ms), AVG(response_time_ms)
+            FROM audit_logs GROUP BY date(timestamp)
+        ''')
+        for table, column, amount in (
+            ('search_history', 'total_searches', 'SUM(hit_count)'),
+            ('translation_history', 'total_translations', 'SUM(hit_count)'),
+            ('fhir_resource_logs', 'total_fhir_resources', 'COUNT(*)'),
+        ):
+            cursor.execute(f'''
+                INSERT INTO analytics_summary (date, {column})
+                SELECT date(timestamp), {amount} FROM {table} WHERE true GROUP BY date(timestamp)
+                ON CONFLICT(date) DO UPDATE SET {column} = excluded.{column}
+            ''')
+        
+        for sql in self._ANALYTICS_TRIGGERS.values():
+            cursor.execute(sql)
+    
+    def _enqueue(self, sql: str, params: tuple):
+        """Queue one insert for the writer thread; dropped (and counted) if the queue is full"""
+        try:
+            self._write_q.put_nowait((sql, params))
+        except queue.Full:
+            self.dropped += 1
+    
+    def _write_loop(self):
+        while True:
+            batch = [self._write_q.get()]
+            deadline = time.monotonic() + WRITE_FLUSH_INTERVAL_SECONDS
+            while len(batch) < WRITE_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._write_q.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            
+            try:
+                self._write_batch(batch)
+            except Exception:
+                logger.exception("Failed to write %d audit rows", len(batch))
+            finally:
+                for _ in batch:
+                    self._write_q.task_done()
+    
+    def _write_batch(self, batch: List[tuple]):
+        """Insert (sql, params) pairs in one transaction, one executemany per statement"""
+        rows_by_sql = {}
+        for sql, params in batch:
+            rows_by_sql.setdefault(sql, []).append(params)
+        
+        with self._write_lock:
+            self._conn.execute('BEGIN')
+            try:
+                for sql, rows in rows_by_sql.items():
+                    self._conn.executemany(sql, rows)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+    
+    def flush(self):
+        """Write everything queued so far (call from shutdown hooks)"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._write_q.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            if batch:
+                self._write_batch(batch)
+        finally:
+            for _ in batch:
+                self._write_q.task_done()
+        # Wait for any batch the writer thread is still committing
+        self._write_q.join()
+    
+    @staticmethod
+    def _generate_checksum(audit_id: str, timestamp: str, user_id: Optional[str],
+                           action_type: str, endpoint: Optional[str], method: Optional[str],
+                           response_status: Optional[int],
+                           algorithm: str = AUDIT_CHECKSUM_ALGORITHM) -> str:
+        """Checksum over the core audit fields in fixed order, tagged with its algorithm"""
+        # audit_id and timestamp are always strings; the rest may be None
+        return _checksum_hasher(algorithm)(b'\x1f'.join([
+            audit_id.encode(),
+            timestamp.encode(),
+            b'' if user_id is None else user_id.encode(),
+            b'' if action_type is None else str(action_type).encode(),
+            b'' if endpoint is None else endpoint.encode(),
+            b'' if method is None else method.encode(),
+            b'' if response_status is None else str(response_status).encode()
+        ]))
+    
+    @staticmethod
+    def _legacy_checksum(log: Dict) -> str:
+        """SHA-256 of the sorted-key JSON used before checksums carried an algorithm tag"""
+        data = {
+            'id': log['id'],
+            'timestamp': str(log['timestamp']).replace(' ', 'T'),
+            'user_id': log['user_id'],
+            'action_type': log['action_type'],
+            'endpoint': log['endpoint'],
+            'method': log['method'],
+            'response_status': log['response_status']
+        }
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
     
     def log_fhir_resource(self, user_id: str, resource_type: str, resource_id: str, patient_id: str, codes: List[str]) -> str:
         """Log FHIR resource creation"""
         log_id = str(uuid.uuid4())
-        timestamp = datetime.now()
-        
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        timestamp = _timestamp()
         
-        cursor.execute('''
-            INSERT INTO fhir_resource_logs (
-                id, timestamp, user_id, resource_type, resource_id, patient_id, codes
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        self._enqueue(self._INSERT_FHIR_SQL, (
             log_id, timestamp, user_id, resource_type, resource_id,
             patient_id, json.dumps(codes)
         ))
         
-        conn.commit()
-        conn.close()
-        
         return log_id
     
+    _INSERT_FHIR_SQL = '''
+        INSERT INTO fhir_resource_logs (
+            id, timestamp, user_id, resource_type, resource_id, patient_id, codes
+        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+    '''
+    
     def log_api_call(self, 
                      action_type: str,
                      user_id: Optional[str] = None,
@@ -173,34 +513,71 @@ class AuditService:
         Returns:
             audit_id: Unique audit log ID
         """
-        audit_id = str(uuid.uuid4())
-        timestamp = datetime.now()
-        
-        # Prepare audit data
-        audit_data = {
-            'id': audit_id,
-            'timestamp': timestamp.isoformat(),
-            'user_id': user_id,
-            'action_type': action_type,
-            'endpoint': endpoint,
-            'method': method,
-            'response_status': response_status
-        }
+        row = self._build_api_call_row(
+            action_type, user_id, user_role, endpoint, method, ip_address,
+            user_agent, request_body, response_status, response_time_ms,
+            resource_type, resource_id, consent_status, abha_id,
+            error_message, metadata
+        )
+        self._enqueue(self._INSERT_API_CALL_SQL, row)
+        
+        return row[0]
+    
+    def bulk_insert(self, rows: List[Dict]) -> int:
+        """
+        Insert many API call logs in a single transaction
         
-        checksum = self._generate_checksum(audit_data)
+        Args:
+            rows: Dicts of log_api_call keyword arguments
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        Returns:
+            Number of rows written
+        """
+        if not rows:
+            return 0
         
-        cursor.execute('''
-            INSERT INTO audit_logs (
-                id, timestamp, user_id, user_role, action_type,
-                resource_type, resource_id, endpoint, method,
-                ip_address, user_agent, request_body, response_status,
-                response_time_ms, consent_status, abha_id,
-                error_message, metadata, checksum
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        params = [self._build_api_call_row(**row) for row in rows]
+        self._write_batch([(self._INSERT_API_CALL_SQL, row) for row in params])
+        
+        return len(params)
+    
+    _INSERT_API_CALL_SQL = '''
+        INSERT INTO audit_logs (
+            id, timestamp, user_id, user_role, action_type,
+            resource_type, resource_id, endpoint, method,
+            ip_address, user_agent, request_body, response_status,
+            response_time_ms, consent_status, abha_id,
+            error_message, metadata, checksum
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    
+    def _build_api_call_row(self,
+                            action_type: str,
+                            user_id: Optional[str] = None,
+                            user_role: Optional[str] = None,
+                            endpoint: str = None,
+                            method: str = None,
+                            ip_address: str = None,
+                            user_agent: str = None,
+                            request_body: Dict = None,
+                            response_status: int = None,
+                            response_time_ms: float = None,
+                            resource_type: str = None,
+                            resource_id: str = None,
+                            consent_status: str = "granted",
+                            abha_id: str = None,
+                            error_message: str = None,
+                            metadata: Dict = None) -> tuple:
+        """Build the audit_logs insert parameters, including the integrity checksum"""
+        audit_id = str(uuid.uuid4())
+        # Stored exactly as hashed, so verification reads back the same string
+        timestamp = _timestamp()
+        
+        checksum = self._generate_checksum(
+            audit_id, timestamp, user_id, action_type, endpoint, method, response_status
+        )
+        
+        return (
             audit_id, timestamp, user_id, user_role, action_type,
             resource_type, resource_id, endpoint, method,
             ip_address, user_agent, 
@@ -209,61 +586,158 @@ class AuditService:
             error_message,
             json.dumps(metadata) if metadata else None,
             checksum
-        ))
-        
-        conn.commit()
-        conn.close()
-        
-        return audit_id
+        )
     
     def log_search(self, user_id: str, query: str, results_count: int, 
                    top_result: str = None, session_id: str = None) -> str:
         """Log search activity"""
         search_id = str(uuid.uuid4())
-        timestamp = datetime.now()
-        
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        timestamp = _timestamp()
         
-        cursor.execute('''
-            INSERT INTO search_history (
-                id, timestamp, user_id, search_query, 
-                results_count, top_result_code, session_id
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (search_id, timestamp, user_id, query, results_count, 
-              top_result, session_id))
-        
-        conn.commit()
-        conn.close()
+        self._enqueue(self._INSERT_SEARCH_SQL, (
+            search_id, timestamp, user_id, query, results_count,
+            top_result, session_id, 1, ','.join(classify_query(query))
+        ))
+        self._count_top(self._top_searches, query)
         
         return search_id
     
+    _INSERT_SEARCH_SQL = '''
+        INSERT INTO search_history (
+            id, timestamp, user_id, search_query,
+            results_count, top_result_code, session_id, hit_count, query_tags
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    
     def log_translation(self, user_id: str, namaste_code: str,
                        icd11_tm2: str = None, icd11_bio: str = None,
                        confidence_tm2: float = None, confidence_bio: float = None,
                        mapping_method: str = "hybrid", accepted: bool = True) -> str:
         """Log code translation activity"""
         trans_id = str(uuid.uuid4())
-        timestamp = datetime.now()
+        timestamp = _timestamp()
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self._enqueue(self._INSERT_TRANSLATION_SQL, (
+            trans_id, timestamp, user_id, namaste_code,
+            icd11_tm2, icd11_bio, confidence_tm2, confidence_bio,
+            mapping_method, accepted, 1
+        ))
+        self._count_top(self._top_translations, namaste_code)
         
-        cursor.execute('''
-            INSERT INTO translation_history (
-                id, timestamp, user_id, namaste_code,
-                icd11_tm2_code, icd11_bio_code,
-                confidence_tm2, confidence_bio,
-                mapping_method, accepted
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (trans_id, timestamp, user_id, namaste_code,
-              icd11_tm2, icd11_bio, confidence_tm2, confidence_bio,
-              mapping_method, accepted))
+        return trans_id
+    
+    _INSERT_TRANSLATION_SQL = '''
+        INSERT INTO translation_history (
+            id, timestamp, user_id, namaste_code,
+            icd11_tm2_code, icd11_bio_code,
+            confidence_tm2, confidence_bio,
+            mapping_method, accepted, hit_count
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    
+    _BULK_TRANSLATION_SQL = '''
+        INSERT INTO translation_history (
+            id, timestamp, user_id, namaste_code,
+            icd11_tm2_code, icd11_bio_code,
+            confidence_tm2, confidence_bio,
+            mapping_method, accepted
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    
+    def bulk_log_translations(self, rows: Iterable[tuple]) -> int:
+        """
+        Insert many translation records with one prepared statement and transaction
         
-        conn.commit()
-        conn.close()
+        Meant for imports and backfills; rows bypass the write queue and may be
+        a generator, which is consumed without being materialized.
         
-        return trans_id
+        Args:
+            rows: (id, timestamp, user_id, namaste_code, icd11_tm2_code,
+                   icd11_bio_code, confidence_tm2, confidence_bio,
+                   mapping_method, accepted) tuples; ids must be pre-generated
+                   UUID strings
+        
+        Returns:
+            Number of rows written
+        """
+        with self._write_lock:
+            self._conn.execute('BEGIN')
+            try:
+                cursor = self._conn.executemany(self._BULK_TRANSLATION_SQL, self._counted_translations(rows))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return cursor.rowcount
+    
+    def _counted_translations(self, rows: Iterable[tuple]) -> Iterator[tuple]:
+        """Pass rows through, counting each NAMASTE code towards the top-N counter"""
+        for row in rows:
+            self._count_top(self._top_translations, row[3])
+            yield row
+    
+    def record_search(self, user_id: str, query: str, results_count: int,
+                      top_result: str = None, session_id: str = None):
+        """
+        Count a search towards the next flush_aggregated call instead of writing it now
+        
+        Repeats by the same user for the same query collapse into one row whose
+        hit_count is the number of searches; the latest results are kept. Only
+        the epoch time is taken here; it is formatted once per row at flush.
+        """
+        with self._pending_lock:
+            entry = self._pending_searches.get((user_id, query))
+            hits = entry[0] + 1 if entry else 1
+            self._pending_searches[(user_id, query)] = (
+                hits, time.time(), results_count, top_result, session_id
+            )
+        self._count_top(self._top_searches, query)
+    
+    def record_translation(self, user_id: str, namaste_code: str,
+                           icd11_tm2: str = None, icd11_bio: str = None,
+                           confidence_tm2: float = None, confidence_bio: float = None,
+                           mapping_method: str = "hybrid", accepted: bool = True):
+        """Count a translation towards the next flush_aggregated call (see record_search)"""
+        key = (user_id, namaste_code, mapping_method)
+        with self._pending_lock:
+            entry = self._pending_translations.get(key)
+            hits = entry[0] + 1 if entry else 1
+            self._pending_translations[key] = (
+                hits, time.time(), icd11_tm2, icd11_bio,
+                confidence_tm2, confidence_bio, accepted
+            )
+        self._count_top(self._top_translations, namaste_code)
+    
+    def flush_aggregated(self) -> int:
+        """
+        Write the searches and translations recorded since the last flush
+        
+        Returns:
+            Number of rows written
+        """
+        with self._pending_lock:
+            searches, self._pending_searches = self._pending_searches, {}
+            translations, self._pending_translations = self._pending_translations, {}
+        if not searches and not translations:
+            return 0
+        
+        self._write_batch([
+            (self._INSERT_SEARCH_SQL, (
+                str(uuid.uuid4()), _timestamp(timestamp), user_id, query, results_count, top_result, session_id, hits,
+                ','.join(classify_query(query))
+            ))
+            for (user_id, query), (hits, timestamp, results_count, top_result, session_id)
+            in searches.items()
+        ] + [
+            (self._INSERT_TRANSLATION_SQL, (
+                str(uuid.uuid4()), _timestamp(timestamp), user_id, namaste_code, tm2, bio,
+                conf_tm2, conf_bio, mapping_method, accepted, hits
+            ))
+            for (user_id, namaste_code, mapping_method), (hits, timestamp, tm2, bio, conf_tm2, conf_bio, accepted)
+            in translations.items()
+        ])
+        
+        return len(searches) + len(translations)
     
     def get_audit_logs(self, 
                       user_id: Optional[str] = None,
@@ -272,7 +746,23 @@ class AuditService:
                       end_date: Optional[datetime] = None,
                       limit: int = 100) -> List[Dict]:
         """Retrieve audit logs with filters"""
-        conn = sqlite3.connect(self.db_path)
+        return list(self.iter_audit_logs(user_id, action_type, start_date, end_date, limit))
+    
+    def iter_audit_logs(self,
+                        user_id: Optional[str] = None,
+                        action_type: Optional[str] = None,
+                        start_date: Optional[datetime] = None,
+                        end_date: Optional[datetime] = None,
+                        limit: int = 100,
+                        batch_size: int = 500) -> Iterator[Dict]:
+        """
+        Yield audit logs with filters, fetching `batch_size` rows at a time
+        
+        Memory stays bounded by one batch, so large exports can be streamed.
+        The connection may be advanced from different threads (e.g. by a
+        streaming response), hence check_same_thread=False.
+        """
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
@@ -289,30 +779,75 @@ class AuditService:
         
         if start_date:
             query += " AND timestamp >= ?"
-            params.append(start_date.isoformat())
+            params.append(start_date.isoformat(' '))
         
         if end_date:
             query += " AND timestamp <= ?"
-            params.append(end_date.isoformat())
+            params.append(end_date.isoformat(' '))
         
         query += " ORDER BY timestamp DESC LIMIT ?"
         params.append(limit)
         
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
+        try:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    log = dict(row)
+                    # Parse JSON fields
+                    if log['request_body']:
+                        log['request_body'] = _json_loads(log['request_body'])
+                    if log['metadata']:
+                        log['metadata'] = _json_loads(log['metadata'])
+                    yield log
+        finally:
+            conn.close()
+    
+    def iter_export_logs(self,
+                         start_date: Optional[datetime] = None,
+                         end_date: Optional[datetime] = None,
+                         page_size: int = 1000) -> Iterator[Dict]:
+        """
+        Yield audit logs oldest-first using keyset pagination on (timestamp, id)
         
-        logs = []
-        for row in rows:
-            log = dict(row)
-            # Parse JSON fields
-            if log['request_body']:
-                log['request_body'] = json.loads(log['request_body'])
-            if log['metadata']:
-                log['metadata'] = json.loads(log['metadata'])
-            logs.append(log)
+        Each page is its own short query, so an export of any size holds one
+        page in memory and never keeps a read transaction open between pages.
+        """
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
         
-        conn.close()
-        return logs
+        filters = ""
+        params = []
+        if start_date:
+            filters += " AND timestamp >= ?"
+            params.append(start_date.isoformat(' '))
+        if end_date:
+            filters += " AND timestamp <= ?"
+            params.append(end_date.isoformat(' '))
+        
+        last = None
+        try:
+            while True:
+                keyset = " AND (timestamp, id) > (?, ?)" if last else ""
+                rows = conn.execute(
+                    f"SELECT * FROM audit_logs WHERE 1=1{filters}{keyset} "
+                    "ORDER BY timestamp, id LIMIT ?",
+                    params + list(last or ()) + [page_size]
+                ).fetchall()
+                if not rows:
+                    return
+                for row in rows:
+                    log = dict(row)
+                    if log['request_body']:
+                        log['request_body'] = _json_loads(log['request_body'])
+                    if log['metadata']:
+                        log['metadata'] = _json_loads(log['metadata'])
+                    yield log
+                last = (rows[-1]['timestamp'], rows[-1]['id'])
+        finally:
+            conn.close()
     
     def get_search_history(self, user_id: Optional[str] = None, 
                           limit: int = 50) -> List[Dict]:
@@ -368,54 +903,40 @@ class AuditService:
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
-        # Total searches
-        cursor.execute('SELECT COUNT(*) FROM search_history')
-        total_searches = cursor.fetchone()[0]
-        
-        # Total translations
-        cursor.execute('SELECT COUNT(*) FROM translation_history')
-        total_translations = cursor.fetchone()[0]
-        
-        # Total API calls
-        cursor.execute('SELECT COUNT(*) FROM audit_logs')
-        total_api_calls = cursor.fetchone()[0]
-        
-        # Unique users
-        cursor.execute('SELECT COUNT(DISTINCT user_id) FROM audit_logs WHERE user_id IS NOT NULL')
-        unique_users = cursor.fetchone()[0]
-        
-        # Average response time
-        cursor.execute('SELECT AVG(response_time_ms) FROM audit_logs WHERE response_time_ms IS NOT NULL')
-        avg_response_time = cursor.fetchone()[0] or 0
-        
-        # Top searched terms
+        # Counters come from the per-day rows kept current by triggers
+        start = start_date.date().isoformat() if start_date else '0000-01-01'
+        end = end_date.date().isoformat() if end_date else '9999-12-31'
         cursor.execute('''
-            SELECT search_query, COUNT(*) as count 
-            FROM search_history 
-            GROUP BY search_query 
-            ORDER BY count DESC 
-            LIMIT 10
-        ''')
-        top_searches = [{'query': row[0], 'count': row[1]} for row in cursor.fetchall()]
+            SELECT
+                COALESCE(SUM(total_searches), 0),
+                COALESCE(SUM(total_translations), 0),
+                COALESCE(SUM(total_api_calls), 0),
+                SUM(avg_response_time_ms * timed_api_calls) / NULLIF(SUM(timed_api_calls), 0),
+                SUM(successful_api_calls) * 100.0 / NULLIF(SUM(status_api_calls), 0)
+            FROM analytics_summary
+            WHERE date BETWEEN ? AND ?
+        ''', (start, end))
+        (total_searches, total_translations, total_api_calls,
+         avg_response_time, success_rate) = cursor.fetchone()
         
-        # Most translated codes
+        # Distinct users can't be summed across days; read them from the (timestamp, user_id) index
         cursor.execute('''
-            SELECT namaste_code, COUNT(*) as count 
-            FROM translation_history 
-            GROUP BY namaste_code 
-            ORDER BY count DESC 
-            LIMIT 10
-        ''')
-        top_translations = [{'code': row[0], 'count': row[1]} for row in cursor.fetchall()]
+            SELECT COUNT(DISTINCT user_id) FROM audit_logs
+            WHERE timestamp >= ? AND date(timestamp) <= ?
+        ''', (start, end))
+        unique_users = cursor.fetchone()[0]
+        avg_response_time = avg_response_time or 0
+        success_rate = success_rate or 0
         
-        # Success rate
-        cursor.execute('''
-            SELECT 
-                COUNT(CASE WHEN response_status >= 200 AND response_status < 300 THEN 1 END) * 100.0 / COUNT(*) 
-            FROM audit_logs 
-            WHERE response_status IS NOT NULL
-        ''')
-        success_rate = cursor.fetchone()[0] or 0
+        # Top searched terms and most translated codes
+        date_range = (start, end) if start_date or end_date else None
+        top_search_counts = self._top_counts(cursor, 'search_history', 'search_query',
+                                             self._top_searches, 10, date_range)
+        top_translation_counts = self._top_counts(cursor, 'translation_history', 'namaste_code',
+                                                  self._top_translations, 10, date_range)
+        
+        top_searches = [{'query': query, 'count': count} for query, count in top_search_counts]
+        top_translations = [{'code': code, 'count': count} for code, count in top_translation_counts]
         
         conn.close()
         
@@ -430,6 +951,42 @@ class AuditService:
             'top_translations': top_translations
         }
     
+    def get_dashboard_stats(self, popular_limit: int = 10, recent_limit: int = 20) -> Dict:
+        """Counts, popular codes and recent activity for the analytics dashboard"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        # All scalar aggregates in one round-trip
+        cursor.execute('''
+            SELECT
+                (SELECT COALESCE(SUM(hit_count), 0) FROM search_history),
+                COALESCE(SUM(hit_count), 0),
+                (SELECT COUNT(DISTINCT user_id) FROM audit_logs WHERE user_id IS NOT NULL),
+                AVG(confidence_tm2),
+                AVG(confidence_bio),
+                COALESCE(SUM(CASE WHEN accepted THEN hit_count ELSE 0 END), 0)
+            FROM translation_history
+        ''')
+        total_searches, total_translations, total_users, avg_tm2, avg_bio, accepted = cursor.fetchone()
+        
+        popular_codes = [{'code': code, 'count': count}
+                         for code, count in self._top_counts(cursor, 'translation_history', 'namaste_code',
+                                                             self._top_translations, popular_limit)]
+        conn.close()
+        
+        return {
+            'total_searches': total_searches,
+            'total_translations': total_translations,
+            'total_users': total_users,
+            'popular_codes': popular_codes,
+            'recent_activity': self.get_audit_logs(limit=recent_limit),
+            'translation_stats': {
+                'avg_confidence_tm2': round(avg_tm2 or 0, 4),
+                'avg_confidence_bio': round(avg_bio or 0, 4),
+                'accepted': accepted
+            }
+        }
+    
     def verify_audit_integrity(self, audit_id: str) -> bool:
         """Verify audit log hasn't been tampered with"""
         conn = sqlite3.connect(self.db_path)
@@ -446,18 +1003,18 @@ class AuditService:
         log = dict(row)
         stored_checksum = log.pop('checksum')
         
-        # Recreate checksum from core data
-        core_data = {
-            'id': log['id'],
-            'timestamp': log['timestamp'],
-            'user_id': log['user_id'],
-            'action_type': log['action_type'],
-            'endpoint': log['endpoint'],
-            'method': log['method'],
-            'response_status': log['response_status']
-        }
+        # Recreate checksum from core data with the algorithm it was written with
+        if ':' not in stored_checksum:
+            return self._legacy_checksum(log) == stored_checksum
+        
+        algorithm = stored_checksum.split(':', 1)[0]
+        if algorithm == 'blake3' and blake3 is None:
+            raise RuntimeError("blake3 is required to verify this audit record")
         
-        computed_checksum = self._generate_checksum(core_data)
+        computed_checksum = self._generate_checksum(
+            log['id'], log['timestamp'], log['user_id'], log['action_type'],
+            log['endpoint'], log['method'], log['response_status'], algorithm=algorithm
+        )
         
         return computed_checksum == stored_checksum
 
@@ -0,0 +1,39 @@
+"""
+Search query classification for audit analytics
+All patterns are matched in a single pass over the query
+"""
+
+import re
+from typing import List
+
+try:
+    import re2
+except ImportError:  # Falls back to one stdlib regex per pattern
+    re2 = None
+
+# (tag, pattern); tags are recorded against the search in the audit trail
+QUERY_PATTERNS = [
+    ('namaste_code', r'^\s*NAM\d{4}\s*$'),
+    ('icd11_tm2_code', r'^\s*TM2(\.[0-9A-Z]+)?\s*$'),
+    ('icd11_mms_code', r'^\s*[0-9A-Z][A-Z0-9]\d{2}(\.[0-9A-Z]+)?\s*$'),
+    ('abha_id', r'^\s*\d{2}-\d{4}-\d{4}-\d{4}\s*$'),
+    ('dosha_term', r'(?i)\b(vata|pitta|kapha)\b'),
+    ('non_ascii', r'[^\x00-\x7f]'),
+]
+
+QUERY_TAGS = [tag for tag, _ in QUERY_PATTERNS]
+
+if re2 is not None:
+    _QUERY_SET = re2.Set.SearchSet(re2.Options())
+    for _, pattern in QUERY_PATTERNS:
+        _QUERY_SET.Add(pattern)
+    _QUERY_SET.Compile()
+else:
+    _QUERY_SET = None
+    _QUERY_RES = [re.compile(pattern) for _, pattern in QUERY_PATTERNS]
+
+def classify_query(query: str) -> List[str]:
+    """Tags of every QUERY_PATTERNS entry matching the query, in pattern order"""
+    if _QUERY_SET is not None:
+        return [QUERY_TAGS[i] for i in sorted(_QUERY_SET.Match(query))]
+    return [tag for tag, regex in zip(QUERY_TAGS, _QUERY_RES) if regex.search(query)]
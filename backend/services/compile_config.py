@@ -0,0 +1,42 @@
+"""
+Pre-bake the ABHA JSON config into an importable Python module
+
+Run from the backend directory at deploy time:
+
+    python -m services.compile_config [config/abha_config.json]
+
+ABHAAuthService.load_config imports the generated module instead of parsing
+JSON, as long as it was built from the same file and that file is unchanged.
+"""
+
+import os
+import pprint
+import sys
+
+import orjson
+
+COMPILED_MODULE_PATH = os.path.join(os.path.dirname(__file__), 'abha_config_compiled.py')
+
+def compile_config(config_path: str = 'config/abha_config.json',
+                   output_path: str = COMPILED_MODULE_PATH) -> str:
+    """Write CONFIG, SOURCE_PATH and SOURCE_MTIME for config_path to output_path"""
+    with open(config_path, 'rb') as f:
+        config = orjson.loads(f.read())
+    
+    source = (
+        '# Generated by services/compile_config.py; do not edit\n'
+        f'SOURCE_PATH = {os.path.abspath(config_path)!r}\n'
+        f'SOURCE_MTIME = {os.path.getmtime(config_path)!r}\n'
+        f'CONFIG = {pprint.pformat(config, sort_dicts=False)}\n'
+    )
+    
+    # Write then rename so a starting worker never imports a partial module
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(source)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+if __name__ == "__main__":
+    path = compile_config(*sys.argv[1:2])
+    print(f"✅ Wrote {path}")
@@ -1,14 +1,92 @@
 import csv
 import json
-from typing import List, Dict
+import os
+import re
+from difflib import SequenceMatcher
+from itertools import islice
+from typing import List, Dict, Tuple
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:  # ANN search is optional; callers fall back to fuzzy search
+    faiss = None
+
+try:
+    import ahocorasick
+except ImportError:  # Falls back to exact token lookups in the inverted index
+    ahocorasick = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # Falls back to csv.DictReader on every load
+    pa = None
+
+try:
+    from rapidfuzz import fuzz, process
+except ImportError:  # Falls back to difflib
+    fuzz = process = None
+
+_TOKEN_RE = re.compile(r'\w+')
+MIN_TOKEN_LENGTH = 3
+MIN_MATCH_SCORE = 0.3
+
+# CSV column -> code entry field
+CSV_COLUMNS = {
+    'Code': 'code',
+    'Disease_Name': 'display',
+    'System': 'system',
+    'Category': 'category',
+    'Synonyms': 'synonyms',
+    'Description': 'description',
+    'Sanskrit_Term': 'sanskrit'
+}
+
+def _similarity(a: str, b: str) -> float:
+    """Normalized edit similarity in [0, 1] (same scale as difflib's ratio)"""
+    if fuzz is not None:
+        return fuzz.ratio(a, b) / 100
+    return SequenceMatcher(None, a, b).ratio()
 
 class NAMASTEParser:
     def __init__(self, csv_path: str):
         self.csv_path = csv_path
         self.codes = []
+        self._by_id = {}
+        self.ann_index = None
+        # Lowercased displays aligned with self.codes, plus trigram -> code indices
+        self.display_lower = []
+        self.display_trigrams = {}
+        # Lowercased Sanskrit terms aligned with self.codes, and every code's synonyms
+        # flattened; synonym_offsets[i]:synonym_offsets[i + 1] are the synonyms of code i
+        self.sanskrit_lower = []
+        self.synonyms_lower = []
+        self.synonym_offsets = [0]
+        self.synonym_owner = []
+        # Column arrays aligned with self.codes for vectorized scans
+        self.codes_np = {}
+        # Token -> code indices over display/synonyms/Sanskrit, used to prefilter fuzzy search
+        self.token_index = {}
+        self.token_automaton = None
     
     def load_csv(self) -> List[Dict]:
         """Load and parse NAMASTE CSV file"""
+        if pa is not None:
+            self.codes = self._load_table()
+        else:
+            self._load_rows()
+        
+        self._by_id = {code['code']: code for code in self.codes}
+        self._build_display_index()
+        self._build_token_index()
+        return self.codes
+    
+    def _load_rows(self):
+        """Parse the CSV row by row with the stdlib reader"""
         with open(self.csv_path, 'r', encoding='utf-8') as file:
             reader = csv.DictReader(file)
             for row in reader:
@@ -25,42 +103,263 @@ class NAMASTEParser:
                     'sanskrit': row['Sanskrit_Term'].strip()
                 }
                 self.codes.append(code_entry)
+    
+    def _load_table(self) -> List[Dict]:
+        """
+        Parse the CSV with pyarrow, caching the trimmed table as a Parquet sibling
         
-        return self.codes
+        The cache is reused while it is newer than the CSV.
+        """
+        cache_path = f"{self.csv_path}.parquet"
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(self.csv_path):
+            table = pq.read_table(cache_path)
+        else:
+            table = pa_csv.read_csv(self.csv_path, convert_options=pa_csv.ConvertOptions(
+                include_columns=list(CSV_COLUMNS),
+                column_types={column: pa.string() for column in CSV_COLUMNS}
+            ))
+            table = pa.table({field: pc.utf8_trim_whitespace(pc.fill_null(table[column], ''))
+                              for column, field in CSV_COLUMNS.items()})
+            
+            # Write then rename so concurrent workers never read a partial file
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            pq.write_table(table, tmp_path)
+            os.replace(tmp_path, cache_path)
+        
+        codes = table.to_pylist()
+        for code in codes:
+            # Parse synonyms (pipe-separated)
+            code['synonyms'] = [s.strip() for s in code['synonyms'].split('|')] if code['synonyms'] else []
+        return codes
+    
+    def _build_display_index(self):
+        """Precompute lowercase displays, column arrays and a trigram index for substring filters"""
+        self.display_lower = [code['display'].lower() for code in self.codes]
+        self.sanskrit_lower = [code['sanskrit'].lower() for code in self.codes]
+        self.synonyms_lower = [syn.lower() for code in self.codes for syn in code['synonyms']]
+        self.synonym_offsets = np.cumsum([0] + [len(code['synonyms']) for code in self.codes]).tolist()
+        self.synonym_owner = [idx for idx, code in enumerate(self.codes) for _ in code['synonyms']]
+        self.codes_np = {
+            'code': np.array([code['code'] for code in self.codes], dtype=str),
+            'display': np.array([code['display'] for code in self.codes], dtype=str),
+            'display_lower': np.array(self.display_lower, dtype=str)
+        }
+        self.display_trigrams = {}
+        for idx, text in enumerate(self.display_lower):
+            for i in range(len(text) - 2):
+                self.display_trigrams.setdefault(text[i:i + 3], set()).add(idx)
+    
+    def _build_token_index(self):
+        """Index searchable tokens and compile them into an Aho-Corasick automaton"""
+        self.token_index = {}
+        for idx, code in enumerate(self.codes):
+            for text in [code['display'], code['sanskrit'], *code['synonyms']]:
+                for token in _TOKEN_RE.findall(text.lower()):
+                    if len(token) >= MIN_TOKEN_LENGTH:
+                        self.token_index.setdefault(token, set()).add(idx)
+        
+        self.token_automaton = None
+        if ahocorasick is not None and self.token_index:
+            automaton = ahocorasick.Automaton()
+            for token, posting in self.token_index.items():
+                automaton.add_word(token, posting)
+            automaton.make_automaton()
+            self.token_automaton = automaton
+    
+    def _candidate_indices(self, query_lower: str) -> set:
+        """Codes sharing at least one indexed token with the query"""
+        if self.token_automaton is not None:
+            # One pass over the query finds every indexed token it contains
+            candidates = set()
+            for _, posting in self.token_automaton.iter(query_lower):
+                candidates |= posting
+            return candidates
+        
+        return set().union(*(self.token_index.get(token, ())
+                             for token in _TOKEN_RE.findall(query_lower)))
+    
+    def _substring_indices(self, needle: str) -> np.ndarray:
+        """Indices of codes whose lowercased display contains `needle`"""
+        if not self.codes:
+            return np.zeros(0, dtype=np.intp)
+        return np.flatnonzero(np.char.find(self.codes_np['display_lower'], needle) >= 0)
+    
+    def _display_matches(self, needle: str):
+        """Indices of codes whose lowercased display contains `needle`, in catalogue order"""
+        if len(needle) < 3:
+            yield from self._substring_indices(needle).tolist()
+            return
+        
+        # Every trigram of the needle must occur in a matching display
+        postings = [self.display_trigrams.get(needle[i:i + 3], set())
+                    for i in range(len(needle) - 2)]
+        for i in sorted(set.intersection(*postings)):
+            if needle in self.display_lower[i]:
+                yield i
+    
+    def filter_by_display(self, text: str) -> List[Dict]:
+        """Codes whose display contains `text` (case-insensitive), in catalogue order"""
+        return [self.codes[i] for i in self._display_matches(text.lower())]
+    
+    def filter_valueset(self, filter_lc: str, limit: int = 50) -> List[Dict]:
+        """First `limit` codes whose display contains the already-lowercased `filter_lc`"""
+        return [self.codes[i] for i in islice(self._display_matches(filter_lc), limit)]
     
     def search_codes(self, query: str, limit: int = 10) -> List[Dict]:
-        """Fuzzy search in NAMASTE codes"""
-        from difflib import SequenceMatcher
+        """
+        Fuzzy search in NAMASTE codes
         
-        results = []
+        Only codes sharing a token with the query are scored. Failing that,
+        codes whose display contains the query; if none do (e.g. a misspelled
+        query), every code is scored as before.
+        """
+        scored = []
         query_lower = query.lower()
         
-        for code in self.codes:
-            # Search in display name
-            score1 = SequenceMatcher(None, query_lower, code['display'].lower()).ratio()
-            
-            # Search in synonyms
-            score2 = max([SequenceMatcher(None, query_lower, syn.lower()).ratio() 
-                         for syn in code['synonyms']] + [0])
-            
-            # Search in Sanskrit term
-            score3 = SequenceMatcher(None, query_lower, code['sanskrit'].lower()).ratio()
-            
-            max_score = max(score1, score2, score3)
-            
-            if max_score > 0.3:  # Threshold
-                results.append({
-                    **code,
-                    'match_score': round(max_score, 3)
-                })
+        candidates = self._candidate_indices(query_lower)
+        if candidates:
+            indices = sorted(candidates)
+        else:
+            indices = self._substring_indices(query_lower).tolist() or range(len(self.codes))
+        
+        if process is not None:
+            scored = [(round(score / 100, 3), idx)
+                      for idx, score in self._fuzzy_scores(query_lower, indices).items()
+                      if score > MIN_MATCH_SCORE * 100]
+        else:
+            for idx in indices:
+                max_score = self._match_score(query_lower, idx)
+                if max_score > MIN_MATCH_SCORE:
+                    scored.append((round(max_score, 3), idx))
+        
+        # Sort by score and limit, building result dicts only for the top hits
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return [{**self.codes[idx], 'match_score': score} for score, idx in scored[:limit]]
+    
+    def _fuzzy_scores(self, query_lower: str, indices) -> Dict[int, float]:
+        """
+        Best RapidFuzz ratio (0-100) per code index over display, synonyms and Sanskrit
+        
+        Each field is scored in one process.extract call restricted to the
+        candidate codes; choices are already lowercased, so no processor runs.
+        Codes scoring below the match threshold on every field are left out.
+        """
+        if isinstance(indices, range):
+            displays, sanskrit, synonyms = self.display_lower, self.sanskrit_lower, self.synonyms_lower
+        else:
+            displays = {idx: self.display_lower[idx] for idx in indices}
+            sanskrit = {idx: self.sanskrit_lower[idx] for idx in indices}
+            synonyms = {pos: self.synonyms_lower[pos] for idx in indices
+                        for pos in range(self.synonym_offsets[idx], self.synonym_offsets[idx + 1])}
+        
+        cutoff = MIN_MATCH_SCORE * 100
+        best = {}
+        for choices in (displays, sanskrit):
+            for _, score, idx in process.extract(query_lower, choices, scorer=fuzz.ratio, processor=None,
+                                                 score_cutoff=cutoff, limit=None):
+                if score > best.get(idx, 0):
+                    best[idx] = score
         
-        # Sort by score and limit
-        results.sort(key=lambda x: x['match_score'], reverse=True)
-        return results[:limit]
+        if synonyms:
+            for _, score, pos in process.extract(query_lower, synonyms, scorer=fuzz.ratio, processor=None,
+                                                 score_cutoff=cutoff, limit=None):
+                idx = self.synonym_owner[pos]
+                if score > best.get(idx, 0):
+                    best[idx] = score
+        return best
+    
+    def _match_score(self, query_lower: str, idx: int) -> float:
+        """Best fuzzy similarity of the query to a code's display, synonyms or Sanskrit term"""
+        # Search in display name
+        score1 = _similarity(query_lower, self.display_lower[idx])
+        
+        # Search in synonyms
+        score2 = max([_similarity(query_lower, syn) for syn in
+                      self.synonyms_lower[self.synonym_offsets[idx]:self.synonym_offsets[idx + 1]]] + [0])
+        
+        # Search in Sanskrit term
+        score3 = _similarity(query_lower, self.sanskrit_lower[idx])
+        
+        return max(score1, score2, score3)
     
     def get_code_by_id(self, code_id: str) -> Dict:
         """Get specific code by ID"""
-        for code in self.codes:
-            if code['code'] == code_id:
-                return code
-        return None
\ No newline at end of file
+        return self._by_id.get(code_id)
+    
+    def load_ann_index(self, index_path: str, dim: int = None) -> bool:
+        """Load a persisted ANN index if it is still in sync with the CSV (and embedding dim)"""
+        if faiss is None or not os.path.exists(index_path):
+            return False
+        if os.path.getmtime(index_path) < os.path.getmtime(self.csv_path):
+            return False
+        
+        index = faiss.read_index(index_path)
+        if index.ntotal != len(self.codes) or (dim is not None and index.d != dim):
+            return False
+        
+        self.ann_index = index
+        return True
+    
+    def build_ann_index(self, embeddings: np.ndarray, index_path: str = None):
+        """
+        Build an HNSW index over display embeddings (one row per code)
+        
+        Embeddings are expected to be L2-normalized so inner product equals
+        cosine similarity. The index is written to index_path when given.
+        """
+        if faiss is None:
+            return
+        
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        index = faiss.IndexHNSWFlat(embeddings.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+        index.add(embeddings)
+        self.ann_index = index
+        
+        if index_path:
+            # Write then rename so concurrent workers never read a partial file
+            os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+            tmp_path = f"{index_path}.{os.getpid()}.tmp"
+            faiss.write_index(index, tmp_path)
+            os.replace(tmp_path, index_path)
+    
+    def hybrid_search(self, query: str, query_emb: np.ndarray, limit: int = 10,
+                      semantic_weight: float = 0.5, overfetch: int = 3) -> List[Dict]:
+        """
+        Retrieve candidates from the ANN index and rank by fuzzy + semantic score
+        
+        The index returns limit * overfetch nearest codes; each is given its
+        fuzzy match_score against the query and ranked by the weighted sum.
+        """
+        query_lower = query.lower()
+        
+        candidates = []
+        for score, idx in self._ann_neighbors(query_emb, limit * overfetch):
+            semantic_score = round(score, 4)
+            match_score = round(self._match_score(query_lower, idx), 3)
+            candidates.append({
+                **self.codes[idx],
+                'match_score': match_score,
+                'semantic_score': semantic_score,
+                'combined_score': round(semantic_weight * semantic_score
+                                        + (1 - semantic_weight) * match_score, 4)
+            })
+        
+        candidates.sort(key=lambda c: c['combined_score'], reverse=True)
+        return candidates[:limit]
+    
+    def ann_search(self, query_emb: np.ndarray, k: int = 10) -> List[Dict]:
+        """Top-k codes by embedding similarity from the ANN index"""
+        return [
+            {**self.codes[idx], 'semantic_score': round(score, 4)}
+            for score, idx in self._ann_neighbors(query_emb, k)
+        ]
+    
+    def _ann_neighbors(self, query_emb: np.ndarray, k: int) -> List[Tuple[float, int]]:
+        """(similarity, code index) pairs for the k nearest codes, best first"""
+        if self.ann_index is None:
+            return []
+        
+        query = np.ascontiguousarray(query_emb, dtype=np.float32).reshape(1, -1)
+        scores, ids = self.ann_index.search(query, k)
+        
+        return [(float(score), int(idx)) for score, idx in zip(scores[0], ids[0]) if idx != -1]
@@ -1,6 +1,87 @@
+from dataclasses import dataclass
 from datetime import datetime
 import uuid
-from typing import List, Dict
+from typing import List, Dict, Tuple
+
+import orjson
+
+# Static Condition blocks. Built fresh for each returned resource so callers
+# may edit one Condition without affecting the others; only the serialized
+# skeleton below is shared.
+def _clinical_active() -> Dict:
+    return {
+        'coding': [{
+            'system': 'http://terminology.hl7.org/CodeSystem/condition-clinical',
+            'code': 'active'
+        }]
+    }
+
+def _verification_confirmed() -> Dict:
+    return {
+        'coding': [{
+            'system': 'http://terminology.hl7.org/CodeSystem/condition-ver-status',
+            'code': 'confirmed'
+        }]
+    }
+
+def _category_problem_list() -> List[Dict]:
+    return [{
+        'coding': [{
+            'system': 'http://terminology.hl7.org/CodeSystem/condition-category',
+            'code': 'problem-list-item',
+            'display': 'Problem List Item'
+        }]
+    }]
+
+# ConceptMap group entries as slotted records instead of per-mapping dicts;
+# orjson serializes them directly and field order matches the FHIR output
+@dataclass
+class Target:
+    __slots__ = ('code', 'display', 'equivalence', 'comment')
+    code: str
+    display: str
+    equivalence: str
+    comment: str
+
+@dataclass
+class Element:
+    __slots__ = ('code', 'display', 'target')
+    code: str
+    display: str
+    target: List[Target]
+
+def _condition_template(holes: Tuple[str, ...]) -> List[bytes]:
+    """
+    Serialized Condition skeleton split around its per-resource values
+    
+    Returns len(holes) + 1 fragments; the JSON for each hole's value goes
+    between consecutive fragments, in the order of `holes`.
+    """
+    placeholders = {hole: f"@@{hole}@@" for hole in holes}
+    skeleton = orjson.dumps({
+        'resourceType': 'Condition',
+        'id': placeholders['id'],
+        'clinicalStatus': _clinical_active(),
+        'verificationStatus': _verification_confirmed(),
+        'category': _category_problem_list(),
+        'code': {
+            'coding': placeholders['coding'],
+            'text': placeholders['text']
+        },
+        'subject': {
+            'reference': placeholders['reference']
+        },
+        'recordedDate': placeholders['recordedDate']
+    })
+    
+    fragments = []
+    for hole in holes:
+        head, skeleton = skeleton.split(orjson.dumps(placeholders[hole]), 1)
+        fragments.append(head)
+    fragments.append(skeleton)
+    return fragments
+
+_CONDITION_FRAGMENTS = _condition_template(('id', 'coding', 'text', 'reference', 'recordedDate'))
 
 class FHIRGenerator:
     def __init__(self):
@@ -8,10 +89,9 @@ class FHIRGenerator:
     
     def generate_codesystem(self, namaste_codes: List[Dict]) -> Dict:
         """Generate FHIR CodeSystem for NAMASTE"""
-        concepts = []
-        for code in namaste_codes:
-            # Use .get() for safer access
-            concept = {
+        # Use .get() for safer access
+        concepts = [
+            {
                 'code': code.get('code'),
                 'display': code.get('display'),
                 'definition': code.get('description'),
@@ -26,7 +106,8 @@ class FHIRGenerator:
                     {'code': 'category', 'valueString': code.get('category')}
                 ]
             }
-            concepts.append(concept)
+            for code in namaste_codes
+        ]
         
         codesystem = {
             'resourceType': 'CodeSystem',
@@ -47,37 +128,26 @@ class FHIRGenerator:
         return codesystem
     
     def generate_conceptmap(self, mappings: List[Dict]) -> Dict:
-        """Generate FHIR ConceptMap for NAMASTE ↔ ICD-11"""
-        elements = []
+        """
+        Generate FHIR ConceptMap for NAMASTE ↔ ICD-11
         
-        for mapping in mappings:
-            targets = []
-            
-            # Add TM2 mapping
-            tm2_map = mapping.get('icd11_tm2')
-            if tm2_map: # Check if the key exists and is not empty/null
-                targets.append({
-                    'code': tm2_map.get('code'),
-                    'display': tm2_map.get('display'),
-                    'equivalence': 'equivalent',
-                    'comment': f"Confidence: {tm2_map.get('confidence')}"
-                })
-            
-            # Add biomedicine mapping
-            biomed_map = mapping.get('icd11_biomedicine')
-            if biomed_map:
-                targets.append({
-                    'code': biomed_map.get('code'),
-                    'display': biomed_map.get('display'),
-                    'equivalence': 'relatedto',
-                    'comment': f"Confidence: {biomed_map.get('confidence')}"
-                })
-            
-            elements.append({
-                'code': mapping.get('namaste_code'),
-                'display': mapping.get('namaste_term'), # Use .get() for safety
-                'target': targets
-            })
+        Group elements are Element/Target dataclasses; serialize with to_json.
+        """
+        elements = [
+            Element(
+                mapping.get('namaste_code'),
+                mapping.get('namaste_term'), # Use .get() for safety
+                [
+                    Target(target.get('code'), target.get('display'), equivalence,
+                           f"Confidence: {target.get('confidence')}")
+                    # TM2 mapping, then biomedicine mapping, when present and not empty/null
+                    for target, equivalence in ((mapping.get('icd11_tm2'), 'equivalent'),
+                                                (mapping.get('icd11_biomedicine'), 'relatedto'))
+                    if target
+                ]
+            )
+            for mapping in mappings
+        ]
         
         conceptmap = {
             'resourceType': 'ConceptMap',
@@ -100,12 +170,62 @@ class FHIRGenerator:
         
         return conceptmap
     
+    @staticmethod
+    def to_json(resource: Dict) -> bytes:
+        """Serialize a generated resource (including its dataclass entries) to JSON bytes"""
+        return orjson.dumps(resource, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_DATACLASS)
+    
     # CHANGED: The entire function signature and body was corrected to match your API usage
-    def create_condition(self, namaste_code: str, namaste_display: str, icd_codes: List[str], patient_id: str, abha_id: str = None) -> Dict:
-        """Generate FHIR Condition resource (ProblemList entry)"""
-        condition_id = str(uuid.uuid4())
+    def create_condition(self, namaste_code: str, namaste_display: str, icd_codes: List[str], patient_id: str, abha_id: str = None,
+                         now_iso: str = None) -> Dict:
+        """
+        Generate FHIR Condition resource (ProblemList entry)
         
-        # Start with the NAMASTE code
+        Pass now_iso to share one recordedDate across many resources.
+        """
+        return self._build_condition(namaste_code, namaste_display, icd_codes, patient_id,
+                                     now_iso or datetime.now().isoformat())
+    
+    def create_conditions_bulk(self, items: List[Dict], now_iso: str = None) -> List[Dict]:
+        """
+        Generate many Condition resources sharing one recordedDate
+        
+        Args:
+            items: Dicts of create_condition keyword arguments
+            now_iso: recordedDate for every resource; defaults to now
+        """
+        now_iso = now_iso or datetime.now().isoformat()
+        return [
+            self._build_condition(item['namaste_code'], item['namaste_display'],
+                                  item['icd_codes'], item['patient_id'], now_iso)
+            for item in items
+        ]
+    
+    def create_condition_bytes(self, namaste_code: str, namaste_display: str, icd_codes: List[str],
+                               patient_id: str, now_iso: str = None) -> Tuple[str, bytes]:
+        """
+        Generate a Condition resource directly as JSON bytes
+        
+        Only the per-resource values are serialized; the rest comes from the
+        pre-serialized skeleton. The output equals to_json(create_condition(...)).
+        
+        Returns:
+            (condition id, JSON bytes)
+        """
+        condition_id = str(uuid.uuid4())
+        prefix, after_id, after_coding, after_text, after_reference, suffix = _CONDITION_FRAGMENTS
+        body = b"".join((
+            prefix, orjson.dumps(condition_id),
+            after_id, orjson.dumps(self._condition_coding(namaste_code, namaste_display, icd_codes)),
+            after_coding, orjson.dumps(namaste_display),
+            after_text, orjson.dumps(f'Patient/{patient_id}'),
+            after_reference, orjson.dumps(now_iso or datetime.now().isoformat()),
+            suffix
+        ))
+        return condition_id, body
+    
+    def _condition_coding(self, namaste_code: str, namaste_display: str, icd_codes: List[str]) -> List[Dict]:
+        # Start with the NAMASTE code, then the ICD-11 codes (which are strings from the request)
         coding = [
             {
                 'system': f'{self.base_url}/CodeSystem/namaste',
@@ -113,44 +233,29 @@ class FHIRGenerator:
                 'display': namaste_display
             }
         ]
-        
-        # Add ICD-11 codes (which are strings from the request)
-        for icd_code_str in icd_codes:
-            coding.append({
+        coding += [
+            {
                 'system': 'http://id.who.int/icd/release/11/mms', # Default to mms
                 'code': icd_code_str
-            })
-        
-        condition = {
+            }
+            for icd_code_str in icd_codes
+        ]
+        return coding
+    
+    def _build_condition(self, namaste_code: str, namaste_display: str, icd_codes: List[str],
+                         patient_id: str, recorded_date: str) -> Dict:
+        return {
             'resourceType': 'Condition',
-            'id': condition_id,
-            'clinicalStatus': {
-                'coding': [{
-                    'system': 'http://terminology.hl7.org/CodeSystem/condition-clinical',
-                    'code': 'active'
-                }]
-            },
-            'verificationStatus': {
-                'coding': [{
-                    'system': 'http://terminology.hl7.org/CodeSystem/condition-ver-status',
-                    'code': 'confirmed'
-                }]
-            },
-            'category': [{
-                'coding': [{
-                    'system': 'http://terminology.hl7.org/CodeSystem/condition-category',
-                    'code': 'problem-list-item',
-                    'display': 'Problem List Item'
-                }]
-            }],
+            'id': str(uuid.uuid4()),
+            'clinicalStatus': _clinical_active(),
+            'verificationStatus': _verification_confirmed(),
+            'category': _category_problem_list(),
             'code': {
-                'coding': coding,
+                'coding': self._condition_coding(namaste_code, namaste_display, icd_codes),
                 'text': namaste_display
             },
             'subject': {
                 'reference': f'Patient/{patient_id}'
             },
-            'recordedDate': datetime.now().isoformat()
+            'recordedDate': recorded_date
         }
-        
-        return condition
\ No newline at end of file
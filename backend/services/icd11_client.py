@@ -1,15 +1,50 @@
+import asyncio
 import requests
-import json
+import httpx
+import threading
 from datetime import datetime, timedelta
-from typing import List, Dict
+from typing import List, Dict, Optional
+
+import orjson
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Sent with every WHO ICD-API request
+API_HEADERS = {
+    'Accept': 'application/json',
+    'Accept-Language': 'en',
+    'API-Version': 'v2'
+}
 
 class ICD11Client:
     def __init__(self, credentials_path: str):
-        with open(credentials_path, 'r') as f:
-            self.config = json.load(f)
+        with open(credentials_path, 'rb') as f:
+            self.config = orjson.loads(f.read())
         
         self.access_token = None
         self.token_expiry = None
+        # Headers for the async paths, rebuilt once per token rather than per request
+        self._auth_headers = dict(API_HEADERS)
+        
+        # Keep-alive connections to the WHO API; Authorization is set whenever the token changes
+        self.session = requests.Session()
+        self.session.headers.update(API_HEADERS)
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=10, pool_maxsize=20,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+        ))
+        
+        # Entity details rarely change within a release; cache by entity URI.
+        # Search results are cached for an hour by (query, use_flexisearch).
+        self._entity_cache = TTLCache(maxsize=10_000, ttl=86400)
+        self._search_cache = TTLCache(maxsize=10_000, ttl=3600)
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        
+        # Serializes async token fetches so concurrent requests share one refresh
+        self._token_lock = asyncio.Lock()
     
     def get_access_token(self) -> str:
         """Get OAuth2 access token"""
@@ -24,31 +59,80 @@ class ICD11Client:
             'grant_type': 'client_credentials'
         }
         
-        response = requests.post(
+        response = self.session.post(
             self.config['token_endpoint'],
             data=payload,
+            headers={'Authorization': None},
             verify=True,
             timeout=60  # ADD THIS LINE: Timeout in seconds
         )
         
         if response.status_code == 200:
-            token_data = response.json()
-            self.access_token = token_data['access_token']
+            token_data = orjson.loads(response.content)
+            self._set_token(token_data['access_token'])
             # Token expires in ~3600 seconds
             self.token_expiry = datetime.now() + timedelta(seconds=3500)
             return self.access_token
         else:
             raise Exception(f"Failed to get token: {response.text}")
     
+    def _set_token(self, token: str):
+        self.access_token = token
+        self.session.headers['Authorization'] = f'Bearer {token}'
+        self._auth_headers = {**API_HEADERS, 'Authorization': f'Bearer {token}'}
+    
+    async def refresh_token(self, http_client: Optional[httpx.AsyncClient] = None) -> int:
+        """
+        Fetch a new OAuth2 token asynchronously and cache it on the client
+        
+        Returns:
+            Token lifetime in seconds, so callers can schedule the next refresh
+        """
+        payload = {
+            'client_id': self.config['client_id'],
+            'client_secret': self.config['client_secret'],
+            'scope': 'icdapi_access',
+            'grant_type': 'client_credentials'
+        }
+        
+        owns_client = http_client is None
+        client = http_client or httpx.AsyncClient(timeout=60)
+        try:
+            response = await client.post(self.config['token_endpoint'], data=payload)
+        finally:
+            if owns_client:
+                await client.aclose()
+        
+        if response.status_code != 200:
+            raise Exception(f"Failed to get token: {response.text}")
+        
+        token_data = orjson.loads(response.content)
+        expires_in = int(token_data.get('expires_in', 3600))
+        self._set_token(token_data['access_token'])
+        # Expire locally a little early so requests never carry a stale token
+        self.token_expiry = datetime.now() + timedelta(seconds=max(expires_in - 60, 0))
+        return expires_in
+    
+    async def _get_access_token_async(self, http_client: Optional[httpx.AsyncClient] = None) -> str:
+        """Current token, refreshed at most once across concurrent callers when expired"""
+        if self.access_token and self.token_expiry > datetime.now():
+            return self.access_token
+        async with self._token_lock:
+            if not (self.access_token and self.token_expiry > datetime.now()):
+                await self.refresh_token(http_client)
+        return self.access_token
+    
     def search_icd11(self, query: str, use_flexisearch: bool = True) -> List[Dict]:
         """Search ICD-11 codes using API"""
-        token = self.get_access_token()
-        headers = {
-            'Authorization': f'Bearer {token}',
-            'Accept': 'application/json',
-            'Accept-Language': 'en',
-            'API-Version': 'v2'
-        }
+        cache_key = (query, use_flexisearch)
+        with self._cache_lock:
+            cached = self._search_cache.get(cache_key)
+            if cached is not None:
+                self.cache_hits += 1
+                return cached
+            self.cache_misses += 1
+        
+        self.get_access_token()
         
         # Use flexisearch for better matching
         search_type = 'flexisearch' if use_flexisearch else 'search'
@@ -60,30 +144,119 @@ class ICD11Client:
             'flatResults': True
         }
         
-        response = requests.get(url, headers=headers, 
+        response = self.session.get(url,
             params=params,
             timeout=15  # ADD THIS LINE: Timeout in seconds
         )
         
         if response.status_code == 200:
-            data = response.json()
-            return data.get('destinationEntities', [])
+            data = orjson.loads(response.content)
+            results = data.get('destinationEntities', [])
+            with self._cache_lock:
+                self._search_cache[cache_key] = results
+            return results
         else:
             return []
     
     def get_entity_details(self, entity_uri: str) -> Dict:
         """Get detailed information about an ICD-11 entity"""
-        token = self.get_access_token()
-        headers = {
-            'Authorization': f'Bearer {token}',
-            'Accept': 'application/json',
-            'Accept-Language': 'en',
-            'API-Version': 'v2'
-        }
+        with self._cache_lock:
+            cached = self._entity_cache.get(entity_uri)
+            if cached is not None:
+                self.cache_hits += 1
+                return cached
+            self.cache_misses += 1
         
-        response = requests.get(entity_uri, headers=headers)
+        self.get_access_token()
+        response = self.session.get(entity_uri)
         
         if response.status_code == 200:
-            return response.json()
+            entity = orjson.loads(response.content)
+            with self._cache_lock:
+                self._entity_cache[entity_uri] = entity
+            return entity
         else:
             return None
+    
+    async def search_icd11_async(self, query: str, use_flexisearch: bool = True,
+                                 http_client: Optional[httpx.AsyncClient] = None) -> List[Dict]:
+        """
+        search_icd11 without blocking the event loop, sharing its result cache
+        
+        Pass a shared AsyncClient so many concurrent searches multiplex over
+        pooled (HTTP/2 where available) connections.
+        """
+        cache_key = (query, use_flexisearch)
+        with self._cache_lock:
+            cached = self._search_cache.get(cache_key)
+            if cached is not None:
+                self.cache_hits += 1
+                return cached
+            self.cache_misses += 1
+        
+        await self._get_access_token_async(http_client)
+        search_type = 'flexisearch' if use_flexisearch else 'search'
+        
+        owns_client = http_client is None
+        client = http_client or httpx.AsyncClient(timeout=15)
+        try:
+            response = await client.get(
+                f"{self.config['api_base_url']}/mms/{search_type}",
+                params={'q': query, 'useFlexisearch': use_flexisearch, 'flatResults': True},
+                headers=self._auth_headers
+            )
+        finally:
+            if owns_client:
+                await client.aclose()
+        
+        if response.status_code != 200:
+            return []
+        
+        results = orjson.loads(response.content).get('destinationEntities', [])
+        with self._cache_lock:
+            self._search_cache[cache_key] = results
+        return results
+    
+    async def get_entity_async(self, code: str, linearization: str = 'mms',
+                               http_client: Optional[httpx.AsyncClient] = None) -> Optional[Dict]:
+        """
+        Look up an ICD-11 entity by code without blocking the event loop
+        
+        Resolves the code to its stem entity via the linearization's codeinfo
+        endpoint, then fetches the entity. Pass a shared AsyncClient to reuse
+        pooled connections; otherwise a short-lived client is created.
+        """
+        # Normally pre-fetched by the refresh task
+        await self._get_access_token_async(http_client)
+        headers = self._auth_headers
+        
+        owns_client = http_client is None
+        client = http_client or httpx.AsyncClient(timeout=15)
+        try:
+            response = await client.get(
+                f"{self.config['api_base_url']}/{linearization}/codeinfo/{code}",
+                headers=headers
+            )
+            if response.status_code != 200:
+                return None
+            
+            entity_uri = orjson.loads(response.content).get('stemId')
+            if not entity_uri:
+                return None
+            
+            with self._cache_lock:
+                cached = self._entity_cache.get(entity_uri)
+            if cached is not None:
+                return cached
+            
+            response = await client.get(entity_uri, headers=headers)
+            if response.status_code != 200:
+                return None
+            
+            entity = orjson.loads(response.content)
+            with self._cache_lock:
+                self._entity_cache[entity_uri] = entity
+            return entity
+        finally:
+            if owns_client:
+                await client.aclose()
@@ -1,24 +1,79 @@
-import json
-from typing import List, Dict, Tuple
-from difflib import SequenceMatcher
+import threading
+from typing import Dict, List
+
+import orjson
+from cachetools import TTLCache
 
 class MappingEngine:
-    def __init__(self, mappings_path: str, icd_client, namaste_parser):
-        with open(mappings_path, 'r') as f:
-            loaded_json = json.load(f)
+    def __init__(self, mappings_path: str, icd_client, namaste_parser,
+                 cache_size: int = 4096, cache_ttl_seconds: int = 3600):
+        with open(mappings_path, 'rb') as f:
+            loaded_json = orjson.loads(f.read())
             self.predefined_mappings = loaded_json.get('mappings', [])
         
+        # The frontend expects 'title' as the old API call provided; add it once at load
+        for mapping in self.predefined_mappings:
+            for match in mapping.get('icd11_tm2', []) + mapping.get('icd11_mms', []):
+                match['title'] = match.get('display')
+        self._by_code = {m['namaste_code']: m for m in self.predefined_mappings if m.get('namaste_code')}
+        
         self.icd_client = icd_client
         self.namaste_parser = namaste_parser 
+        
+        # Memoized translations keyed by NAMASTE code
+        self._translation_cache = TTLCache(maxsize=cache_size, ttl=cache_ttl_seconds)
+        self._cache_lock = threading.Lock()
     
     def get_predefined_mapping(self, namaste_code: str) -> Dict:
         """Check if pre-mapped exists"""
-        for mapping in self.predefined_mappings:
-            if mapping.get('namaste_code') == namaste_code:
-                return mapping
-        return None
+        return self._by_code.get(namaste_code)
     
     def translate_namaste_to_icd(self, namaste_code: str) -> Dict:
+        """
+        Translate a NAMASTE code, serving repeat codes from the TTL cache.
+        Callers get their own copy, so re-ranking the match lists is safe.
+        """
+        with self._cache_lock:
+            result = self._translation_cache.get(namaste_code)
+        
+        if result is None:
+            result = self._translate_namaste_to_icd(namaste_code)
+            with self._cache_lock:
+                self._translation_cache[namaste_code] = result
+        
+        return self._copy_result(result)
+    
+    def translate_many(self, namaste_codes: List[str]) -> List[Dict]:
+        """
+        Translate several NAMASTE codes, in input order
+        
+        Cached codes are collected under one lock acquisition and repeated
+        codes are translated once; each position still gets its own copy.
+        """
+        unique_codes = list(dict.fromkeys(namaste_codes))
+        with self._cache_lock:
+            results = {code: self._translation_cache.get(code) for code in unique_codes}
+        
+        # Translations are in-memory lookups, so misses are filled serially
+        missing = {code: self._translate_namaste_to_icd(code)
+                   for code, result in results.items() if result is None}
+        if missing:
+            with self._cache_lock:
+                self._translation_cache.update(missing)
+            results.update(missing)
+        
+        return [self._copy_result(results[code]) for code in namaste_codes]
+    
+    @staticmethod
+    def _copy_result(result: Dict) -> Dict:
+        """Copy a cached translation down to the individual match dicts"""
+        copied = dict(result)
+        for key in ('icd11_tm2_matches', 'icd11_biomedicine_matches'):
+            if key in copied:
+                copied[key] = [dict(match) for match in copied[key]]
+        return copied
+    
+    def _translate_namaste_to_icd(self, namaste_code: str) -> Dict:
         """
         Main translation function.
         CHANGED: This function now ONLY uses the predefined mappings from concept_mappings.json.
@@ -35,15 +90,11 @@ class MappingEngine:
         if predefined:
             # FIXED: Correctly reads 'icd11_mms' from your JSON file.
             # The frontend expects 'icd11_biomedicine_matches', so we rename the key here for consistency.
+            # Matches already carry 'title' (added at load); translate_namaste_to_icd copies them per caller
             tm2_matches = predefined.get('icd11_tm2', [])
             biomedicine_matches = predefined.get('icd11_mms', [])
 
             # To maintain compatibility with the frontend, let's rename the keys in the final output.
-            # We also need to add 'title' to match what the old API call provided.
-            for match in tm2_matches:
-                match['title'] = match.get('display')
-            for match in biomedicine_matches:
-                match['title'] = match.get('display')
 
             return {
                 'namaste': namaste_data,
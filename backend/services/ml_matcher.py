@@ -3,50 +3,402 @@ ML-Based Semantic Matching using BioBERT
 Provides advanced semantic similarity for NAMASTE-ICD11 mapping
 """
 
-from sentence_transformers import SentenceTransformer, util
 import numpy as np
 from typing import List, Dict, Tuple
+import hashlib
 import pickle
 import os
+import re
+import threading
+
+# torch and sentence_transformers are imported with the model on first use (see SemanticMatcher.model)
+torch = None
+
+# Set to skip loading (and downloading) the model entirely, e.g. in CI
+ML_MATCHER_DISABLED = os.environ.get('ML_MATCHER_DISABLED') == '1'
+
+# Set-bit count for every possible byte, used for Hamming distance on packed sign bits
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first; ties keep their original order"""
+    if k >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    if k <= 0:
+        return np.zeros(0, dtype=np.intp)
+    top = np.sort(np.argpartition(-scores, k - 1)[:k])
+    return top[np.argsort(-scores[top], kind='stable')]
 
 class SemanticMatcher:
-    def __init__(self, model_name: str = 'dmis-lab/biobert-base-cased-v1.2'):
+    def __init__(self, model_name: str = 'dmis-lab/biobert-base-cased-v1.2',
+                 precision: str = None):
         """
         Initialize BioBERT model for biomedical text similarity
         Falls back to lighter model if BioBERT unavailable
+        
+        The model is loaded on first use of `model`, not here.
+        
+        precision is "int8" (dynamic quantization, CPU only), "fp16" (CUDA
+        only) or "fp32"; it defaults to ML_PRECISION, else int8 unless
+        ML_QUANTIZE=0. Unsupported combinations keep FP32.
         """
-        try:
-            self.model = SentenceTransformer(model_name)
-            print(f"✅ Loaded BioBERT model: {model_name}")
-        except Exception as e:
-            print(f"⚠️ BioBERT unavailable, using fallback model: {e}")
-            self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        if precision is None:
+            precision = os.environ.get(
+                'ML_PRECISION', 'int8' if os.environ.get('ML_QUANTIZE', '1') == '1' else 'fp32'
+            )
+        self._model_name = model_name
+        self._requested_precision = precision
+        self._model = None
+        self._model_lock = threading.Lock()
+        
+        # Model and precision in effect, known once the model is loaded
+        self.model_name = None
+        self.precision = None
+        self.quantized = False
         
         self.cache_dir = 'ml_models/embeddings_cache'
         os.makedirs(self.cache_dir, exist_ok=True)
+        # blake2b(text) -> embedding; persisted as an fp16 matrix plus key -> row index
         self.embeddings_cache = {}
+        self.cached_matrix = None
+        self.cached_rows = {}
+        # Text -> normalized numpy embedding for the batched candidate scorers
+        self.batch_cache = {}
+        
+        # Full-precision catalogue embeddings, one row per key (see build_catalog_embeddings)
+        self.catalog_embeddings = None
+        self.catalog_rows = {}
+        
+        # ICD-11 candidate entries and their embeddings, one row each (see build_catalog)
+        self.icd_catalog_embeddings = None
+        self.icd_catalog_entries = []
+        
+        # 1-bit quantized embeddings for coarse re-ranking (see build_binary_index)
+        self.binary_codes = None
+        self.binary_rows = {}
+        self.binary_dim = 0
+    
+    @property
+    def model(self):
+        """The SentenceTransformer, loaded (and converted to the requested precision) on first access"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._load_model()
+        return self._model
+    
+    def _load_model(self):
+        global torch
+        if ML_MATCHER_DISABLED:
+            raise RuntimeError("Semantic matching is disabled (ML_MATCHER_DISABLED=1)")
+        
+        from sentence_transformers import SentenceTransformer
+        try:
+            import torch
+        except ImportError:  # Model stays in FP32
+            torch = None
+        
+        if torch is not None:
+            # Split the cores between uvicorn workers instead of each claiming all of them;
+            # WORKERS defaults as in api/app.py
+            cpus = os.cpu_count() or 1
+            workers = max(1, int(os.environ.get('WORKERS', cpus)))
+            torch.set_num_threads(max(1, cpus // workers))
+        
+        try:
+            self._model = SentenceTransformer(self._model_name)
+            self.model_name = self._model_name
+            print(f"✅ Loaded BioBERT model: {self._model_name}")
+        except Exception as e:
+            print(f"⚠️ BioBERT unavailable, using fallback model: {e}")
+            self._model = SentenceTransformer('all-MiniLM-L6-v2')
+            self.model_name = 'all-MiniLM-L6-v2'
+        
+        self.precision = self._convert_precision(self._requested_precision)
+        self.quantized = self.precision == 'int8'
+    
+    def _convert_precision(self, precision: str) -> str:
+        """Convert the model to the requested precision, returning the one in effect"""
+        if precision == 'int8' and self._quantize_model():
+            return 'int8'
+        if precision == 'fp16' and self._model.device.type == 'cuda':
+            self._model.half()
+            print("✅ Converted model to fp16 for GPU inference")
+            return 'fp16'
+        return 'fp32'
+    
+    def _quantize_model(self) -> bool:
+        """Swap Linear layers for int8 dynamic-quantized ones; keeps FP32 on failure"""
+        if torch is None or self._model.device.type != 'cpu':
+            return False
+        try:
+            self._model = torch.quantization.quantize_dynamic(
+                self._model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        except Exception as e:
+            print(f"⚠️ int8 quantization unavailable, keeping FP32 model: {e}")
+            return False
+        print("✅ Quantized model to int8 for CPU inference")
+        return True
     
     def encode_text(self, text: str) -> np.ndarray:
-        """Generate embedding for given text"""
-        # Check cache first
-        cache_key = hash(text)
+        """Generate (L2-normalized) float32 embedding for given text"""
+        # Check cache first (stable across restarts, unlike hash())
+        cache_key = self._cache_key(text)
         if cache_key in self.embeddings_cache:
             return self.embeddings_cache[cache_key]
         
+        row = self.cached_rows.get(cache_key)
+        if row is not None:
+            # Served without loading the model; same dtype as freshly encoded rows
+            embedding = np.asarray(self.cached_matrix[row], dtype=np.float32)
+            self.embeddings_cache[cache_key] = embedding
+            return embedding
+        
         # Generate new embedding
-        embedding = self.model.encode(text, convert_to_tensor=True)
+        embedding = self._encode(text, convert_to_numpy=True, normalize_embeddings=True)
         self.embeddings_cache[cache_key] = embedding
         
         return embedding
     
+    def _encode(self, texts, **kwargs):
+        """model.encode under torch.inference_mode, skipping autograd version tracking"""
+        model = self.model  # Loads the model, and with it torch
+        if torch is None:
+            return model.encode(texts, **kwargs)
+        with torch.inference_mode():
+            return model.encode(texts, **kwargs)
+    
+    @staticmethod
+    def _cache_key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+    
     def compute_similarity(self, text1: str, text2: str) -> float:
         """Compute semantic similarity between two texts"""
         emb1 = self.encode_text(text1)
         emb2 = self.encode_text(text2)
         
-        similarity = util.pytorch_cos_sim(emb1, emb2).item()
+        # Unit-length embeddings, so cosine similarity is the dot product
+        similarity = float((emb1 * emb2).sum())
         return round(similarity, 4)
     
+    def encode_batch(self, texts: List[str]) -> np.ndarray:
+        """Encode many texts in one batched forward pass (L2-normalized)"""
+        return self._encode(
+            list(texts),
+            batch_size=64,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+    
+    def encode_cached(self, texts: List[str]) -> np.ndarray:
+        """
+        Normalized embeddings for texts, encoding only those not seen before
+        
+        Unseen texts go through encode_batch together; the rest are stacked
+        from batch_cache, which is keyed by the text itself.
+        """
+        missing = list(dict.fromkeys(text for text in texts if text not in self.batch_cache))
+        if missing:
+            self.batch_cache.update(zip(missing, self.encode_batch(missing)))
+        return np.stack([self.batch_cache[text] for text in texts])
+    
+    def compute_similarities_batch(self, query: str, texts: List[str]) -> np.ndarray:
+        """
+        Compute semantic similarity of one query against many texts
+        
+        Texts not encoded before (e.g. ICD titles outside build_catalog) go
+        through a single batched forward pass; all are then scored with one
+        matrix product on normalized embeddings.
+        
+        Returns:
+            Array of cosine similarities aligned with `texts`
+        """
+        if not texts:
+            return np.zeros(0, dtype=np.float32)
+        
+        embeddings = self.encode_cached([query] + list(texts))
+        query_emb, cand_embs = embeddings[0], embeddings[1:]
+        
+        return np.round(cand_embs @ query_emb, 4)
+    
+    def compute_similarities_grouped(self, groups: List[Tuple[str, List[str]]]) -> List[np.ndarray]:
+        """
+        Score several (query, texts) groups with a single batched encode
+        
+        Every query and candidate across all groups not encoded before goes
+        through one forward pass; the embeddings are then split back per group.
+        
+        Returns:
+            One array of cosine similarities per group, aligned with its texts
+        """
+        texts = []
+        for query, candidates in groups:
+            texts.append(query)
+            texts.extend(candidates)
+        if not texts:
+            return []
+        
+        embeddings = self.encode_cached(texts)
+        
+        scores = []
+        pos = 0
+        for _, candidates in groups:
+            query_emb = embeddings[pos]
+            cand_embs = embeddings[pos + 1:pos + 1 + len(candidates)]
+            scores.append(np.round(cand_embs @ query_emb, 4))
+            pos += 1 + len(candidates)
+        
+        return scores
+    
+    @staticmethod
+    def _candidate_text(entry: Dict) -> str:
+        """Text embedded for an ICD-11 entry: display plus definition when present"""
+        return " ".join(filter(None, (entry.get('display'), entry.get('definition'))))
+    
+    def build_catalog(self, entries: List[Dict]) -> np.ndarray:
+        """
+        Pre-encode a static ICD-11 candidate catalogue
+        
+        The embeddings land in batch_cache, so re-ranking any of these entries
+        (hybrid_match, find_best_matches, compute_similarities_batch with their
+        displays) encodes only the query; match_against_catalog scores the
+        whole catalogue with one matrix product.
+        """
+        self.icd_catalog_entries = list(entries)
+        if not entries:
+            self.icd_catalog_embeddings = None
+            return None
+        
+        embeddings = self.encode_cached([self._candidate_text(entry) for entry in entries])
+        self.icd_catalog_embeddings = embeddings.astype(np.float32)
+        return self.icd_catalog_embeddings
+    
+    def match_against_catalog(self, query: str, top_k: int = 5) -> List[Dict]:
+        """Top-k catalogue entries by cosine similarity to the query"""
+        if self.icd_catalog_embeddings is None:
+            return []
+        
+        scores = self.icd_catalog_embeddings @ self.encode_cached([query])[0]
+        return [
+            {**self.icd_catalog_entries[i], 'similarity': round(float(scores[i]), 4), 'match_type': 'semantic'}
+            for i in _top_k(scores, top_k)
+        ]
+    
+    def build_catalog_embeddings(self, keys: List[str], texts: List[str],
+                                 path: str = None, source_path: str = None) -> np.ndarray:
+        """
+        Precompute normalized float32 embeddings for a static catalogue
+        
+        The file actually used is `path` with the loaded model's name and
+        embedding dimension added to its name, so a model change never reuses
+        another model's vectors. When it holds a matrix with one row per key,
+        is at least as new as `source_path` and has the model's dimension it is
+        memory-mapped instead of re-encoding; otherwise the texts are encoded
+        and saved there.
+        
+        Args:
+            keys: Identifier for each text (e.g. NAMASTE code)
+            texts: Text to embed for each key
+            path: Optional .npy file to load from / save to
+            source_path: Optional file the texts were read from (e.g. the CSV)
+        """
+        embeddings = None
+        if path:
+            dim = self.model.get_sentence_embedding_dimension()
+            slug = re.sub(r'[^A-Za-z0-9.-]+', '_', self.model_name)
+            root, ext = os.path.splitext(path)
+            path = f"{root}.{slug}-{dim}{ext}"
+            
+            fresh = os.path.exists(path) and (
+                source_path is None or os.path.getmtime(path) >= os.path.getmtime(source_path)
+            )
+            if fresh:
+                embeddings = np.load(path, mmap_mode='r')
+                if embeddings.shape != (len(keys), dim):
+                    embeddings = None
+        
+        if embeddings is None:
+            embeddings = self.encode_batch(texts).astype(np.float32)
+            if path:
+                # Write then rename so concurrent workers never map a partial file
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, embeddings)
+                os.replace(tmp_path, path)
+        
+        self.catalog_embeddings = embeddings
+        self.catalog_rows = {key: row for row, key in enumerate(keys)}
+        return embeddings
+    
+    def score_candidates(self, query: str, keys: List[str], texts: List[str]) -> np.ndarray:
+        """
+        Cosine similarity of a query against candidates, using catalogue rows where known
+        
+        Only the query (and any candidate missing from the catalogue) goes
+        through the model; known candidates are a row lookup and a dot product.
+        
+        Returns:
+            Array of cosine similarities aligned with `keys`
+        """
+        if not keys:
+            return np.zeros(0, dtype=np.float32)
+        
+        missing = [i for i, key in enumerate(keys) if key not in self.catalog_rows]
+        embeddings = self.encode_batch([query] + [texts[i] for i in missing])
+        query_emb = embeddings[0]
+        
+        cand_embs = np.empty((len(keys), query_emb.shape[0]), dtype=np.float32)
+        known = [i for i, key in enumerate(keys) if key in self.catalog_rows]
+        if known:
+            cand_embs[known] = self.catalog_embeddings[[self.catalog_rows[keys[i]] for i in known]]
+        if missing:
+            cand_embs[missing] = embeddings[1:]
+        
+        return np.round(cand_embs @ query_emb, 4)
+    
+    def build_binary_index(self, keys: List[str], texts: List[str], embeddings: np.ndarray = None):
+        """
+        Precompute sign-bit (1-bit) embeddings for a static catalogue
+        
+        Args:
+            keys: Identifier for each text (e.g. NAMASTE code)
+            texts: Text to embed for each key
+            embeddings: Already-computed embeddings for texts, if available
+        """
+        if embeddings is None:
+            embeddings = self.encode_batch(texts)
+        self.binary_codes = np.packbits(embeddings > 0, axis=1)
+        self.binary_rows = {key: row for row, key in enumerate(keys)}
+        self.binary_dim = embeddings.shape[1]
+    
+    def binary_similarities(self, query_text: str, candidate_keys: List[str]) -> np.ndarray:
+        """
+        Approximate cosine similarity using Hamming distance on sign bits
+        
+        Candidates are looked up in the index built by build_binary_index;
+        unknown keys score 0. The Hamming distance h over d bits is mapped to
+        an angle estimate via cos(pi * h / d) so scores share the cosine scale.
+        """
+        scores = np.zeros(len(candidate_keys), dtype=np.float32)
+        if self.binary_codes is None or not candidate_keys:
+            return scores
+        
+        positions = [i for i, key in enumerate(candidate_keys) if key in self.binary_rows]
+        if not positions:
+            return scores
+        rows = [self.binary_rows[candidate_keys[i]] for i in positions]
+        
+        query_emb = self._encode(query_text, convert_to_numpy=True, normalize_embeddings=True)
+        query_bits = np.packbits(query_emb > 0)
+        
+        xor = np.bitwise_xor(self.binary_codes[rows], query_bits)
+        hamming = _POPCOUNT_TABLE[xor].sum(axis=1, dtype=np.int32)
+        scores[positions] = np.cos(np.pi * hamming / self.binary_dim)
+        
+        return np.round(scores, 4)
+    
     def find_best_matches(self, 
                          query_text: str, 
                          candidate_texts: List[Dict[str, str]], 
@@ -62,26 +414,26 @@ class SemanticMatcher:
         Returns:
             List of matches with similarity scores
         """
-        query_embedding = self.encode_text(query_text)
+        if not candidate_texts:
+            return []
         
-        matches = []
-        for candidate in candidate_texts:
-            # Combine code display and description for better matching
-            candidate_text = f"{candidate.get('display', '')} {candidate.get('definition', '')}"
-            candidate_embedding = self.encode_text(candidate_text)
-            
-            similarity = util.pytorch_cos_sim(query_embedding, candidate_embedding).item()
-            
-            matches.append({
-                'code': candidate.get('code'),
-                'display': candidate.get('display'),
-                'similarity': round(similarity, 4),
-                'match_type': 'semantic'
-            })
+        # Combine code display and description for better matching
+        embeddings = self.encode_cached([query_text] + [
+            self._candidate_text(candidate)
+            for candidate in candidate_texts
+        ])
+        similarities = np.round(embeddings[1:] @ embeddings[0], 4)
         
-        # Sort by similarity and return top-k
-        matches.sort(key=lambda x: x['similarity'], reverse=True)
-        return matches[:top_k]
+        # Top-k by similarity, keeping candidate order among ties
+        return [
+            {
+                'code': candidate_texts[i].get('code'),
+                'display': candidate_texts[i].get('display'),
+                'similarity': float(similarities[i]),
+                'match_type': 'semantic'
+            }
+            for i in _top_k(similarities, top_k)
+        ]
     
     def hybrid_match(self, 
                     namaste_term: Dict, 
@@ -105,18 +457,21 @@ class SemanticMatcher:
         if namaste_term.get('synonyms'):
             query_text += " " + " ".join(namaste_term['synonyms'])
         
-        query_embedding = self.encode_text(query_text)
+        if not icd_candidates:
+            return []
+        
+        # One batched encode for the query and every candidate not cached yet
+        embeddings = self.encode_cached([query_text] + [
+            self._candidate_text(candidate)
+            for candidate in icd_candidates
+        ])
+        semantic_scores = embeddings[1:] @ embeddings[0]
         
         enhanced_candidates = []
-        for candidate in icd_candidates:
+        for candidate, semantic_score in zip(icd_candidates, semantic_scores.tolist()):
             # Get fuzzy score (if already computed)
             fuzzy_score = candidate.get('confidence', 0.5)
             
-            # Compute semantic score
-            candidate_text = f"{candidate.get('display', '')} {candidate.get('definition', '')}"
-            candidate_embedding = self.encode_text(candidate_text)
-            semantic_score = util.pytorch_cos_sim(query_embedding, candidate_embedding).item()
-            
             # Hybrid score
             hybrid_score = (fuzzy_score * fuzzy_score_weight + 
                           semantic_score * semantic_score_weight)
@@ -135,25 +490,61 @@ class SemanticMatcher:
         return enhanced_candidates
     
     def save_cache(self, filepath: str = None):
-        """Save embeddings cache to disk"""
+        """
+        Save embeddings cache to disk
+        
+        Embeddings go to a float16 .npy matrix next to `filepath`, which holds
+        only the pickled key -> row index; both are written atomically.
+        """
         if filepath is None:
-            filepath = os.path.join(self.cache_dir, 'embeddings_cache.pkl')
+            filepath = os.path.join(self.cache_dir, 'embeddings_index.pkl')
+        matrix_path = os.path.splitext(filepath)[0] + '.npy'
         
-        with open(filepath, 'wb') as f:
-            pickle.dump(self.embeddings_cache, f)
+        rows = dict(self.cached_rows)
+        vectors = [self.cached_matrix] if self.cached_matrix is not None else []
+        new_keys = [key for key in self.embeddings_cache if key not in rows]
+        if new_keys:
+            vectors.append(np.stack([self._to_numpy(self.embeddings_cache[key]) for key in new_keys]))
+            rows.update((key, len(rows) + i) for i, key in enumerate(new_keys))
+        if not vectors:
+            return
+        
+        matrix = np.concatenate(vectors).astype(np.float16)
+        for path, write in ((matrix_path, lambda f: np.save(f, matrix)),
+                            (filepath, lambda f: pickle.dump(rows, f))):
+            # Write then rename so a concurrent load never sees a partial file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        
+        self.cached_matrix = np.load(matrix_path, mmap_mode='r')
+        self.cached_rows = rows
         print(f"💾 Saved embeddings cache to {filepath}")
     
     def load_cache(self, filepath: str = None):
-        """Load embeddings cache from disk"""
+        """Memory-map an embeddings cache written by save_cache"""
         if filepath is None:
-            filepath = os.path.join(self.cache_dir, 'embeddings_cache.pkl')
+            filepath = os.path.join(self.cache_dir, 'embeddings_index.pkl')
+        matrix_path = os.path.splitext(filepath)[0] + '.npy'
         
-        if os.path.exists(filepath):
+        if os.path.exists(filepath) and os.path.exists(matrix_path):
             with open(filepath, 'rb') as f:
-                self.embeddings_cache = pickle.load(f)
+                rows = pickle.load(f)
+            matrix = np.load(matrix_path, mmap_mode='r')
+            if matrix.shape[0] != len(rows):
+                print("⚠️ Embeddings cache index does not match its matrix, starting fresh")
+                return
+            self.cached_matrix, self.cached_rows = matrix, rows
             print(f"📂 Loaded embeddings cache from {filepath}")
         else:
             print("ℹ️ No cache file found, starting fresh")
+    
+    @staticmethod
+    def _to_numpy(embedding) -> np.ndarray:
+        if torch is not None and isinstance(embedding, torch.Tensor):
+            return embedding.detach().cpu().numpy()
+        return np.asarray(embedding)
 
 
 # Example usage
@@ -0,0 +1,98 @@
+"""
+Two-tier response cache for terminology endpoints
+Exact matches by request key, plus semantic matches by query embedding
+"""
+
+import threading
+import time
+from typing import Dict, Hashable, Optional
+
+import numpy as np
+from cachetools import TTLCache
+
+try:
+    from prometheus_client import Counter
+except ImportError:  # Hit counts are still kept on the cache instance
+    Counter = None
+
+if Counter is not None:
+    CACHE_EXACT_HITS = Counter('cache_exact_hits', 'Responses served from the exact-match cache')
+    CACHE_SEMANTIC_HITS = Counter('cache_semantic_hits', 'Responses served from the semantic cache')
+else:
+    CACHE_EXACT_HITS = CACHE_SEMANTIC_HITS = None
+
+class ResponseCache:
+    def __init__(self, maxsize: int = 4096, ttl_seconds: int = 7 * 24 * 3600,
+                 semantic_size: int = 1024, semantic_threshold: float = 0.92):
+        self.ttl_seconds = ttl_seconds
+        self.semantic_threshold = semantic_threshold
+        
+        self._exact = TTLCache(maxsize=maxsize, ttl=ttl_seconds)
+        
+        # Ring buffer of normalized query embeddings and their responses
+        self._semantic_size = semantic_size
+        self._semantic_embs = None
+        self._semantic_entries = [None] * semantic_size  # (partition, response, stored_at)
+        self._next_slot = 0
+        
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+    
+    def get(self, key: Hashable) -> Optional[Dict]:
+        """Cached response for an exact request key"""
+        with self._lock:
+            response = self._exact.get(key)
+            if response is not None:
+                self.exact_hits += 1
+        
+        if response is not None and CACHE_EXACT_HITS is not None:
+            CACHE_EXACT_HITS.inc()
+        return response
+    
+    def set(self, key: Hashable, response: Dict):
+        with self._lock:
+            self._exact[key] = response
+    
+    def get_similar(self, partition: Hashable, query_emb: np.ndarray) -> Optional[Dict]:
+        """
+        Cached response for the most similar earlier query in the same partition
+        
+        The partition holds the request parameters other than the query text
+        (e.g. limit, use_ml); only entries with cosine similarity of at least
+        semantic_threshold and younger than the TTL are returned.
+        """
+        with self._lock:
+            if self._semantic_embs is None:
+                return None
+            
+            sims = self._semantic_embs @ np.asarray(query_emb, dtype=np.float32)
+            candidates = np.flatnonzero(sims >= self.semantic_threshold)
+            now = time.monotonic()
+            
+            response = None
+            for slot in candidates[np.argsort(-sims[candidates])]:
+                entry = self._semantic_entries[slot]
+                if entry is None or entry[0] != partition or now - entry[2] > self.ttl_seconds:
+                    continue
+                response = entry[1]
+                self.semantic_hits += 1
+                break
+        
+        if response is None:
+            return None
+        if CACHE_SEMANTIC_HITS is not None:
+            CACHE_SEMANTIC_HITS.inc()
+        return response
+    
+    def add_similar(self, partition: Hashable, query_emb: np.ndarray, response: Dict):
+        """Remember a response under its query embedding, overwriting the oldest slot"""
+        query_emb = np.asarray(query_emb, dtype=np.float32)
+        with self._lock:
+            if self._semantic_embs is None:
+                self._semantic_embs = np.zeros((self._semantic_size, query_emb.shape[0]), dtype=np.float32)
+            
+            slot = self._next_slot
+            self._semantic_embs[slot] = query_emb
+            self._semantic_entries[slot] = (partition, response, time.monotonic())
+            self._next_slot = (slot + 1) % self._semantic_size
@@ -0,0 +1,158 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+
+from services.audit_service import AuditService
+
+# Schema of databases created before hit_count / query_tags and the
+# analytics_summary API-call columns existed (e.g. the shipped data/audit_logs.db)
+PRE_SERIES_SCHEMA = '''
+CREATE TABLE audit_logs (
+    id TEXT PRIMARY KEY,
+    timestamp DATETIME NOT NULL,
+    user_id TEXT,
+    user_role TEXT,
+    action_type TEXT NOT NULL,
+    resource_type TEXT,
+    resource_id TEXT,
+    endpoint TEXT,
+    method TEXT,
+    ip_address TEXT,
+    user_agent TEXT,
+    request_body TEXT,
+    response_status INTEGER,
+    response_time_ms FLOAT,
+    consent_status TEXT,
+    abha_id TEXT,
+    error_message TEXT,
+    metadata TEXT,
+    checksum TEXT NOT NULL
+);
+CREATE TABLE search_history (
+    id TEXT PRIMARY KEY,
+    timestamp DATETIME NOT NULL,
+    user_id TEXT,
+    search_query TEXT NOT NULL,
+    results_count INTEGER,
+    top_result_code TEXT,
+    session_id TEXT
+);
+CREATE TABLE translation_history (
+    id TEXT PRIMARY KEY,
+    timestamp DATETIME NOT NULL,
+    user_id TEXT,
+    namaste_code TEXT NOT NULL,
+    icd11_tm2_code TEXT,
+    icd11_bio_code TEXT,
+    confidence_tm2 FLOAT,
+    confidence_bio FLOAT,
+    mapping_method TEXT,
+    accepted BOOLEAN
+);
+CREATE TABLE analytics_summary (
+    date DATE PRIMARY KEY,
+    total_searches INTEGER DEFAULT 0,
+    total_translations INTEGER DEFAULT 0,
+    total_fhir_resources INTEGER DEFAULT 0,
+    unique_users INTEGER DEFAULT 0,
+    avg_response_time_ms FLOAT,
+    top_searched_terms TEXT
+);
+CREATE TABLE fhir_resource_logs (
+    id TEXT PRIMARY KEY,
+    timestamp DATETIME NOT NULL,
+    user_id TEXT,
+    resource_type TEXT,
+    resource_id TEXT,
+    patient_id TEXT,
+    codes TEXT
+);
+INSERT INTO search_history (id, timestamp, user_id, search_query, results_count)
+VALUES ('s1', '2024-01-01 10:00:00', 'u1', 'fever', 3),
+       ('s2', '2024-01-01 10:05:00', 'u2', 'fever', 3);
+INSERT INTO audit_logs (id, timestamp, user_id, action_type, response_status, checksum)
+VALUES ('a1', '2019-06-01 09:00:00', 'u1', 'SEARCH', 200, 'x'),
+       ('a2', '2024-01-01 10:00:00', 'u1', 'SEARCH', 200, 'x');
+INSERT INTO translation_history (id, timestamp, user_id, namaste_code)
+VALUES ('t1', '2024-01-01 10:10:00', 'u1', 'NAM0001');
+'''
+
+
+class PreSeriesDatabaseTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, 'audit_logs.db')
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript(PRE_SERIES_SCHEMA)
+        conn.close()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_opens_and_migrates_old_schema(self):
+        service = AuditService(self.db_path)
+        service._conn.close()
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            search_columns = {row[1] for row in conn.execute('PRAGMA table_info(search_history)')}
+            translation_columns = {row[1] for row in conn.execute('PRAGMA table_info(translation_history)')}
+            indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        finally:
+            conn.close()
+
+        self.assertTrue({'hit_count', 'query_tags'} <= search_columns)
+        self.assertIn('hit_count', translation_columns)
+        self.assertTrue({'idx_search_query', 'idx_trans_code'} <= indexes)
+
+    def test_existing_history_counts_after_migration(self):
+        service = AuditService(self.db_path)
+        summary = service.get_analytics_summary()
+        service._conn.close()
+
+        self.assertEqual(summary['total_searches'], 2)
+        self.assertEqual(summary['top_searches'][0], {'query': 'fever', 'count': 2})
+        self.assertEqual(summary['top_translations'][0], {'code': 'NAM0001', 'count': 1})
+
+
+    def test_export_filters_by_date(self):
+        service = AuditService(self.db_path)
+        logs = list(service.iter_export_logs(datetime(2020, 1, 1), None))
+        service._conn.close()
+
+        self.assertEqual([log['id'] for log in logs], ['a2'])
+
+
+
+class SharedDatabaseTopCountsTest(unittest.TestCase):
+    """Two workers on one database must report the same rankings"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(self.tmpdir.name, 'audit_logs.db')
+        self.writer = AuditService(db_path, in_memory_top=False)
+        self.reader = AuditService(db_path, in_memory_top=False)
+
+    def tearDown(self):
+        self.writer._conn.close()
+        self.reader._conn.close()
+        self.tmpdir.cleanup()
+
+    def test_rankings_include_other_workers_writes(self):
+        for _ in range(3):
+            self.writer.log_search('u1', 'amavata', 5)
+            self.writer.log_translation('u1', 'NAM0042')
+        self.writer.flush()
+
+        summary = self.reader.get_analytics_summary()
+        self.assertEqual(summary['top_searches'], [{'query': 'amavata', 'count': 3}])
+        self.assertEqual(summary['top_translations'], [{'code': 'NAM0042', 'count': 3}])
+
+        stats = self.reader.get_dashboard_stats()
+        self.assertEqual(stats['popular_codes'], [{'code': 'NAM0042', 'count': 3}])
+
+
+if __name__ == '__main__':
+    unittest.main()
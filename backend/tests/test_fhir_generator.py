@@ -0,0 +1,32 @@
+import unittest
+
+from services.fhir_generator import FHIRGenerator
+
+
+class ConditionTest(unittest.TestCase):
+    def setUp(self):
+        self.fhir_gen = FHIRGenerator()
+
+    def create(self):
+        return self.fhir_gen.create_condition('NAM0001', 'Jvara', ['1D01'], 'P001',
+                                              now_iso='2024-01-01T00:00:00')
+
+    def test_conditions_do_not_share_static_blocks(self):
+        first = self.create()
+        first['category'].append({'text': 'extra'})
+        first['clinicalStatus']['coding'][0]['code'] = 'resolved'
+
+        second = self.create()
+        self.assertEqual(len(second['category']), 1)
+        self.assertEqual(second['clinicalStatus']['coding'][0]['code'], 'active')
+
+    def test_bytes_match_dict_serialization(self):
+        condition = self.create()
+        condition_id, body = self.fhir_gen.create_condition_bytes(
+            'NAM0001', 'Jvara', ['1D01'], 'P001', now_iso='2024-01-01T00:00:00')
+        condition['id'] = condition_id
+        self.assertEqual(body, self.fhir_gen.to_json(condition))
+
+
+if __name__ == '__main__':
+    unittest.main()
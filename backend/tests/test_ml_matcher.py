@@ -0,0 +1,36 @@
+import os
+import tempfile
+import unittest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+@unittest.skipIf(np is None, "numpy not installed")
+class EncodeTextCacheTest(unittest.TestCase):
+    def setUp(self):
+        from services.ml_matcher import SemanticMatcher
+
+        # SemanticMatcher creates its cache directory relative to the cwd
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tmpdir.name)
+        self.matcher = SemanticMatcher()
+
+    def test_cached_rows_are_numpy_without_loading_model(self):
+        self.matcher.cached_matrix = np.array([[0.6, 0.8]], dtype=np.float16)
+        self.matcher.cached_rows = {self.matcher._cache_key('fever'): 0}
+
+        embedding = self.matcher.encode_text('fever')
+
+        self.assertIsInstance(embedding, np.ndarray)
+        self.assertEqual(embedding.dtype, np.float32)
+        self.assertIsNone(self.matcher._model)
+        self.assertAlmostEqual(self.matcher.compute_similarity('fever', 'fever'), 1.0, places=3)
+
+
+if __name__ == '__main__':
+    unittest.main()